@@ -0,0 +1,50 @@
+'''
+Microbenchmark of Tello state parsing
+Compares old dict of str parsing (plus int() of every value in the consumer)
+with ryze_tello.parse_tello_state filling preallocated TelloState in place
+
+Usage: python benchmarks/bench_state_parser.py [number]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+
+_STATE = (b'pitch:1;roll:-2;yaw:35;vgx:0;vgy:0;vgz:0;templ:62;temph:65;tof:10;h:0;bat:87;'
+          b'baro:254.14;time:0;agx:-8.00;agy:4.00;agz:-999.00;\r\n')
+_NUMBER = 200000
+
+
+def parse_tello_state_dict(state):
+    '''
+    Parsing used by RyzeTello before TelloState
+    '''
+    state_list = state.decode("utf-8")[:-3].split(';')
+    return dict([tuple(param.split(':')) for param in state_list])
+
+
+def consume_dict():
+    state = parse_tello_state_dict(_STATE)
+    return int(state['bat']), int(state['templ']), int(state['h'])
+
+
+_tello_state = ryze_tello.TelloState()
+
+
+def consume_tello_state():
+    ryze_tello.parse_tello_state(_STATE, _tello_state)
+    return _tello_state.bat, _tello_state.templ, _tello_state.h
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else _NUMBER
+    for name, function in (('dict', consume_dict), ('TelloState', consume_tello_state)):
+        seconds = min(timeit.repeat(function, number=number, repeat=5))
+        print('{:<12} {:8.2f} us/packet {:10.0f} packets/s'.format(name, seconds / number * 1e6, number / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+'''
+Benchmark suite of RyzeTello hot paths against local TelloSimulator instances
+    rtt   - command round trip time of tello_send_command
+    state - state packets parsed per second by tello_receive_state
+    video - frames per second and frame handling time of the video path like RyzeTelloUI: decode thread
+            converts cv2.VideoCapture frames into TelloFrameMailbox buffers wrapped by pygame.image.frombuffer,
+            render loop takes the latest one and blits it, requires OpenCV, pygame and --video file
+            with H.264 elementary stream
+Reports latency percentiles, packets/s and CPU per drone,
+simulators run in a separate process so that CPU is of RyzeTello only,
+saves results as JSON to benchmarks/results and compares them with a previous run
+
+Usage: python benchmarks/bench_tello.py [--drones N] [--compare results/<file>.json] [rtt] [state] [video]
+'''
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_simulator
+
+_DIR_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+_RENDER_FPS = 30 # like main window loop of RyzeTelloUI
+
+
+def percentiles(values, points=(50, 90, 99)):
+    '''
+    Return dict {'p<point>': value} of nearest-rank percentiles
+    '''
+    values = sorted(values)
+    if not values:
+        return {'p{}'.format(point): None for point in points}
+    return {'p{}'.format(point): values[min(len(values) - 1, int(len(values) * point / 100))] for point in points}
+
+
+class StateCounter():
+    '''
+    Stands for tello_state_history of RyzeTello and counts parsed states
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, tello_state):
+        self.count += 1
+
+
+def run_simulators(connection, number, simulator_arguments):
+    '''
+    Run number of TelloSimulator instances in simulator process
+    Send their addresses, receive state ports of RyzeTello instances, run until anything is received
+    '''
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        simulators = [ryze_tello_simulator.TelloSimulator(**simulator_arguments) for _ in range(number)]
+        try:
+            connection.send([simulator.address for simulator in simulators])
+            for simulator, state_port in zip(simulators, connection.recv()):
+                simulator.state_port = state_port
+            connection.recv()
+        finally:
+            for simulator in simulators:
+                simulator.close()
+
+
+@contextlib.contextmanager
+def drones(number, **simulator_arguments):
+    '''
+    Start number of RyzeTello instances, each connected to own TelloSimulator on loopback
+    Simulators run in another process, so time.process_time() counts CPU of RyzeTello threads only
+    Yield list of (tello, state_counter)
+    '''
+    connection, simulator_connection = multiprocessing.Pipe()
+    simulator_process = multiprocessing.Process(target=run_simulators,
+                                                args=(simulator_connection, number, simulator_arguments))
+    simulator_process.start()
+    links = []
+    try:
+        for address in connection.recv():
+            state_counter = StateCounter()
+            tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                         local_address_command_response=('127.0.0.1', 0),
+                                         tello_address_command_response=address,
+                                         timeout_sleep=3600, tello_state_history=state_counter)
+            links.append((tello, state_counter))
+        connection.send([tello.socket_state.getsockname()[1] for tello, _ in links])
+        # Wait for handshake of tello_supervise_link
+        time.sleep(0.2)
+        yield links
+    finally:
+        for tello, _ in links:
+            tello.close()
+        connection.send(None)
+        simulator_process.join()
+
+
+def bench_rtt(arguments):
+    rtts = []
+    timeouts = 0
+    with drones(arguments.drones, delay=arguments.delay) as links:
+        cpu = time.process_time()
+        started = time.perf_counter()
+        for _ in range(arguments.commands):
+            commands = [tello.tello_send_command_async('battery?') for tello, _ in links]
+            for command in commands:
+                command.wait()
+                if command.response is None:
+                    timeouts += 1
+                else:
+                    rtts.append(command.rtt())
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+    result = {'commands': len(rtts) + timeouts, 'timeouts': timeouts,
+              'commands_per_s': (len(rtts) + timeouts) / elapsed,
+              'cpu_per_drone': cpu / elapsed / arguments.drones}
+    result.update({'rtt_ms_' + key: value for key, value in percentiles(rtts).items()})
+    return result
+
+
+def bench_state(arguments):
+    with drones(arguments.drones, state_rate=arguments.state_rate) as links:
+        counts = [state_counter.count for _, state_counter in links]
+        cpu = time.process_time()
+        started = time.perf_counter()
+        time.sleep(arguments.duration)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+        received = sum(state_counter.count for _, state_counter in links) - sum(counts)
+        errors = sum(tello.get_tello_state_errors() for tello, _ in links)
+    return {'packets_per_s': received / elapsed, 'packets_per_s_per_drone': received / elapsed / arguments.drones,
+            'parse_errors': errors, 'cpu_per_drone': cpu / elapsed / arguments.drones}
+
+
+def bench_video(arguments):
+    import cv2
+    import numpy
+    import pygame
+
+    if arguments.video is None:
+        return {'skipped': 'no --video file'}
+    with drones(1, video_file=arguments.video, video_port=arguments.video_port) as links:
+        tello = links[0][0]
+        frame_size = (tello.frame_width, tello.frame_height)
+        # Offscreen surface stands for the main window, buffers are set up once like in RyzeTelloUI
+        window = pygame.Surface(frame_size)
+        frame_buffers = []
+        for _ in range(3):
+            frame_rgb = numpy.empty((tello.frame_height, tello.frame_width, 3), numpy.uint8)
+            frame_buffers.append((frame_rgb, pygame.image.frombuffer(frame_rgb, frame_size, 'RGB')))
+        frame_mailbox = ryze_tello.TelloFrameMailbox(frame_buffers)
+        tello.tello_send_command('streamon')
+        stream = cv2.VideoCapture('udp://@127.0.0.1:{}'.format(arguments.video_port))
+        frame_times = []
+        stop = threading.Event()
+
+        def decode():
+            while not stop.is_set() and stream.isOpened():
+                ret, frame = stream.read()
+                if not ret:
+                    continue
+                frame_started = time.perf_counter()
+                if frame.shape[1::-1] != frame_size:
+                    frame = cv2.resize(frame, frame_size)
+                frame_rgb, _ = frame_mailbox.writer_buffer()
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+                frame_mailbox.publish()
+                frame_times.append((time.perf_counter() - frame_started) * 1000)
+
+        thread_decode = threading.Thread(target=decode)
+        present_times = []
+        latencies = []
+        cpu = time.process_time()
+        started = time.perf_counter()
+        thread_decode.start()
+        next_render = started
+        while time.perf_counter() - started < arguments.duration:
+            next_render += 1 / _RENDER_FPS
+            time.sleep(max(0, next_render - time.perf_counter()))
+            present_started = time.perf_counter()
+            frame = frame_mailbox.take()
+            if frame is None:
+                continue
+            (_, surf_frame), _, timestamp = frame
+            window.blit(surf_frame, (0, 0))
+            present_times.append((time.perf_counter() - present_started) * 1000)
+            latencies.append((time.monotonic() - timestamp) * 1000)
+        stop.set()
+        thread_decode.join()
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+        stream.release()
+    stats = frame_mailbox.get_stats()
+    result = {'frames_per_s': len(frame_times) / elapsed, 'presented_per_s': len(present_times) / elapsed,
+              'dropped': stats['dropped'], 'cpu_per_drone': cpu / elapsed}
+    result.update({'frame_ms_' + key: value for key, value in percentiles(frame_times).items()})
+    result.update({'present_ms_' + key: value for key, value in percentiles(present_times).items()})
+    result.update({'latency_ms_' + key: value for key, value in percentiles(latencies).items()})
+    return result
+
+
+_BENCHMARKS = {'rtt': bench_rtt, 'state': bench_state, 'video': bench_video}
+
+
+def compare(results, previous):
+    '''
+    Print results next to results of previous run
+    '''
+    for name, result in results['benchmarks'].items():
+        for key, value in result.items():
+            old = previous.get('benchmarks', {}).get(name, {}).get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                print('{:<6} {:<28} {:>12.3f} {:>12.3f} {:>+8.1f}%'.format(name, key, old, value, (value - old) / old * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RyzeTello benchmarks against local TelloSimulator')
+    parser.add_argument('benchmarks', nargs='*', help='rtt, state, video (rtt and state by default)')
+    parser.add_argument('--drones', type=int, default=1)
+    parser.add_argument('--commands', type=int, default=500, help='commands per drone for rtt')
+    parser.add_argument('--delay', type=float, default=0, help='simulator response delay in ms')
+    parser.add_argument('--state-rate', type=float, default=100, help='state packets per second per drone')
+    parser.add_argument('--duration', type=float, default=5, help='duration of state and video in sec')
+    parser.add_argument('--video', help='H.264 elementary stream file for video')
+    parser.add_argument('--video-port', type=int, default=11111)
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    parser.add_argument('--no-save', action='store_true')
+    arguments = parser.parse_args()
+    for name in arguments.benchmarks:
+        if name not in _BENCHMARKS:
+            parser.error("unknown benchmark '{}'".format(name))
+    arguments.benchmarks = arguments.benchmarks or ['rtt', 'state']
+
+    results = {'time': datetime.datetime.now().isoformat(), 'python': sys.version.split()[0],
+               'arguments': vars(arguments), 'benchmarks': {}}
+    for name in arguments.benchmarks:
+        # RyzeTello prints every command and response
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results['benchmarks'][name] = _BENCHMARKS[name](arguments)
+        print(name, json.dumps(results['benchmarks'][name], indent=1))
+
+    if not arguments.no_save:
+        if not os.path.exists(_DIR_RESULTS):
+            os.mkdir(_DIR_RESULTS)
+        filename = os.path.join(_DIR_RESULTS, "{}.json".format(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")))
+        with open(filename, 'w') as results_file:
+            json.dump(results, results_file, indent=1)
+        print("Results saved {}".format(filename))
+    if arguments.compare:
+        with open(arguments.compare) as previous_file:
+            compare(results, json.load(previous_file))
+
+
+if __name__ == "__main__":
+    main()
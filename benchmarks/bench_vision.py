@@ -0,0 +1,161 @@
+'''
+Benchmark of ryze_tello_vision.TelloVisionStage with canned video on CPU
+Frames of --video file are fed at --fps like the decoder thread does, a synthetic detector
+(Gaussian blur passes and brightest point, cost proportional to pixels) analyzes them
+    inline - detector runs on the feeding thread, like analysis inside RyzeTelloUI.tello_video_broadcast
+    stage  - frames are submitted to TelloVisionStage with --workers processes
+Reports frames fed per second, feeding thread time per frame, results per second, skip ratio,
+latency percentiles and the final scale
+
+Usage: python benchmarks/bench_vision.py --video capture.h264 [--workers 2] [--target-latency 0.1] [inline] [stage]
+'''
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+
+import ryze_tello
+import ryze_tello_vision
+
+
+def percentiles(values, points=(50, 90, 99)):
+    '''
+    Return dict {'p<point>': value} of nearest-rank percentiles
+    '''
+    values = sorted(values)
+    if not values:
+        return {'p{}'.format(point): None for point in points}
+    return {'p{}'.format(point): values[min(len(values) - 1, int(len(values) * point / 100))] for point in points}
+
+
+def detect_brightest(frame, passes=4):
+    '''
+    Synthetic detector: return (x, y) of the brightest blurred point
+    '''
+    cv2.setNumThreads(1)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    for _ in range(passes):
+        gray = cv2.GaussianBlur(gray, (0, 0), 5)
+    return cv2.minMaxLoc(gray)[3]
+
+
+def read_frames(filename, limit=300):
+    stream = cv2.VideoCapture(filename)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = stream.read()
+        if not ret:
+            break
+        frames.append(frame)
+    stream.release()
+    return frames
+
+
+def feed(frames, arguments, handle):
+    '''
+    Call handle(frame, timestamp) for frames in loop at arguments.fps during arguments.duration
+    Return (frames fed, feeding thread ms per frame)
+    '''
+    period = 1 / arguments.fps
+    handle_times = []
+    started = next_time = time.monotonic()
+    index = 0
+    while time.monotonic() - started < arguments.duration:
+        next_time += period
+        frame_started = time.monotonic()
+        handle(frames[index % len(frames)], frame_started)
+        handle_times.append((time.monotonic() - frame_started) * 1000)
+        index += 1
+        # Like a decoder, frames due while handling are not made up
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_time = time.monotonic()
+    return index / (time.monotonic() - started), handle_times
+
+
+def bench_inline(frames, arguments):
+    detector = functools.partial(detect_brightest, passes=arguments.passes)
+    latencies = []
+
+    def handle(frame, timestamp):
+        detector(frame)
+        latencies.append((time.monotonic() - timestamp) * 1000)
+
+    frames_per_s, handle_times = feed(frames, arguments, handle)
+    result = {'frames_per_s': frames_per_s, 'results_per_s': frames_per_s, 'skip_ratio': 0}
+    result.update({'feed_ms_' + key: value for key, value in percentiles(handle_times).items()})
+    result.update({'latency_ms_' + key: value for key, value in percentiles(latencies).items()})
+    return result
+
+
+def bench_stage(frames, arguments):
+    latencies = []
+    lock = threading.Lock()
+
+    def on_result(vision_result):
+        with lock:
+            latencies.append(vision_result.latency * 1000)
+
+    stage = ryze_tello_vision.TelloVisionStage(functools.partial(detect_brightest, passes=arguments.passes), on_result,
+                                               arguments.workers, arguments.target_latency, arguments.min_scale)
+    # Start workers before measuring, the first frame starts them
+    stage.submit(frames[0])
+    while stage.get_stats()['completed'] < 1:
+        time.sleep(0.01)
+    with lock:
+        latencies.clear()
+    completed = stage.get_stats()['completed']
+    started = time.monotonic()
+    frames_per_s, handle_times = feed(frames, arguments, stage.submit)
+    elapsed = time.monotonic() - started
+    stats = stage.get_stats()
+    stage.close()
+    result = {'frames_per_s': frames_per_s, 'results_per_s': (stats['completed'] - completed) / elapsed,
+              'skip_ratio': stats['skip_ratio'], 'late': stats['late'], 'scale': stats['scale'],
+              'analysis_ms_avg': stats['analysis_ms_avg']}
+    result.update({'feed_ms_' + key: value for key, value in percentiles(handle_times).items()})
+    with lock:
+        result.update({'latency_ms_' + key: value for key, value in percentiles(latencies).items()})
+    return result
+
+
+_BENCHMARKS = {'inline': bench_inline, 'stage': bench_stage}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TelloVisionStage benchmark with canned video')
+    parser.add_argument('benchmarks', nargs='*', help='inline, stage (both by default)')
+    parser.add_argument('--video', required=True, help='H.264 elementary stream or any video file cv2 reads')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of feeding frames')
+    parser.add_argument('--fps', type=float, default=ryze_tello._FRAME_RATE)
+    parser.add_argument('--passes', type=int, default=4, help='blur passes of synthetic detector, its cost')
+    parser.add_argument('--workers', type=int, default=ryze_tello_vision._WORKERS)
+    parser.add_argument('--target-latency', type=float, default=ryze_tello_vision._TARGET_LATENCY)
+    parser.add_argument('--min-scale', type=float, default=ryze_tello_vision._MIN_SCALE)
+    arguments = parser.parse_args()
+    for name in arguments.benchmarks:
+        if name not in _BENCHMARKS:
+            parser.error("unknown benchmark '{}'".format(name))
+
+    frames = read_frames(arguments.video)
+    if not frames:
+        sys.exit('No frames read from {}'.format(arguments.video))
+    started = time.perf_counter()
+    detect_brightest(frames[0], arguments.passes)
+    print('detector {:.1f} ms per {}x{} frame, {} frames'.format((time.perf_counter() - started) * 1000,
+                                                              frames[0].shape[1], frames[0].shape[0], len(frames)))
+    for name in arguments.benchmarks or ('inline', 'stage'):
+        print(name, json.dumps(_BENCHMARKS[name](frames, arguments), indent=1))
+
+
+if __name__ == "__main__":
+    main()
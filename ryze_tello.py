@@ -1,17 +1,876 @@
+import collections
+import re
 import socket
 import threading
 import time
 
+import ryze_tello_metrics
+
 _LOCAL_ADDRESS_STATE = ('', 8890)
 _LOCAL_ADDRESS_COMMAND_RESPONSE = ('',8889)
 _TELLO_ADDRESS_COMMAND_RESPONSE = ('192.168.10.1', 8889)
 _TELLO_VIDEO_STREAM = 'udp://@0.0.0.0:11111'
+_LOCAL_ADDRESS_VIDEO = ('', 11111)
+_LOCAL_ADDRESS_VIDEO_RELAY = ('127.0.0.1', 11112)
+_TIMEOUT_VIDEO = 0.5 # in sec
+_VIDEO_PACKET_SIZE = 1460 # Tello splits video stream into datagrams of this size
+_DECODER_QUEUE_SIZE = 30 # access units, 1 sec of Tello video stream
 _TIMEOUT_RESPONSE = 2000 # in msec
+# Flight time added to timeout of commands Tello answers after flight, speeds are the lowest expected
+_TIMEOUT_TAKEOFF = 8000 # in msec, takeoff and land
+_TIMEOUT_FLIP = 3000 # in msec
+_MOVE_SPEED = 20 # in cm/s
+_ROTATE_SPEED = 30 # in degree/s
+_RESPONSE_RTT_FACTOR = 4 # response this many average round trip times after command is of that command
+_RESPONSE_RTT_MIN = 100 # in msec
 _TIMEOUT_SLEEP = 10 # in sec
+_TIMEOUT_SOCKET = 0.2 # in sec, receive threads check for close this often
+_LINK_CHECK = 0.1 # in sec
+_LINK_DEGRADED = 1 # in sec without state packet or response
+_LINK_LOST = 3 # in sec without state packet or response
+_LINK_RTT_DEGRADED = 500 # in msec, average round trip time of keepalive and read commands
+_RECONNECT_BACKOFF = (0.5, 8) # in sec, the first and the longest interval between handshakes
+_LINK_STATES = ('connecting', 'ok', 'degraded', 'lost')
 _FRAME_RATE = 30
 _FRAME_WIDTH = 960
 _FRAME_HEIGHT = 720
 _FPS = 30
+# Commands sent ahead of queued commands, queued commands are cancelled
+_PRIORITY_COMMANDS = ('emergency', 'land', 'stop')
+# Commands not queued again while the same command is queued or waiting for response
+_COALESCED_COMMANDS = ('takeoff', 'forward', 'back', 'left', 'right', 'up', 'down', 'cw', 'ccw', 'flip', 'go', 'curve')
+_RC_RATE = 20 # in Hz
+_RC_FAILSAFE = 300 # in msec
+
+_is_logging = True
+
+
+def set_logging(is_logging):
+    '''
+    Turn console logging of commands, responses and thread events on or off
+    Printing every command and response costs time on receive threads, turn it off for long runs
+    '''
+    global _is_logging
+    _is_logging = is_logging
+
+
+def log(*args):
+    '''
+    print() if logging is on (see set_logging)
+    '''
+    if _is_logging:
+        print(*args)
+
+
+def address(text):
+    '''
+    Parse 'host:port' into socket address tuple, argparse type of command line tools
+    '''
+    host, _, port = text.rpartition(':')
+    return (host, int(port))
+
+
+class TelloCommand():
+    '''
+    Waitable handle of a single command sent to Tello
+    Completed by the receive thread as soon as the matching response arrives
+    Attributes:
+    command - command sent to Tello as str
+    timeout - timeout in ms to wait response from Tello
+    response - response from Tello as str or None if not received
+    sent_at - time.monotonic() when command was sent
+    received_at - time.monotonic() when response was received or None
+    timed_out - True if response was not received in time
+    queued_at - time.monotonic() when command was queued by RyzeTello.tello_queue_command or None
+    cancelled - True if queued command was cancelled before sending
+    '''
+
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.response = None
+        self.sent_at = None
+        self.received_at = None
+        self.timed_out = False
+        self.queued_at = None
+        self.cancelled = False
+        self.__event = threading.Event()
+
+    def done(self):
+        return self.__event.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Wait for response not more then timeout ms (default is timeout of command)
+        Return response as str or None if Tello doesn't response
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        self.__event.wait(max(0, timeout - self.elapsed()) / 1000)
+        return self.response
+
+    def elapsed(self):
+        '''
+        Return ms passed since command was sent
+        '''
+        if self.sent_at is None:
+            return 0
+        return (time.monotonic() - self.sent_at) * 1000
+
+    def rtt(self):
+        '''
+        Return round trip time in ms or None if response was not received
+        '''
+        if self.received_at is None:
+            return None
+        return (self.received_at - self.sent_at) * 1000
+
+    def wait_time(self):
+        '''
+        Return ms the command spent in queue before sending or None if it was not queued or not sent yet
+        '''
+        if self.queued_at is None or self.sent_at is None:
+            return None
+        return (self.sent_at - self.queued_at) * 1000
+
+    def _complete(self, response):
+        self.response = response
+        self.received_at = time.monotonic()
+        self.__event.set()
+
+    def _expire(self):
+        self.timed_out = True
+        self.__event.set()
+
+    def _cancel(self):
+        self.cancelled = True
+        self.__event.set()
+
+
+def command_timeout(command_to_tello, timeout_response=_TIMEOUT_RESPONSE):
+    '''
+    Return default timeout in ms of command: timeout_response, plus flight time
+    for takeoff, land, move, rotate, flip, go and curve commands which Tello answers after flight
+    '''
+    words = command_to_tello.split()
+    try:
+        arguments = [abs(float(argument)) for argument in words[1:]]
+    except ValueError:
+        return timeout_response
+    name = words[0] if words else ''
+    if name in ('takeoff', 'land'):
+        return timeout_response + _TIMEOUT_TAKEOFF
+    if name == 'flip':
+        return timeout_response + _TIMEOUT_FLIP
+    if name in ('forward', 'back', 'left', 'right', 'up', 'down') and arguments:
+        return timeout_response + arguments[0] / _MOVE_SPEED * 1000
+    if name in ('cw', 'ccw') and arguments:
+        return timeout_response + arguments[0] / _ROTATE_SPEED * 1000
+    if name in ('go', 'curve') and len(arguments) >= 4:
+        # Path of curve is not longer than the way through both points
+        path = sum(sum(value ** 2 for value in arguments[start:start + 3]) ** 0.5 for start in range(0, len(arguments) - 1, 3))
+        return timeout_response + path / max(arguments[-1], 1) * 1000
+    return timeout_response
+
+
+class TelloCommandMatcher():
+    '''
+    Class matches Tello responses with commands waiting for them
+    Tello answers commands in order they were sent, so a response arriving
+    while a timed out command may still be answered is taken as its late response
+    Timed out command is forgotten if its response didn't arrive during one more timeout
+    (or its default timeout with flight time, if that is longer), or if a response arrives as soon after the oldest waiting command as responses do
+    (4 average round trip times of 'command' and read commands, at least 100 ms): then the response
+    is of that command and responses of timed out commands were lost, so one lost response
+    doesn't time out every command after it. Read command is never answered 'ok', so timed out read
+    command is forgotten when 'ok' arrives, and 'ok' is given to timed out command before a waiting read command
+    Late and unmatched responses are counted and never given to another command
+    Commands must have command, timeout, elapsed(), _complete(response) and _expire() like TelloCommand
+    '''
+
+    def __init__(self):
+        # Commands waiting for response in order they were sent
+        self.__pending_commands = collections.deque()
+        # Timed out commands which response may still arrive
+        self.__orphan_commands = collections.deque()
+        self.__lock = threading.Lock()
+        self.__rtt_ewma = None
+        self.__stats = {'sent': 0, 'completed': 0, 'timeouts': 0, 'late': 0, 'unmatched': 0, 'dropped': 0}
+
+    def add(self, command):
+        with self.__lock:
+            self.__expire()
+            self.__pending_commands.append(command)
+            self.__stats['sent'] += 1
+
+    def match(self, response):
+        '''
+        Complete the oldest command waiting for response
+        Return matched command or None if response is late or unmatched
+        '''
+        with self.__lock:
+            self.__expire()
+            if self.__orphan_commands and self.__pending_commands:
+                response_time = max(_RESPONSE_RTT_MIN, _RESPONSE_RTT_FACTOR * (self.__rtt_ewma or 0))
+                pending_command = self.__pending_commands[0]
+                if pending_command.elapsed() <= response_time and not (response == 'ok' and
+                                                                       pending_command.command.endswith('?')):
+                    self.__stats['dropped'] += len(self.__orphan_commands)
+                    self.__orphan_commands.clear()
+            while self.__orphan_commands and response == 'ok' and self.__orphan_commands[0].command.endswith('?'):
+                self.__orphan_commands.popleft()
+                self.__stats['dropped'] += 1
+            if self.__orphan_commands:
+                command = self.__orphan_commands.popleft()
+                self.__stats['late'] += 1
+                log("Late response '{}' to command '{}'".format(response, command.command))
+                return None
+            if not self.__pending_commands:
+                self.__stats['unmatched'] += 1
+                log("Unmatched response '{}'".format(response))
+                return None
+            command = self.__pending_commands.popleft()
+            self.__stats['completed'] += 1
+            # Other commands answer after flight, only these measure response time
+            if command.command == 'command' or command.command.endswith('?'):
+                rtt = command.elapsed()
+                self.__rtt_ewma = rtt if self.__rtt_ewma is None else 0.8 * self.__rtt_ewma + 0.2 * rtt
+        command._complete(response)
+        return command
+
+    def expire(self):
+        with self.__lock:
+            self.__expire()
+
+    def time_out(self, command):
+        '''
+        Time out waiting command at once, its response may still arrive as late one,
+        e.g. handshake sent while link was lost when link comes back
+        '''
+        with self.__lock:
+            if command not in self.__pending_commands:
+                return
+            self.__pending_commands.remove(command)
+            command._expire()
+            self.__orphan_commands.append(command)
+            self.__stats['timeouts'] += 1
+
+    def clear_orphans(self):
+        '''
+        Forget timed out commands, e.g. when link comes back: their responses were lost with it
+        '''
+        with self.__lock:
+            self.__stats['dropped'] += len(self.__orphan_commands)
+            self.__orphan_commands.clear()
+
+    def __expire(self):
+        while self.__orphan_commands and self.__orphan_commands[0].elapsed() >= max(
+                2 * self.__orphan_commands[0].timeout, command_timeout(self.__orphan_commands[0].command)):
+            self.__orphan_commands.popleft()
+        while self.__pending_commands and self.__pending_commands[0].elapsed() >= self.__pending_commands[0].timeout:
+            command = self.__pending_commands.popleft()
+            command._expire()
+            self.__orphan_commands.append(command)
+            self.__stats['timeouts'] += 1
+
+    def get_stats(self):
+        '''
+        Return copy of command counters as dict:
+        sent, completed, timeouts, late (response after timeout), unmatched (response without command),
+        dropped (timed out commands given up because their responses were lost)
+        '''
+        with self.__lock:
+            return dict(self.__stats)
+
+
+class TelloState():
+    '''
+    Typed record of Tello state with numeric fields already converted
+    Fields are the same as keys of Tello state packet (see RyzeTello.tello_receive_state),
+    unknown values are None, templ, temph and bat are 0 until received
+    timestamp - time.monotonic() when the packet was received
+    Record also supports state[key] and iteration over field names like dict
+    '''
+
+    FIELDS = ('pitch','roll','yaw','vgx','vgy','vgz','templ','temph','tof','h','bat','baro',
+              'time','agx','agy','agz')
+    __slots__ = FIELDS + ('timestamp',)
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.templ = 0
+        self.temph = 0
+        self.bat = 0
+        self.timestamp = None
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def keys(self):
+        return self.FIELDS
+
+    def copy(self):
+        tello_state = TelloState()
+        for field in self.__slots__:
+            setattr(tello_state, field, getattr(self, field))
+        return tello_state
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return 'TelloState({})'.format(', '.join('{}={}'.format(field, getattr(self, field)) for field in self.__slots__))
+
+
+# Tello state packet with all fields in order of the SDK, captured values are converted in place
+_TELLO_STATE_PACKET = re.compile(b''.join(b' ?' + field.encode() + b':([-+0-9.]+);' for field in TelloState.FIELDS) + b'\r\n')
+
+# Key of Tello state packet: (field of TelloState, type)
+_TELLO_STATE_FIELDS = {b'pitch': ('pitch', int), b'roll': ('roll', int), b'yaw': ('yaw', int),
+                       b'vgx': ('vgx', int), b'vgy': ('vgy', int), b'vgz': ('vgz', int),
+                       b'templ': ('templ', int), b'temph': ('temph', int), b'tof': ('tof', int),
+                       b'h': ('h', int), b'bat': ('bat', int), b'baro': ('baro', float),
+                       b'time': ('time', int), b'agx': ('agx', float), b'agy': ('agy', float),
+                       b'agz': ('agz', float)}
+
+
+def parse_tello_state(state, tello_state):
+    '''
+    Parse Tello state packet as bytes into given TelloState in place
+    Values are converted straight from bytes without decoding to str or building lists and dicts
+    Packet in SDK format takes one regular expression match,
+    other packets are scanned field by field and unknown keys are skipped (e.g. mission pad fields of Tello EDU)
+    Return True if packet is well-formed and has every field of TelloState, otherwise False
+    and tello_state may be partially updated (callers parse into a spare record, a partial packet
+    would leave fields of an older packet in it)
+    '''
+    match = _TELLO_STATE_PACKET.match(state)
+    try:
+        if match is not None:
+            values = match.groups()
+            tello_state.pitch = int(values[0])
+            tello_state.roll = int(values[1])
+            tello_state.yaw = int(values[2])
+            tello_state.vgx = int(values[3])
+            tello_state.vgy = int(values[4])
+            tello_state.vgz = int(values[5])
+            tello_state.templ = int(values[6])
+            tello_state.temph = int(values[7])
+            tello_state.tof = int(values[8])
+            tello_state.h = int(values[9])
+            tello_state.bat = int(values[10])
+            tello_state.baro = float(values[11])
+            tello_state.time = int(values[12])
+            tello_state.agx = float(values[13])
+            tello_state.agy = float(values[14])
+            tello_state.agz = float(values[15])
+            return True
+        if not state.endswith(b'\r\n'):
+            return False
+        position = 0
+        end = len(state) - 2
+        fields = set()
+        while position < end:
+            separator = state.find(b';', position, end)
+            if separator < 0:
+                separator = end
+            colon = state.find(b':', position, separator)
+            if colon < 0:
+                return False
+            field = _TELLO_STATE_FIELDS.get(state[position:colon].strip())
+            if field is not None:
+                setattr(tello_state, field[0], field[1](state[colon + 1:separator]))
+                fields.add(field[0])
+            position = separator + 1
+    except ValueError:
+        return False
+    return len(fields) == len(TelloState.FIELDS)
+
+
+class TelloFrameMailbox():
+    '''
+    Single-slot mailbox passing the latest video frame from decoder to renderer without copying
+    Triple buffering over preallocated buffers: decoder writes into writer_buffer() and publish() it,
+    renderer take() the latest published buffer and owns it until the next take()
+    A published frame replaced before it was taken is counted as dropped,
+    so renderer always shows the newest frame and latency stays flat when it falls behind
+    Required argument:
+    buffers - list of 3 preallocated buffers of any type, e.g. NumPy arrays
+    '''
+
+    def __init__(self, buffers):
+        if len(buffers) != 3:
+            raise ValueError('TelloFrameMailbox needs 3 buffers, got {}'.format(len(buffers)))
+        self.__writer, self.__latest, self.__reader = buffers
+        self.__latest_sequence = 0
+        self.__latest_timestamp = None
+        self.__is_fresh = False
+        self.__lock = threading.Lock()
+        self.__stats = {'published': 0, 'taken': 0, 'dropped': 0}
+
+    def writer_buffer(self):
+        return self.__writer
+
+    def publish(self, timestamp=None):
+        '''
+        Publish writer buffer as the latest frame, timestamp defaults to time.monotonic()
+        Return sequence number of the frame
+        '''
+        with self.__lock:
+            if self.__is_fresh:
+                self.__stats['dropped'] += 1
+            self.__writer, self.__latest = self.__latest, self.__writer
+            self.__stats['published'] += 1
+            self.__latest_sequence = self.__stats['published']
+            self.__latest_timestamp = time.monotonic() if timestamp is None else timestamp
+            self.__is_fresh = True
+            return self.__latest_sequence
+
+    def take(self):
+        '''
+        Return (buffer, sequence, timestamp) of the latest frame or None if no new frame was published
+        '''
+        with self.__lock:
+            if not self.__is_fresh:
+                return None
+            self.__reader, self.__latest = self.__latest, self.__reader
+            self.__is_fresh = False
+            self.__stats['taken'] += 1
+            return self.__reader, self.__latest_sequence, self.__latest_timestamp
+
+    def get_stats(self):
+        '''
+        Return copy of counters as dict: published, taken, dropped
+        '''
+        with self.__lock:
+            return dict(self.__stats)
+
+
+class H264BitReader():
+    '''
+    Reader of H.264 header bits: fixed length and Exp-Golomb coded values
+    '''
+
+    def __init__(self, data):
+        # Remove emulation prevention bytes, headers are short so only the beginning is needed
+        self.data = data[:64].replace(b'\x00\x00\x03', b'\x00\x00')
+        self.position = 0
+
+    def bits(self, count):
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.position >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.position & 7))) & 1)
+            self.position += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while not self.bits(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError('Invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+# Profiles with chroma format and scaling matrices in SPS
+_H264_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+
+def parse_h264_sps(nal_unit):
+    '''
+    Parse SPS NAL unit (without start code) and return (log2_max_frame_num, separate_colour_plane)
+    '''
+    reader = H264BitReader(nal_unit[1:])
+    profile_idc = reader.bits(8)
+    reader.bits(16) # constraint flags and level
+    reader.ue() # seq_parameter_set_id
+    separate_colour_plane = 0
+    chroma_format_idc = 1
+    if profile_idc in _H264_HIGH_PROFILES:
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = reader.bits(1)
+        reader.ue() # bit_depth_luma_minus8
+        reader.ue() # bit_depth_chroma_minus8
+        reader.bits(1) # qpprime_y_zero_transform_bypass_flag
+        if reader.bits(1): # seq_scaling_matrix_present_flag
+            for index in range(12 if chroma_format_idc == 3 else 8):
+                if reader.bits(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if index < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + reader.se() + 256) % 256
+                        last_scale = next_scale or last_scale
+    return reader.ue() + 4, separate_colour_plane
+
+
+def parse_h264_frame_num(nal_unit, log2_max_frame_num, separate_colour_plane=0):
+    '''
+    Parse slice NAL unit (without start code) and return (first_mb_in_slice, frame_num)
+    '''
+    reader = H264BitReader(nal_unit[1:])
+    first_mb_in_slice = reader.ue()
+    reader.ue() # slice_type
+    reader.ue() # pic_parameter_set_id
+    if separate_colour_plane:
+        reader.bits(2)
+    return first_mb_in_slice, reader.bits(log2_max_frame_num)
+
+
+class TelloAccessUnit():
+    '''
+    One coded picture of Tello video stream with parameter sets and SEI before it
+    data - H.264 elementary stream bytes with start codes
+    is_idr - True if picture is IDR (stream can be decoded from it)
+    has_sps - True if SPS precedes the picture
+    frame_num - frame_num of slice header or None if SPS was not received yet
+    first_received_at - time.monotonic() when the first datagram of access unit was received
+    completed_at - time.monotonic() when access unit was reassembled
+    sequence - number of access unit in stream
+    '''
+
+    __slots__ = ('data', 'is_idr', 'has_sps', 'frame_num', 'first_received_at', 'completed_at', 'sequence')
+
+    def __init__(self, data, is_idr, has_sps, frame_num, first_received_at, completed_at, sequence):
+        self.data = data
+        self.is_idr = is_idr
+        self.has_sps = has_sps
+        self.frame_num = frame_num
+        self.first_received_at = first_received_at
+        self.completed_at = completed_at
+        self.sequence = sequence
+
+
+class TelloVideoReceiver():
+    '''
+    Class receives Tello video stream (H.264 elementary stream over UDP) from socket directly
+    and reassembles datagrams into NAL units and access units (pictures)
+    Consumers take the stream at the stage they need:
+        subscribe(callback(datagram)) - raw datagrams, e.g. to record stream as is
+        subscribe_access_units(callback(TelloAccessUnit)) - reassembled pictures, e.g. for pre-trigger buffer
+        subscribe_frames(callback(frame, TelloAccessUnit)) - pictures decoded by decoder in decoder thread
+    Callbacks are called from receive or decoder thread and must not block
+    Tello splits pictures into datagrams of 1460 bytes, a shorter datagram ends the picture,
+    so access unit is passed on without waiting for the next one
+    Loss is estimated from gaps of frame_num in slice headers
+    Default optional arguments are:
+    local_address_video = ('', 11111) - socket as tuple to receive Tello video stream
+    relay_address = ('127.0.0.1', 11112) - socket as tuple to relay datagrams to
+                                           (e.g. for cv2.VideoCapture(relay_stream)), None to disable relay
+    decoder = None - object with decode(data) method returning list of decoded frames,
+                     e.g. ryze_tello_stream.PyAVDecoder
+    decoder_queue_size = 30 - access units waiting for decoder, on overflow they are dropped up to the next IDR
+    metrics = None - ryze_tello_metrics.TelloMetrics to export stream counters and reassembly and decode times
+    '''
+
+    def __init__(self, local_address_video=_LOCAL_ADDRESS_VIDEO, relay_address=_LOCAL_ADDRESS_VIDEO_RELAY,
+                    decoder=None, decoder_queue_size=_DECODER_QUEUE_SIZE, metrics=None):
+        self.local_address_video = local_address_video
+        self.relay_address = relay_address
+        self.relay_stream = None if relay_address is None else 'udp://@{}:{}'.format(*relay_address)
+        self.decoder = decoder
+        self.decoder_queue_size = decoder_queue_size
+        self.__subscribers = []
+        self.__access_unit_subscribers = []
+        self.__frame_subscribers = []
+        self.__is_running = True
+
+        # Reassembly state
+        self.__nal_units = []
+        self.__nal_unit = bytearray()
+        self.__access_unit = []
+        self.__access_unit_received_at = None
+        self.__access_unit_has_picture = False
+        self.__access_unit_is_idr = False
+        self.__access_unit_has_sps = False
+        self.__access_unit_frame_num = None
+        self.__log2_max_frame_num = None
+        self.__separate_colour_plane = 0
+        self.__previous_reference_frame_num = None
+        self.__last_idr_at = None
+
+        self.__decoder_queue = collections.deque()
+        self.__decoder_condition = threading.Condition()
+        self.__is_decoder_waiting_idr = True
+
+        self.__lock = threading.Lock()
+        self.__stats = {'datagrams': 0, 'bytes': 0, 'nal_units': 0, 'access_units': 0, 'idr_frames': 0,
+                        'frames_lost': 0, 'idr_interval_ms': None, 'reassembly_ms_last': None,
+                        'reassembly_ms_total': 0, 'decoded': 0, 'decoder_dropped': 0, 'decode_ms_total': 0,
+                        'bytes_per_s': 0}
+        self.__rate_started_at = time.monotonic()
+        self.__rate_bytes = 0
+        self.__reassembly_histogram = self.__decode_histogram = None
+        if metrics is not None:
+            self.__reassembly_histogram = metrics.histogram('tello_video_reassembly_seconds',
+                                                            'From the first datagram of picture to its reassembly')
+            self.__decode_histogram = metrics.histogram('tello_video_decode_seconds', 'Decode time of picture')
+            metrics.add_collector('tello_video', self.get_stats, ('datagrams', 'bytes', 'nal_units', 'access_units',
+                                  'idr_frames', 'frames_lost', 'decoded', 'decoder_dropped'), 'Tello video stream')
+
+        self.socket_video = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_video.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.socket_video.bind(self.local_address_video)
+        self.socket_video.settimeout(_TIMEOUT_VIDEO)
+        self.socket_relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.thread_tello_receive_video = threading.Thread(target=self.tello_receive_video)
+        self.thread_tello_receive_video.start()
+        log("Starting tello_receive_video thread")
+        self.thread_tello_decode_video = None
+        if self.decoder is not None:
+            self.thread_tello_decode_video = threading.Thread(target=self.tello_decode_video)
+            self.thread_tello_decode_video.start()
+            log("Starting tello_decode_video thread")
+
+    def subscribe(self, callback):
+        '''
+        Call callback(datagram) from receive thread for every datagram
+        '''
+        self.__subscribers = self.__subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        self.__subscribers = [subscriber for subscriber in self.__subscribers if subscriber != callback]
+
+    def subscribe_access_units(self, callback):
+        '''
+        Call callback(TelloAccessUnit) from receive thread for every reassembled picture
+        '''
+        self.__access_unit_subscribers = self.__access_unit_subscribers + [callback]
+
+    def unsubscribe_access_units(self, callback):
+        self.__access_unit_subscribers = [subscriber for subscriber in self.__access_unit_subscribers if subscriber != callback]
+
+    def subscribe_frames(self, callback):
+        '''
+        Call callback(frame, TelloAccessUnit) from decoder thread for every decoded frame
+        '''
+        self.__frame_subscribers = self.__frame_subscribers + [callback]
+
+    def unsubscribe_frames(self, callback):
+        self.__frame_subscribers = [subscriber for subscriber in self.__frame_subscribers if subscriber != callback]
+
+    def tello_receive_video(self):
+        while self.__is_running:
+            try:
+                datagram = self.socket_video.recv(2048)
+            except socket.timeout:
+                continue
+            except OSError as os_error:
+                log('Exception in tello_receive_video', os_error)
+                break
+            for subscriber in self.__subscribers:
+                try:
+                    subscriber(datagram)
+                except Exception as ex:
+                    log('Exception in tello_receive_video subscriber', ex)
+            if self.relay_address is not None:
+                try:
+                    self.socket_relay.sendto(datagram, self.relay_address)
+                except OSError as os_error:
+                    log('Exception in tello_receive_video relay', os_error)
+            try:
+                self.__reassemble(datagram)
+            except Exception as ex:
+                log('Exception in tello_receive_video reassembly', ex)
+        log("Exiting tello_receive_video...")
+
+    def __reassemble(self, datagram):
+        now = time.monotonic()
+        with self.__lock:
+            self.__stats['datagrams'] += 1
+            self.__stats['bytes'] += len(datagram)
+            if now - self.__rate_started_at >= 1:
+                self.__stats['bytes_per_s'] = (self.__stats['bytes'] - self.__rate_bytes) / (now - self.__rate_started_at)
+                self.__rate_bytes = self.__stats['bytes']
+                self.__rate_started_at = now
+        if self.__access_unit_received_at is None:
+            self.__access_unit_received_at = now
+        position = 0
+        while True:
+            start = datagram.find(b'\x00\x00\x01', position)
+            if start < 0:
+                self.__nal_unit += datagram[position:]
+                break
+            # 4 byte start code belongs to the next NAL unit
+            end = start - 1 if start > position and datagram[start - 1] == 0 else start
+            self.__nal_unit += datagram[position:end]
+            self.__nal_unit_complete(now)
+            position = start + 3
+        # Datagram shorter than maximum ends the picture
+        if len(datagram) < _VIDEO_PACKET_SIZE:
+            self.__nal_unit_complete(now)
+            if self.__access_unit_has_picture:
+                self.__access_unit_complete(now)
+
+    def __nal_unit_complete(self, now):
+        if not self.__nal_unit:
+            return
+        nal_unit = bytes(self.__nal_unit)
+        self.__nal_unit = bytearray()
+        with self.__lock:
+            self.__stats['nal_units'] += 1
+        nal_type = nal_unit[0] & 0x1f
+        if nal_type in (1, 5):
+            # first_mb_in_slice = 0 is coded as a single 1 bit
+            first_mb_in_slice, frame_num = (0 if len(nal_unit) > 1 and nal_unit[1] & 0x80 else 1), None
+            if self.__log2_max_frame_num is not None:
+                try:
+                    first_mb_in_slice, frame_num = parse_h264_frame_num(nal_unit, self.__log2_max_frame_num,
+                                                                        self.__separate_colour_plane)
+                except (ValueError, IndexError):
+                    pass
+            # The first slice of the next picture completes current access unit
+            if first_mb_in_slice == 0 and self.__access_unit_has_picture:
+                self.__access_unit_complete(now)
+            if not self.__access_unit_has_picture:
+                self.__access_unit_has_picture = True
+                self.__access_unit_frame_num = frame_num
+                self.__count_lost_frames(nal_unit, nal_type, frame_num)
+            self.__access_unit_is_idr = self.__access_unit_is_idr or nal_type == 5
+        elif nal_type in (6, 7, 8, 9) and self.__access_unit_has_picture:
+            self.__access_unit_complete(now)
+        if nal_type == 7:
+            self.__access_unit_has_sps = True
+            try:
+                self.__log2_max_frame_num, self.__separate_colour_plane = parse_h264_sps(nal_unit)
+            except (ValueError, IndexError):
+                pass
+        self.__access_unit.append(nal_unit)
+        if self.__access_unit_received_at is None:
+            self.__access_unit_received_at = now
+
+    def __count_lost_frames(self, nal_unit, nal_type, frame_num):
+        if nal_type == 5:
+            self.__previous_reference_frame_num = frame_num
+            return
+        if frame_num is None or self.__previous_reference_frame_num is None:
+            return
+        max_frame_num = 1 << self.__log2_max_frame_num
+        lost = (frame_num - self.__previous_reference_frame_num - 1) % max_frame_num
+        # frame_num equal to previous one is a non-reference picture, not a gap
+        if frame_num != self.__previous_reference_frame_num and lost:
+            with self.__lock:
+                self.__stats['frames_lost'] += lost
+        if nal_unit[0] & 0x60:
+            self.__previous_reference_frame_num = frame_num
+
+    def __access_unit_complete(self, now):
+        data = b''.join(b'\x00\x00\x00\x01' + nal_unit for nal_unit in self.__access_unit)
+        with self.__lock:
+            self.__stats['access_units'] += 1
+            sequence = self.__stats['access_units']
+            reassembly = (now - self.__access_unit_received_at) * 1000
+            self.__stats['reassembly_ms_last'] = reassembly
+            self.__stats['reassembly_ms_total'] += reassembly
+            if self.__access_unit_is_idr:
+                self.__stats['idr_frames'] += 1
+                if self.__last_idr_at is not None:
+                    self.__stats['idr_interval_ms'] = (now - self.__last_idr_at) * 1000
+                self.__last_idr_at = now
+        if self.__reassembly_histogram is not None:
+            self.__reassembly_histogram.observe(reassembly / 1000)
+        access_unit = TelloAccessUnit(data, self.__access_unit_is_idr, self.__access_unit_has_sps,
+                                      self.__access_unit_frame_num, self.__access_unit_received_at, now, sequence)
+        self.__access_unit = []
+        self.__access_unit_received_at = None
+        self.__access_unit_has_picture = False
+        self.__access_unit_is_idr = False
+        self.__access_unit_has_sps = False
+        self.__access_unit_frame_num = None
+        for subscriber in self.__access_unit_subscribers:
+            try:
+                subscriber(access_unit)
+            except Exception as ex:
+                log('Exception in tello_receive_video access unit subscriber', ex)
+        if self.decoder is not None:
+            self.__queue_decode(access_unit)
+
+    def __queue_decode(self, access_unit):
+        with self.__decoder_condition:
+            if len(self.__decoder_queue) >= self.decoder_queue_size:
+                # Decoder can't catch up, P pictures without their references are useless
+                with self.__lock:
+                    self.__stats['decoder_dropped'] += len(self.__decoder_queue)
+                self.__decoder_queue.clear()
+                self.__is_decoder_waiting_idr = True
+            if self.__is_decoder_waiting_idr:
+                if not access_unit.is_idr:
+                    with self.__lock:
+                        self.__stats['decoder_dropped'] += 1
+                    return
+                self.__is_decoder_waiting_idr = False
+            self.__decoder_queue.append(access_unit)
+            self.__decoder_condition.notify()
+
+    def tello_decode_video(self):
+        '''
+        Decode queued access units by decoder and pass frames to frame subscribers
+        '''
+        while True:
+            with self.__decoder_condition:
+                while not self.__decoder_queue and self.__is_running:
+                    self.__decoder_condition.wait()
+                if not self.__is_running:
+                    break
+                access_unit = self.__decoder_queue.popleft()
+            started = time.monotonic()
+            try:
+                frames = self.decoder.decode(access_unit.data)
+            except Exception as ex:
+                log('Exception in tello_decode_video', ex)
+                continue
+            decode_time = time.monotonic() - started
+            with self.__lock:
+                self.__stats['decoded'] += len(frames)
+                self.__stats['decode_ms_total'] += decode_time * 1000
+            if self.__decode_histogram is not None:
+                self.__decode_histogram.observe(decode_time)
+            for frame in frames:
+                for subscriber in self.__frame_subscribers:
+                    try:
+                        subscriber(frame, access_unit)
+                    except Exception as ex:
+                        log('Exception in tello_decode_video frame subscriber', ex)
+        log("Exiting tello_decode_video...")
+
+    def get_stats(self):
+        '''
+        Return copy of stream counters as dict:
+        datagrams, bytes, bytes_per_s (over the last second), nal_units, access_units, idr_frames,
+        idr_interval_ms (between the last two IDR), frames_lost (estimated from frame_num gaps),
+        reassembly_ms_last, reassembly_ms_avg (from the first datagram of picture to its reassembly),
+        decoded, decoder_dropped, decode_ms_avg
+        '''
+        with self.__lock:
+            stats = dict(self.__stats)
+        reassembly_ms_total = stats.pop('reassembly_ms_total')
+        decode_ms_total = stats.pop('decode_ms_total')
+        stats['reassembly_ms_avg'] = reassembly_ms_total / stats['access_units'] if stats['access_units'] else None
+        stats['decode_ms_avg'] = decode_ms_total / stats['decoded'] if stats['decoded'] else None
+        return stats
+
+    def close(self):
+        self.__is_running = False
+        with self.__decoder_condition:
+            self.__decoder_condition.notify_all()
+        for thread in (self.thread_tello_receive_video, self.thread_tello_decode_video):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        self.socket_video.close()
+        self.socket_relay.close()
+
 
 class RyzeTello():
     '''
@@ -23,52 +882,116 @@ class RyzeTello():
     local_address_command_response = ('',8889) - socket as tuple to receive Tello response
     tello_address_command_response = ('192.168.10.1', 8889) - socket as tuple to send Tello command
     tello_video_stream = 'udp://@0.0.0.0:11111' - ip address and port as str to receive Tello video stream
+    local_address_video = ('', 11111) - socket as tuple to receive Tello video stream by TelloVideoReceiver
     timeout_response = 2000 - timeout in ms to wait response from Tello
-    timeout_sleep = 10 - in sec to wait before sending 'command' to Tello
+    timeout_sleep = 10 - in sec of no commands sent before sending keepalive 'command' to Tello
     frame_rate = 30 - frame rate of Tello video stream
     frame_width = 960 - frame width of Tello video stream
     frame_height = 720 - frame height of Tello video stream
+    tello_state_history = None - object with append(TelloState) method to keep every received state,
+                                 e.g. ryze_tello_telemetry.TelloStateHistory
+    metrics = None - ryze_tello_metrics.TelloMetrics to export counters and command round trip time to,
+                     new one is created if None, other parts (video, recorder, UI) may add theirs to it
+    flight_recorder = None - ryze_tello_flightlog.TelloFlightRecorder to log states, commands and responses
     '''
     
     def __init__(self, local_address_state=_LOCAL_ADDRESS_STATE, local_address_command_response=_LOCAL_ADDRESS_COMMAND_RESPONSE,
                     tello_address_command_response=_TELLO_ADDRESS_COMMAND_RESPONSE,tello_video_stream=_TELLO_VIDEO_STREAM,
                     timeout_response=_TIMEOUT_RESPONSE,timeout_sleep=_TIMEOUT_SLEEP,
-                    frame_rate=_FRAME_RATE,frame_width=_FRAME_WIDTH,frame_height=_FRAME_HEIGHT):
-        self.__tello_state = {'pitch':'n/a','roll':'n/a','yaw':'n/a','vgx':'n/a','vgy':'n/a','vgz':'n/a',
-                    'templ':'0','temph':'0','tof':'n/a','h':'n/a','bat':'0','baro':'n/a',
-                    'time':'n/a','agx':'n/a','agy':'n/a','agz':'n/a'}
+                    frame_rate=_FRAME_RATE,frame_width=_FRAME_WIDTH,frame_height=_FRAME_HEIGHT,
+                    tello_state_history=None,local_address_video=_LOCAL_ADDRESS_VIDEO,metrics=None,
+                    flight_recorder=None):
+        # Receive thread parses into the spare record and swaps it with the current one
+        self.__tello_state = TelloState()
+        self.__tello_state_spare = TelloState()
+        self.__tello_state_errors = 0
+        self.__tello_state_packets = 0
+        self.__tello_state_subscribers = []
         self.__tello_response = ''
+        self.__command_matcher = TelloCommandMatcher()
 
         self.local_address_state = local_address_state
         self.local_address_command_response = local_address_command_response
         self.tello_address_command_response = tello_address_command_response
         self.tello_video_stream = tello_video_stream
+        self.local_address_video = local_address_video
         self.timeout_response = timeout_response
         self.timeout_sleep = timeout_sleep
         self.frame_rate = frame_rate
         self.frame_width = frame_width
         self.frame_height = frame_height
+        self.tello_state_history = tello_state_history
+        self.flight_recorder = flight_recorder
+        self.metrics = ryze_tello_metrics.TelloMetrics() if metrics is None else metrics
+        self.__rtt_histogram = self.metrics.histogram('tello_command_rtt_seconds', 'Command round trip time')
+        self.metrics.add_collector('tello_command', self.get_tello_command_stats,
+                                   ('sent', 'completed', 'timeouts', 'late', 'unmatched', 'dropped'), 'Commands sent to Tello')
+        self.metrics.add_collector('tello_state', self.get_tello_state_stats, ('packets', 'errors'), 'Tello state')
+        self.metrics.add_collector('tello_queue', self.get_tello_queue_stats,
+                                   ('queued', 'sent', 'coalesced', 'cancelled'), 'Command queue')
+        self.metrics.add_collector('tello_rc', self.get_tello_rc_stats, ('sent', 'failsafes'), 'rc sender')
+        self.__closing = threading.Event()
+        self.__command_queue = collections.deque()
+        self.__command_queue_condition = threading.Condition()
+        self.__command_in_flight = None
+        self.__priority_command = None
+        self.__queue_stats = {'queued': 0, 'sent': 0, 'coalesced': 0, 'cancelled': 0,
+                              'wait_ms_last': None, 'wait_ms_max': None, 'wait_ms_total': 0}
+        self.__rc_sticks = (0, 0, 0, 0)
+        self.__rc_sticks_time = 0
+        self.__rc_stop = threading.Event()
+        self.__rc_stats = {'sent': 0, 'failsafes': 0, 'jitter_ms_max': 0, 'jitter_ms_total': 0, 'jitter_ms_squares': 0}
+        self.rc_rate = _RC_RATE
+        self.rc_failsafe = _RC_FAILSAFE
+        self.thread_tello_rc_sender = None
+        # Link supervisor settings, in sec (see tello_supervise_link)
+        self.link_degraded = _LINK_DEGRADED
+        self.link_lost = _LINK_LOST
+        self.link_rtt_degraded = _LINK_RTT_DEGRADED
+        self.__link_state = 'connecting'
+        self.__link_changed_at = time.monotonic()
+        self.__last_state_at = None
+        self.__last_response_at = None
+        self.__last_command_at = 0
+        self.__rtt_ewma = None
+        self.__is_streaming = False
+        self.__link_stats = {'keepalives': 0, 'handshakes': 0, 'degraded': 0, 'lost': 0, 'recovered': 0,
+                             'detect_ms_last': None, 'recover_ms_last': None}
+        self.__detect_histogram = self.metrics.histogram('tello_link_detect_seconds',
+                                                         'From the last packet received to link declared lost')
+        self.__recover_histogram = self.metrics.histogram('tello_link_recover_seconds',
+                                                          'From link declared lost to Tello answering again')
+        self.metrics.add_collector('tello_link', self.get_tello_link_stats,
+                                   ('keepalives', 'handshakes', 'degraded', 'lost', 'recovered'),
+                                   'Link to Tello, state is index of {}'.format(_LINK_STATES))
 
         # Create a UDP sockets for receiving Tello state
         self.socket_state = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket_state.bind(self.local_address_state)
+        self.socket_state.settimeout(_TIMEOUT_SOCKET)
         # Creating thread for receiving Tello state
         self.thread_tello_receive_state = threading.Thread(target=self.tello_receive_state)
         self.thread_tello_receive_state.start()
-        print("Starting tello_receive_state thread")
+        log("Starting tello_receive_state thread")
 
         # Create a UDP sockets for command/response Tello
         self.socket_command_response = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket_command_response.bind(self.local_address_command_response)
+        self.socket_command_response.settimeout(_TIMEOUT_SOCKET)
         # Creating thread for command/response Tello
         self.thread_tello_receive_response = threading.Thread(target=self.tello_receive_response)
         self.thread_tello_receive_response.start()
-        print("Starting tello_receive_response thread")
+        log("Starting tello_receive_response thread")
 
-        # Creating thread for wake Tello
-        self.thread_tello_wake = threading.Thread(target=self.tello_wake)
-        self.thread_tello_wake.start()
-        print("Starting tello_wake thread")
+        # Creating thread for sending queued commands
+        self.thread_tello_command_scheduler = threading.Thread(target=self.tello_command_scheduler)
+        self.thread_tello_command_scheduler.start()
+        log("Starting tello_command_scheduler thread")
+
+        # Creating thread for watching the link and keeping Tello awake
+        self.thread_tello_supervise_link = threading.Thread(target=self.tello_supervise_link)
+        self.thread_tello_supervise_link.start()
+        log("Starting tello_supervise_link thread")
 
     def tello_receive_state(self):
         '''
@@ -94,70 +1017,424 @@ class RyzeTello():
             o agy: Acceleration y,
             o agz: Acceleration z,
         '''
-        while not self.socket_state._closed: 
+        while not self.__closing.is_set():
             try:
                 state = self.socket_state.recv(1024)
-                state_list = state.decode("utf-8")[:-3].split(';')
-                self.__tello_state = dict([tuple(param.split(':')) for param in state_list])
+                self.__last_state_at = time.monotonic()
+                if parse_tello_state(state, self.__tello_state_spare):
+                    self.__tello_state_spare.timestamp = self.__last_state_at
+                    self.__tello_state, self.__tello_state_spare = self.__tello_state_spare, self.__tello_state
+                    self.__tello_state_packets += 1
+                    if self.tello_state_history is not None:
+                        self.tello_state_history.append(self.__tello_state)
+                    if self.flight_recorder is not None:
+                        self.flight_recorder.write_state(self.__tello_state)
+                    for subscriber in self.__tello_state_subscribers:
+                        try:
+                            subscriber(self.__tello_state)
+                        except Exception as ex:
+                            log('Exception in tello_receive_state subscriber', ex)
+                else:
+                    self.__tello_state_errors += 1
+            except socket.timeout:
+                continue
             except Exception as ex:
-                print ('Exception in tello_receive_state', ex)
-        print ("Socket on {} port is closed. Exiting tello_receive_state...".format(self.local_address_state[1]))
+                log('Exception in tello_receive_state', ex)
+        log("Exiting tello_receive_state...")
 
     def get_tello_state(self):
+        '''
+        Return the latest TelloState
+        Record is reused for the packet after the next one, call copy() to keep it longer
+        '''
         return self.__tello_state
 
+    def subscribe_state(self, callback):
+        '''
+        Call callback(TelloState) from receive thread for every parsed state packet
+        Record is reused like the one of get_tello_state(), callback must not block
+        '''
+        self.__tello_state_subscribers = self.__tello_state_subscribers + [callback]
+
+    def unsubscribe_state(self, callback):
+        self.__tello_state_subscribers = [subscriber for subscriber in self.__tello_state_subscribers if subscriber != callback]
+
+    def get_tello_state_errors(self):
+        '''
+        Return number of malformed state packets
+        '''
+        return self.__tello_state_errors
+
+    def get_tello_state_stats(self):
+        '''
+        Return dict: packets (parsed), errors (malformed) and bat, h, tof, temph of the latest state
+        '''
+        state = self.__tello_state
+        return {'packets': self.__tello_state_packets, 'errors': self.__tello_state_errors,
+                'bat': state.bat, 'h': state.h, 'tof': state.tof, 'temph': state.temph}
+
     def tello_receive_response(self):
         '''
         Fuction receives response from Tello and assign it to variable tello_response
-        Then print it in console
+        Then complete the command waiting for it (see TelloCommandMatcher) and print it in console
         '''
-        while not self.socket_command_response._closed:
+        while not self.__closing.is_set():
             try:
                 response = self.socket_command_response.recv(1024)
+                if not response:
+                    continue
+                self.__last_response_at = time.monotonic()
                 self.__tello_response = response.decode(encoding="utf-8")
-                print(self.__tello_response)
+                command = self.__command_matcher.match(self.__tello_response)
+                if command is not None:
+                    self.__rtt_histogram.observe(command.rtt() / 1000)
+                    # Other commands answer after flight, only these measure the link
+                    if command.command == 'command' or command.command.endswith('?'):
+                        rtt = command.rtt()
+                        self.__rtt_ewma = rtt if self.__rtt_ewma is None else 0.8 * self.__rtt_ewma + 0.2 * rtt
+                if self.flight_recorder is not None:
+                    self.flight_recorder.write_response(self.__tello_response, command)
+                log(self.__tello_response)
+            except socket.timeout:
+                continue
             except OSError as os_error:
-                print('Exception in tello_receive_response', os_error)
+                log('Exception in tello_receive_response', os_error)
             except UnicodeDecodeError as decode_error:     
-                print('Exception in tello_receive_response', decode_error)
+                log('Exception in tello_receive_response', decode_error)
             except Exception as ex:
-                print('Exception in tello_receive_response', ex)
-        print ("Socket on {} port is closed. Exiting tello_receive_response...".format(self.local_address_command_response[1]))
+                log('Exception in tello_receive_response', ex)
+        log("Exiting tello_receive_response...")
 
     def get_tello_response(self):
         return self.__tello_response
 
-    def tello_send_command(self, command_to_tello='command'):
+    def get_tello_command_stats(self):
         '''
-        Function send command to Tello and wait for response not more then timeout=3000 ms
+        Return copy of command counters as dict:
+        sent, completed, timeouts, late (response after timeout), unmatched (response without command),
+        dropped (timed out commands given up because their responses were lost)
         '''
-        self.__tello_response = ''
+        return self.__command_matcher.get_stats()
+
+    def tello_send_command_async(self, command_to_tello='command', timeout=None):
+        '''
+        Function send command to Tello without waiting for response
+        Return TelloCommand handle completed when response arrives
+        timeout - timeout in ms to wait response (default is timeout_response plus flight time, see command_timeout)
+        '''
+        command = TelloCommand(command_to_tello, command_timeout(command_to_tello, self.timeout_response) if timeout is None else timeout)
+        self.__send_command(command)
+        return command
 
-        print(command_to_tello)
+    def __send_command(self, command):
+        log(command.command)
+        self.__tello_response = ''
+        command.sent_at = time.monotonic()
+        self.__last_command_at = command.sent_at
+        if command.command in ('streamon', 'streamoff'):
+            self.__is_streaming = command.command == 'streamon'
+        # Register before sending, so that a fast response always finds its command
+        self.__command_matcher.add(command)
+        if self.flight_recorder is not None:
+            self.flight_recorder.write_command(command)
         try:
-            self.socket_command_response.sendto(command_to_tello.encode(encoding="utf-8"), self.tello_address_command_response)
+            self.socket_command_response.sendto(command.command.encode(encoding="utf-8"), self.tello_address_command_response)
         except Exception as ex:
-            print("Exception in tello_send_command", ex)
-        timeout = self.timeout_response
-        while not self.__tello_response:
-            time.sleep(0.05)
-            timeout -= 50
-            if not timeout:
-                print("Tello doesn't response to command '{}'.".format(command_to_tello))
-                break
+            log("Exception in tello_send_command", ex)
+
+    def tello_send_command(self, command_to_tello='command', timeout=None):
+        '''
+        Function send command to Tello and wait for response not more then timeout ms (see tello_send_command_async)
+        Return response as str or None if Tello doesn't response
+        '''
+        command = self.tello_send_command_async(command_to_tello, timeout)
+        command.wait()
+        self.__command_matcher.expire()
+        if command.response is None:
+            log("Tello doesn't response to command '{}'.".format(command_to_tello))
+        return command.response
+
+    def tello_queue_command(self, command_to_tello, timeout=None):
+        '''
+        Function queue command to Tello without blocking
+        Commands are sent by tello_command_scheduler one by one, the next one after response to the previous
+        'emergency', 'land' and 'stop' are sent at once and cancel all queued commands
+        Movement command identical to a queued or not yet answered one is not queued again,
+        the handle of that command is returned instead (e.g. key repeat), so is 'land' or 'stop'
+        identical to a not yet answered one, while 'emergency' is always sent
+        Return TelloCommand handle, its timeout starts when command is sent
+        '''
+        command = TelloCommand(command_to_tello, command_timeout(command_to_tello, self.timeout_response) if timeout is None else timeout)
+        command.queued_at = time.monotonic()
+        name = command_to_tello.split(' ', 1)[0]
+        with self.__command_queue_condition:
+            if name in _PRIORITY_COMMANDS:
+                while self.__command_queue:
+                    self.__command_queue.popleft()._cancel()
+                    self.__queue_stats['cancelled'] += 1
+                priority_command = self.__priority_command
+                if (name != 'emergency' and priority_command is not None and not priority_command.done()
+                        and priority_command.command == command_to_tello):
+                    self.__queue_stats['coalesced'] += 1
+                    return priority_command
+                self.__queue_stats['queued'] += 1
+                self.__send_command(command)
+                self.__update_queue_stats(command)
+                self.__priority_command = command
+                return command
+            if name in _COALESCED_COMMANDS:
+                for queued_command in (self.__command_in_flight, *self.__command_queue):
+                    if queued_command is not None and queued_command.command == command_to_tello:
+                        self.__queue_stats['coalesced'] += 1
+                        return queued_command
+            self.__command_queue.append(command)
+            self.__queue_stats['queued'] += 1
+            self.__command_queue_condition.notify()
+        return command
+
+    def __update_queue_stats(self, command):
+        '''
+        Must be called with __command_queue_condition held
+        '''
+        wait_time = command.wait_time()
+        self.__queue_stats['sent'] += 1
+        self.__queue_stats['wait_ms_last'] = wait_time
+        self.__queue_stats['wait_ms_max'] = max(wait_time, self.__queue_stats['wait_ms_max'] or 0)
+        self.__queue_stats['wait_ms_total'] += wait_time
+
+    def get_tello_queue_stats(self):
+        '''
+        Return copy of command queue counters as dict:
+        depth, queued, sent, coalesced, cancelled, wait_ms_last, wait_ms_max, wait_ms_avg (time in queue before sending)
+        '''
+        with self.__command_queue_condition:
+            stats = dict(self.__queue_stats)
+            stats['depth'] = len(self.__command_queue)
+        wait_ms_total = stats.pop('wait_ms_total')
+        stats['wait_ms_avg'] = wait_ms_total / stats['sent'] if stats['sent'] else None
+        return stats
+
+    def tello_command_scheduler(self):
+        '''
+        Function send queued commands one by one and wait for response to each
+        '''
+        while not self.__closing.is_set():
+            with self.__command_queue_condition:
+                while not self.__command_queue and not self.__closing.is_set():
+                    self.__command_queue_condition.wait()
+                if self.__closing.is_set():
+                    break
+                command = self.__command_queue.popleft()
+                self.__command_in_flight = command
+                self.__send_command(command)
+                self.__update_queue_stats(command)
+            command.wait()
+            self.__command_matcher.expire()
+            with self.__command_queue_condition:
+                self.__command_in_flight = None
+        log("Exiting tello_command_scheduler...")
 
-    def tello_wake(self):
+    def tello_rc_start(self, rate=_RC_RATE, failsafe=_RC_FAILSAFE):
         '''
-        Function send 'command' to Tello every 10 sec
+        Function start sending 'rc a b c d' with given rate in Hz from tello_rc_sender thread
+        Sticks are set by tello_rc_set, if they are not set during failsafe ms zero sticks are sent
+        rc is sent without waiting for response, Tello doesn't answer it
         '''
-        while not self.socket_command_response._closed:
+        if self.thread_tello_rc_sender is not None and self.thread_tello_rc_sender.is_alive():
+            return
+        self.rc_rate = rate
+        self.rc_failsafe = failsafe
+        self.__rc_sticks = (0, 0, 0, 0)
+        self.__rc_sticks_time = time.monotonic()
+        self.__rc_stats = {'sent': 0, 'failsafes': 0, 'jitter_ms_max': 0, 'jitter_ms_total': 0, 'jitter_ms_squares': 0}
+        self.__rc_stop.clear()
+        self.thread_tello_rc_sender = threading.Thread(target=self.tello_rc_sender)
+        self.thread_tello_rc_sender.start()
+        log("Starting tello_rc_sender thread")
+
+    def tello_rc_set(self, a=0, b=0, c=0, d=0):
+        '''
+        Function set sticks sent by tello_rc_sender, values are clipped to -100..100
+        a - left/right, b - forward/backward, c - up/down, d - yaw
+        '''
+        self.__rc_sticks = tuple(max(-100, min(100, int(stick))) for stick in (a, b, c, d))
+        self.__rc_sticks_time = time.monotonic()
+
+    def tello_rc_stop(self):
+        '''
+        Function stop tello_rc_sender thread, it sends zero sticks before exit
+        '''
+        self.__rc_stop.set()
+        if self.thread_tello_rc_sender is not None and threading.current_thread() is not self.thread_tello_rc_sender:
+            self.thread_tello_rc_sender.join()
+
+    def get_tello_rc_stats(self):
+        '''
+        Return dict of rc sender counters: sent, failsafes (zero sticks sent as input stopped),
+        jitter_ms_mean, jitter_ms_stdev, jitter_ms_max (deviation of send interval from 1 / rc_rate)
+        '''
+        stats = dict(self.__rc_stats)
+        intervals = stats['sent'] - 1
+        jitter_ms_total = stats.pop('jitter_ms_total')
+        jitter_ms_squares = stats.pop('jitter_ms_squares')
+        if intervals > 0:
+            stats['jitter_ms_mean'] = jitter_ms_total / intervals
+            stats['jitter_ms_stdev'] = max(0, jitter_ms_squares / intervals - stats['jitter_ms_mean'] ** 2) ** 0.5
+        else:
+            stats['jitter_ms_mean'] = stats['jitter_ms_stdev'] = None
+        return stats
+
+    def tello_rc_sender(self):
+        '''
+        Function send 'rc a b c d' every 1 / rc_rate sec until tello_rc_stop or close
+        '''
+        period = 1 / self.rc_rate
+        next_time = time.monotonic()
+        last_time = None
+        is_failsafe = False
+        while not self.__rc_stop.is_set() and not self.__closing.is_set():
+            now = time.monotonic()
+            if now - self.__rc_sticks_time > self.rc_failsafe / 1000:
+                if not is_failsafe:
+                    self.__rc_stats['failsafes'] += 1
+                    is_failsafe = True
+                sticks = (0, 0, 0, 0)
+            else:
+                is_failsafe = False
+                sticks = self.__rc_sticks
+            rc_command = 'rc {} {} {} {}'.format(*sticks)
+            self.__last_command_at = now
+            if self.flight_recorder is not None:
+                self.flight_recorder.write_command(rc_command)
+            try:
+                self.socket_command_response.sendto(rc_command.encode(encoding="utf-8"),
+                                                    self.tello_address_command_response)
+            except Exception as ex:
+                log('Exception in tello_rc_sender', ex)
+            if last_time is not None:
+                jitter = abs(now - last_time - period) * 1000
+                self.__rc_stats['jitter_ms_total'] += jitter
+                self.__rc_stats['jitter_ms_squares'] += jitter * jitter
+                self.__rc_stats['jitter_ms_max'] = max(jitter, self.__rc_stats['jitter_ms_max'])
+            self.__rc_stats['sent'] += 1
+            last_time = now
+            next_time += period
+            # Don't send a burst after a stall, keep the rate instead
+            if next_time < now:
+                next_time = now + period
+            self.__rc_stop.wait(max(0, next_time - time.monotonic()))
+        if not self.__closing.is_set():
             try:
-                self.tello_send_command()
-                time.sleep(self.timeout_sleep)    
+                self.socket_command_response.sendto(b'rc 0 0 0 0', self.tello_address_command_response)
             except Exception as ex:
-                print ('Exception in tello_wake', ex)
-        print ("Socket on {} port is closed. Exiting tello_wake...".format(self.local_address_command_response[1]))
+                log('Exception in tello_rc_sender', ex)
+        log("Exiting tello_rc_sender...")
+
+    def tello_supervise_link(self):
+        '''
+        Function watches the link to Tello every 0.1 sec
+        Link is degraded when nothing was received for link_degraded sec or average round trip time
+        of 'command' and read commands exceeds link_rtt_degraded ms, lost after link_lost sec
+        While link is connecting or lost, 'command' is sent like by tello_send_command_async
+        with backoff from 0.5 to 8 sec, the next one after the previous is answered or timed out.
+        When Tello answers again commands timed out while link was lost are forgotten, handshake still
+        waiting is timed out (its response is taken as late, not by the next command) and 'streamon'
+        is sent too if video stream was on
+        While link is up, keepalive 'command' is sent only if no command was sent for timeout_sleep sec
+        '''
+        backoff = _RECONNECT_BACKOFF[0]
+        handshake_at = 0
+        handshake = None
+        while not self.__closing.is_set():
+            try:
+                now = time.monotonic()
+                received_at = max(self.__last_state_at or 0, self.__last_response_at or 0)
+                if self.__link_state in ('connecting', 'lost'):
+                    # Responses to handshakes sent while Tello was away are taken as late, any packet will do
+                    if received_at > self.__link_changed_at:
+                        self.__command_matcher.clear_orphans()
+                        if handshake is not None:
+                            self.__command_matcher.time_out(handshake)
+                            handshake = None
+                        if self.__link_state == 'lost':
+                            recover_time = now - self.__link_changed_at
+                            self.__recover_histogram.observe(recover_time)
+                            self.__link_stats['recovered'] += 1
+                            self.__link_stats['recover_ms_last'] = recover_time * 1000
+                            if self.__is_streaming:
+                                self.tello_send_command_async('streamon')
+                        self.__set_link_state('ok', now)
+                        backoff = _RECONNECT_BACKOFF[0]
+                    elif now >= handshake_at and (handshake is None or handshake.done()):
+                        handshake = self.tello_send_command_async('command')
+                        self.__link_stats['handshakes'] += 1
+                        handshake_at = now + backoff
+                        backoff = min(backoff * 2, _RECONNECT_BACKOFF[1])
+                else:
+                    silence = now - received_at
+                    if silence >= self.link_lost:
+                        self.__detect_histogram.observe(silence)
+                        self.__link_stats['lost'] += 1
+                        self.__link_stats['detect_ms_last'] = silence * 1000
+                        self.__set_link_state('lost', now)
+                        handshake_at = now
+                        continue
+                    rtt = self.__rtt_ewma
+                    if silence >= self.link_degraded or rtt is not None and rtt >= self.link_rtt_degraded:
+                        if self.__link_state != 'degraded':
+                            self.__link_stats['degraded'] += 1
+                            self.__set_link_state('degraded', now)
+                    elif self.__link_state != 'ok':
+                        self.__set_link_state('ok', now)
+                    if now - self.__last_command_at >= self.timeout_sleep:
+                        self.tello_send_command_async('command')
+                        self.__link_stats['keepalives'] += 1
+                self.__command_matcher.expire()
+            except Exception as ex:
+                log('Exception in tello_supervise_link', ex)
+            self.__closing.wait(_LINK_CHECK)
+        log("Exiting tello_supervise_link...")
+
+    def __set_link_state(self, link_state, now):
+        log("Link to Tello {} -> {}".format(self.__link_state, link_state))
+        self.__link_state = link_state
+        self.__link_changed_at = now
+
+    def get_tello_link_state(self):
+        '''
+        Return state of link to Tello: 'connecting', 'ok', 'degraded' or 'lost'
+        '''
+        return self.__link_state
+
+    def get_tello_link_stats(self):
+        '''
+        Return dict of link counters: state (index in connecting, ok, degraded, lost), keepalives, handshakes,
+        degraded, lost, recovered (times link changed to), detect_ms_last (silence before link was declared lost),
+        recover_ms_last (from lost to Tello answering), silence_ms (since the last packet), rtt_ms_avg
+        '''
+        stats = dict(self.__link_stats)
+        received_at = max(self.__last_state_at or 0, self.__last_response_at or 0)
+        stats['state'] = _LINK_STATES.index(self.__link_state)
+        stats['silence_ms'] = (time.monotonic() - received_at) * 1000 if received_at else None
+        stats['rtt_ms_avg'] = self.__rtt_ewma
+        return stats
 
     def close(self):
+        '''
+        Stop threads and close sockets
+        Receive threads wake every 0.2 sec to check for close, so close takes not more than that
+        '''
+        self.__closing.set()
+        self.tello_rc_stop()
+        with self.__command_queue_condition:
+            while self.__command_queue:
+                self.__command_queue.popleft()._cancel()
+            if self.__command_in_flight is not None:
+                self.__command_in_flight._cancel()
+            self.__command_queue_condition.notify_all()
+        for thread in (self.thread_tello_receive_state, self.thread_tello_receive_response,
+                       self.thread_tello_command_scheduler, self.thread_tello_supervise_link):
+            if thread is not threading.current_thread():
+                thread.join()
         self.socket_state.close()
         self.socket_command_response.close()
@@ -0,0 +1,254 @@
+import asyncio
+import time
+
+import ryze_tello
+
+
+class AsyncTelloCommand():
+    '''
+    Awaitable handle of a single command sent to Tello by AsyncRyzeTello
+    Has the same attributes as ryze_tello.TelloCommand
+    Must be created inside running event loop
+    '''
+
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.response = None
+        self.sent_at = None
+        self.received_at = None
+        self.timed_out = False
+        self.__future = asyncio.get_running_loop().create_future()
+
+    def done(self):
+        return self.__future.done()
+
+    async def wait(self, timeout=None):
+        '''
+        Wait for response not more then timeout ms (default is timeout of command)
+        Return response as str or None if Tello doesn't response
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(self.__future), max(0, timeout - self.elapsed()) / 1000)
+        except asyncio.TimeoutError:
+            pass
+        return self.response
+
+    def elapsed(self):
+        if self.sent_at is None:
+            return 0
+        return (time.monotonic() - self.sent_at) * 1000
+
+    def rtt(self):
+        if self.received_at is None:
+            return None
+        return (self.received_at - self.sent_at) * 1000
+
+    def _complete(self, response):
+        self.response = response
+        self.received_at = time.monotonic()
+        if not self.__future.done():
+            self.__future.set_result(response)
+
+    def _expire(self):
+        self.timed_out = True
+        if not self.__future.done():
+            self.__future.set_result(None)
+
+
+class _TelloDatagramProtocol(asyncio.DatagramProtocol):
+    '''
+    Pass every received datagram to callback
+    '''
+
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+
+    def datagram_received(self, data, addr):
+        self.callback(data)
+
+    def error_received(self, exc):
+        ryze_tello.log('Exception in {}'.format(self.name), exc)
+
+
+class AsyncRyzeTello():
+    '''
+    Class describes Ryze Tello interact over asyncio datagram endpoints
+    All links run on one event loop without own threads
+    Arguments and defaults are the same as ryze_tello.RyzeTello (video arguments are kept for the UI)
+    Sockets are opened by start() and closed by close(), or use instance as async context manager:
+
+        async with AsyncRyzeTello() as tello:
+            await tello.tello_send_command('takeoff')
+            async for state in tello.tello_state_stream():
+                ...
+    '''
+
+    def __init__(self, local_address_state=ryze_tello._LOCAL_ADDRESS_STATE,
+                    local_address_command_response=ryze_tello._LOCAL_ADDRESS_COMMAND_RESPONSE,
+                    tello_address_command_response=ryze_tello._TELLO_ADDRESS_COMMAND_RESPONSE,
+                    tello_video_stream=ryze_tello._TELLO_VIDEO_STREAM,
+                    timeout_response=ryze_tello._TIMEOUT_RESPONSE,timeout_sleep=ryze_tello._TIMEOUT_SLEEP,
+                    frame_rate=ryze_tello._FRAME_RATE,frame_width=ryze_tello._FRAME_WIDTH,
+                    frame_height=ryze_tello._FRAME_HEIGHT,tello_state_history=None):
+        self.__tello_state = ryze_tello.TelloState()
+        self.__tello_state_spare = ryze_tello.TelloState()
+        self.__tello_state_errors = 0
+        self.__tello_response = ''
+        self.__command_matcher = ryze_tello.TelloCommandMatcher()
+        self.__state_queues = set()
+        self.__last_command_at = 0
+
+        self.local_address_state = local_address_state
+        self.local_address_command_response = local_address_command_response
+        self.tello_address_command_response = tello_address_command_response
+        self.tello_video_stream = tello_video_stream
+        self.timeout_response = timeout_response
+        self.timeout_sleep = timeout_sleep
+        self.frame_rate = frame_rate
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.tello_state_history = tello_state_history
+
+        self.transport_state = None
+        self.transport_command_response = None
+        self.task_tello_wake = None
+
+    async def start(self):
+        '''
+        Open datagram endpoints and start keepalive task
+        '''
+        loop = asyncio.get_running_loop()
+        self.transport_state, _ = await loop.create_datagram_endpoint(
+            lambda: _TelloDatagramProtocol(self.tello_receive_state, 'tello_receive_state'),
+            local_addr=self.local_address_state)
+        self.transport_command_response, _ = await loop.create_datagram_endpoint(
+            lambda: _TelloDatagramProtocol(self.tello_receive_response, 'tello_receive_response'),
+            local_addr=self.local_address_command_response)
+        self.task_tello_wake = loop.create_task(self.tello_wake())
+        return self
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def tello_receive_state(self, state):
+        '''
+        Parse Tello state (see ryze_tello.RyzeTello.tello_receive_state)
+        and pass its copy to every state stream
+        '''
+        if not ryze_tello.parse_tello_state(state, self.__tello_state_spare):
+            self.__tello_state_errors += 1
+            return
+        self.__tello_state_spare.timestamp = time.monotonic()
+        self.__tello_state, self.__tello_state_spare = self.__tello_state_spare, self.__tello_state
+        if self.tello_state_history is not None:
+            self.tello_state_history.append(self.__tello_state)
+        for queue in self.__state_queues:
+            # Slow stream loses the oldest state, not the newest one
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(self.__tello_state.copy())
+
+    def get_tello_state(self):
+        return self.__tello_state
+
+    def get_tello_state_errors(self):
+        return self.__tello_state_errors
+
+    async def tello_state_stream(self, maxsize=1):
+        '''
+        Async generator of Tello states as they arrive
+        maxsize - number of states kept for slow consumer, older states are dropped
+        '''
+        queue = asyncio.Queue(maxsize)
+        self.__state_queues.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.__state_queues.discard(queue)
+
+    def tello_receive_response(self, response):
+        '''
+        Complete the command waiting for response (see ryze_tello.TelloCommandMatcher)
+        '''
+        try:
+            self.__tello_response = response.decode(encoding="utf-8")
+        except UnicodeDecodeError as decode_error:
+            ryze_tello.log('Exception in tello_receive_response', decode_error)
+            return
+        self.__command_matcher.match(self.__tello_response)
+        ryze_tello.log(self.__tello_response)
+
+    def get_tello_response(self):
+        return self.__tello_response
+
+    def get_tello_command_stats(self):
+        return self.__command_matcher.get_stats()
+
+    def tello_send_command_nowait(self, command_to_tello='command', timeout=None):
+        '''
+        Send command to Tello without waiting for response
+        Return AsyncTelloCommand completed when response arrives
+        timeout - timeout in ms to wait response (default is timeout_response plus flight time, see ryze_tello.command_timeout)
+        '''
+        command = AsyncTelloCommand(command_to_tello, ryze_tello.command_timeout(command_to_tello, self.timeout_response)
+                                                      if timeout is None else timeout)
+        ryze_tello.log(command_to_tello)
+        self.__tello_response = ''
+        command.sent_at = time.monotonic()
+        self.__last_command_at = command.sent_at
+        self.__command_matcher.add(command)
+        try:
+            self.transport_command_response.sendto(command_to_tello.encode(encoding="utf-8"), self.tello_address_command_response)
+        except Exception as ex:
+            ryze_tello.log("Exception in tello_send_command", ex)
+        return command
+
+    async def tello_send_command(self, command_to_tello='command', timeout=None):
+        '''
+        Send command to Tello and wait for response not more then timeout_response ms
+        Return response as str or None if Tello doesn't response
+        '''
+        command = self.tello_send_command_nowait(command_to_tello, timeout)
+        await command.wait()
+        self.__command_matcher.expire()
+        if command.response is None:
+            ryze_tello.log("Tello doesn't response to command '{}'.".format(command_to_tello))
+        return command.response
+
+    async def tello_wake(self):
+        '''
+        Send 'command' to Tello at start, then only when no command was sent for timeout_sleep sec,
+        like keepalive of ryze_tello.RyzeTello.tello_supervise_link
+        '''
+        while not self.transport_command_response.is_closing():
+            try:
+                idle = time.monotonic() - self.__last_command_at
+                if idle >= self.timeout_sleep:
+                    await self.tello_send_command()
+                else:
+                    await asyncio.sleep(self.timeout_sleep - idle)
+            except asyncio.CancelledError:
+                break
+            except Exception as ex:
+                ryze_tello.log('Exception in tello_wake', ex)
+        ryze_tello.log("Exiting tello_wake...")
+
+    async def close(self):
+        if self.task_tello_wake is not None:
+            self.task_tello_wake.cancel()
+            try:
+                await self.task_tello_wake
+            except asyncio.CancelledError:
+                pass
+        if self.transport_state is not None:
+            self.transport_state.close()
+        if self.transport_command_response is not None:
+            self.transport_command_response.close()
@@ -1,9 +1,12 @@
 import ryze_tello
+import ryze_tello_metrics
+import ryze_tello_recorder
+import ryze_tello_stream
 
 import pygame
 import os
 import cv2
-import datetime
+import numpy
 import threading
 
 _DIR_SNAPSHOT = 'img'
@@ -22,6 +25,15 @@ class RyzeTelloUI:
     main_window_caption = 'DJI Ryze Tello Control' - main windows caption
     main_window_x_y = '310, 30' - main windows position (x,y) at start
     filename_intro = 'tello.jpg' - intro pic filename
+    record_decoded = False - record decoded frames (e.g. to add overlays) by encoding them again,
+                             otherwise video stream is recorded as received from Tello
+    frame_bus = None - name of shared memory block to publish decoded frames to other processes
+                       by ryze_tello_framebus.TelloFramePublisher
+    metrics_address = None - socket as tuple to serve metrics for Prometheus at http://<address>/metrics
+    flight_log = None - directory to save flight log of states, commands and video
+                        by ryze_tello_flightlog.TelloFlightRecorder
+    vision_stage = None - ryze_tello_vision.TelloVisionStage to analyze decoded frames in worker processes,
+                          its callback gets results tagged with frame timestamps
     '''
 
     __FPS = 30
@@ -33,15 +45,36 @@ class RyzeTelloUI:
     __BLUE_COLOR = (0, 0, 255)
     __BLACK_COLOR = (0, 0, 0)
     __FONT_NAME = 'Microsoft Sans Serif'
+    __RC_SPEED = 50
+    __SNAPSHOT_BURST = 10
+    __PRE_TRIGGER = 10 # in sec
+    __TIMEOUT_VIDEO_STOP = 2 # in sec
+    __TEXT_CACHE_SIZE = 1024 # rendered text surfaces
+    __TELLO_STATE_TEMPLATE = {'pitch':    ["Attitude pitch {} degree    ",(40, 5)],
+                              'roll' :    ["Attitude roll  {} degree    ",(40, 20)],
+                              'yaw'  :    ["Attitude yaw   {} degree    ",(40, 35)],
+                              'vgx'  :    ["Speed x        {} m/s       ",(40, 50)],
+                              'vgy'  :    ["Speed y        {} m/s       ",(40, 65)],
+                              'vgz'  :    ["Speed z        {} m/s       ",(40, 80)],
+                              'templ':    ["Lowest temperature  {} °C   ",(330, 5)],
+                              'temph':    ["Highest temperature {} °C   ",(330, 20)],
+                              'tof'  :    ["TOF distance   {} cm    ",(330, 35)],
+                              'h'    :    ["Height         {} cm    ",(330, 50)],
+                              'bat'  :    ["Current battery percentage {} %     ",(330, 65)],
+                              'baro' :    ["Barometer measurement  {} cm   ",(660, 5)],
+                              'time' :    ["Motors on time   {}    ",(660, 20)],
+                              'agx'  :    ["Acceleration x   {}    ",(660, 35)],
+                              'agy'  :    ["Acceleration y   {}    ",(660, 50)],
+                              'agz'  :    ["Acceleration z   {}    ",(660, 65)]}
 
     def __init__(self, tello, dir_snapshot=_DIR_SNAPSHOT, dir_video=_DIR_VIDEO,
                 main_window_caption=_MAIN_WINDOW_CAPTION, main_window_x_y=_MAIN_WINDOW_X_Y,
-                filename_intro=_FILENAME_INTRO):
+                filename_intro=_FILENAME_INTRO, record_decoded=False, frame_bus=None,
+                metrics_address=None, flight_log=None, vision_stage=None):
 
-        self.is_recording = False
-        self.is_recording_stop = False
-        self.is_snapshortting = False
         self.is_broadcasting = False
+        self.is_broadcast_stop = False
+        self.is_rc_mode = False
 
         self.tello = tello
         self.dir_snapshot = dir_snapshot
@@ -53,10 +86,54 @@ class RyzeTelloUI:
         pygame.init()
         self.tello_ui = pygame.display.set_mode((self.tello.frame_width + 20, self.tello.frame_height + 100))
         pygame.display.set_caption(self.main_window_caption)
-        self.surf_rec_indicator = pygame.Surface((100, 40))
-        self.surf_rec_indicator.set_colorkey(self.__BLACK_COLOR)
-        self.surf_video = pygame.Surface((self.tello.frame_width, self.tello.frame_height))
-        self.surf_state = pygame.Surface((self.tello.frame_width + 20, 100))
+        # Decoder writes RGB frames into preallocated arrays, each wrapped once by a surface sharing its memory
+        self.frame_bgr = numpy.empty((self.tello.frame_height, self.tello.frame_width, 3), numpy.uint8)
+        frame_buffers = []
+        for _ in range(3):
+            frame_rgb = numpy.empty((self.tello.frame_height, self.tello.frame_width, 3), numpy.uint8)
+            frame_buffers.append((frame_rgb, pygame.image.frombuffer(frame_rgb, (self.tello.frame_width, self.tello.frame_height), 'RGB')))
+        self.frame_mailbox = ryze_tello.TelloFrameMailbox(frame_buffers)
+        self.recorder = ryze_tello_recorder.TelloRecorder(self.tello.frame_width, self.tello.frame_height,
+                                                          self.tello.frame_rate, self.dir_snapshot, self.dir_video,
+                                                          metrics=self.tello.metrics)
+        self.stream_recorder = ryze_tello_stream.TelloStreamRecorder(self.dir_video, frame_rate=self.tello.frame_rate,
+                                                                     pre_trigger=self.__PRE_TRIGGER)
+        self.video_recorder = self.recorder if record_decoded else self.stream_recorder
+        self.tello.metrics.add_collector('tello_stream_recorder', self.stream_recorder.get_stats,
+                                         ('datagrams', 'access_units', 'bytes', 'skipped'), 'Recorder of video stream')
+        # Frames taken from mailbox are presented, frames replaced before UI took them are dropped
+        self.tello.metrics.add_collector('tello_frames', self.frame_mailbox.get_stats, ('published', 'taken', 'dropped'),
+                                         'Decoded frames presented by UI')
+        self.metrics_server = None
+        if metrics_address is not None:
+            self.metrics_server = ryze_tello_metrics.TelloMetricsServer(self.tello.metrics, metrics_address)
+        self.tello_video = None
+        self.tello_stream = None
+        self.frame_publisher = None
+        if frame_bus is not None:
+            import ryze_tello_framebus
+
+            self.frame_publisher = ryze_tello_framebus.TelloFramePublisher(frame_bus, self.tello.frame_width,
+                                                                           self.tello.frame_height)
+        self.vision_stage = vision_stage
+        if self.vision_stage is not None:
+            self.tello.metrics.add_collector('tello_vision', self.vision_stage.get_stats,
+                                             ('submitted', 'skipped', 'completed', 'late', 'errors', 'torn'),
+                                             'Analysis of decoded frames')
+        self.flight_recorder = None
+        if flight_log is not None:
+            import ryze_tello_flightlog
+
+            self.flight_recorder = ryze_tello_flightlog.TelloFlightRecorder(flight_log)
+            self.tello.flight_recorder = self.flight_recorder
+        # Main window loop is the only one drawing, changed areas are collected and updated once per loop
+        self.dirty_rects = []
+        self.__fonts = {}
+        self.__text_cache = {}
+        # Field of state panel -> (value, color, rect) drawn last time
+        self.__state_drawn = {}
+        self.rect_video = pygame.Rect(10, 0, self.tello.frame_width, self.tello.frame_height)
+        self.surf_rec_text = self.get_font(36, bold=1).render("REC",True,self.__RED_COLOR)
     
         self.start = self.intro_window()
         if self.start:
@@ -75,12 +152,40 @@ class RyzeTelloUI:
                 return True
         else:
             pygame.draw.rect(self.tello_ui, inactive_color,(x_button,y_button,width_button,height_button))
-        font = pygame.font.SysFont(self.__FONT_NAME,20, bold=1)
-        text = font.render(text_button, True, self.__BLACK_COLOR)
+        text = self.render_text(text_button, self.__BLACK_COLOR, 20, bold=1)
         rect = text.get_rect()
         rect.center = ((x_button+(width_button//2)), (y_button+(height_button//2)))
         self.tello_ui.blit(text, rect)
-        pygame.display.flip()
+        self.dirty_rects.append(pygame.Rect(x_button, y_button, width_button, height_button))
+
+    def get_font(self, size, bold=0):
+        '''
+        Return font of given size, fonts are created once, pygame.font.SysFont looks them up slowly
+        '''
+        font = self.__fonts.get((size, bold))
+        if font is None:
+            font = self.__fonts[(size, bold)] = pygame.font.SysFont(self.__FONT_NAME, size, bold=bold)
+        return font
+
+    def render_text(self, text, color, size, bold=0):
+        '''
+        Return surface with rendered text, surfaces are cached by (text, color, size, bold)
+        '''
+        key = (text, color, size, bold)
+        surf_text = self.__text_cache.get(key)
+        if surf_text is None:
+            if len(self.__text_cache) >= self.__TEXT_CACHE_SIZE:
+                self.__text_cache.clear()
+            surf_text = self.__text_cache[key] = self.get_font(size, bold).render(text, True, color)
+        return surf_text
+
+    def update_display(self):
+        '''
+        Update changed areas of window only
+        '''
+        if self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+            self.dirty_rects = []
 
     def intro_window(self):
         '''
@@ -110,6 +215,10 @@ class RyzeTelloUI:
         self.tello_ui.blit(text, (140, 620))
         text = font.render("F1 - Start record      F2 - Stop record      F3 - Take snapshot      F10 - Restart video",True,self.__SILVER_COLOR)
         self.tello_ui.blit(text, (140, 640))
+        text = font.render("F4 - Take 10 snapshots in a row      F5 - Stick mode on/off (continuous rc control)",True,self.__SILVER_COLOR)
+        self.tello_ui.blit(text, (140, 660))
+        text = font.render("F6 - Save incident (10 sec before and 5 sec after)      F1 record starts 10 sec before",True,self.__SILVER_COLOR)
+        self.tello_ui.blit(text, (140, 680))
         pygame.display.flip()
         
         clock = pygame.time.Clock()
@@ -125,11 +234,12 @@ class RyzeTelloUI:
             if bye:
                 self.tello.close()
                 return False
+            self.update_display()
             clock.tick(self.__FPS)
 
     def seek_key_send_command(self,keys):
         '''
-        Seek command in configuration schema and send it to Tello
+        Seek command in configuration schema and queue it to Tello without blocking UI
             pygame.K_q      :   "takeoff",
             pygame.K_SPACE  :   "land",
             pygame.K_UP     :   "forward 50",
@@ -142,43 +252,90 @@ class RyzeTelloUI:
             pygame.K_d      :   "right 50"
         '''
         if keys[pygame.K_q]:
-            self.tello.tello_send_command("takeoff")
+            self.tello.tello_queue_command("takeoff")
             return
         if keys[pygame.K_SPACE]:
-            self.tello.tello_send_command("land")
+            self.tello.tello_queue_command("land")
             return
         if keys[pygame.K_UP]:
-            self.tello.tello_send_command("forward 50")
+            self.tello.tello_queue_command("forward 50")
             return
         if keys[pygame.K_DOWN]:
-            self.tello.tello_send_command("back 50")
+            self.tello.tello_queue_command("back 50")
             return
         if keys[pygame.K_LEFT]:
-            self.tello.tello_send_command("ccw 30")
+            self.tello.tello_queue_command("ccw 30")
             return
         if keys[pygame.K_RIGHT]:
-            self.tello.tello_send_command("cw 30")
+            self.tello.tello_queue_command("cw 30")
             return
         if keys[pygame.K_w]:
-            self.tello.tello_send_command("up 50")
+            self.tello.tello_queue_command("up 50")
             return
         if keys[pygame.K_s]:
-            self.tello.tello_send_command("down 50")
+            self.tello.tello_queue_command("down 50")
             return
         if keys[pygame.K_a]:
-            self.tello.tello_send_command("left 50")
+            self.tello.tello_queue_command("left 50")
             return
         if keys[pygame.K_d]:
-            self.tello.tello_send_command("right 50")
+            self.tello.tello_queue_command("right 50")
             return
 
+    def seek_key_send_rc(self,keys):
+        '''
+        Map pressed keys to sticks of continuous rc control
+            pygame.K_q      :   "takeoff",
+            pygame.K_SPACE  :   "land",
+            pygame.K_UP / pygame.K_DOWN     :   forward / backward
+            pygame.K_LEFT / pygame.K_RIGHT  :   yaw left / right
+            pygame.K_w / pygame.K_s         :   up / down
+            pygame.K_a / pygame.K_d         :   left / right
+        '''
+        if keys[pygame.K_q]:
+            self.tello.tello_queue_command("takeoff")
+        if keys[pygame.K_SPACE]:
+            self.tello.tello_queue_command("land")
+        self.tello.tello_rc_set((keys[pygame.K_d] - keys[pygame.K_a]) * self.__RC_SPEED,
+                                (keys[pygame.K_UP] - keys[pygame.K_DOWN]) * self.__RC_SPEED,
+                                (keys[pygame.K_w] - keys[pygame.K_s]) * self.__RC_SPEED,
+                                (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * self.__RC_SPEED)
+
+    def rc_mode_switch(self):
+        '''
+        Switch between discrete commands and continuous rc control
+        '''
+        self.is_rc_mode = not self.is_rc_mode
+        if self.is_rc_mode:
+            print("Stick mode on")
+            self.tello.tello_rc_start()
+        else:
+            self.tello.tello_rc_stop()
+            print("Stick mode off", self.tello.get_tello_rc_stats())
+
     def broadcast_init(self):
         '''
         Initialize brodcasting
+        Video stream is decoded by PyAV in decoder thread of TelloVideoReceiver if PyAV is installed,
+        otherwise datagrams are relayed to cv2.VideoCapture read by tello_video_broadcast thread
         '''
         self.tello.tello_send_command('streamon')
+        if self.tello_video is None:
+            decoder = ryze_tello_stream.create_decoder()
+            if decoder is not None:
+                self.tello_video = ryze_tello.TelloVideoReceiver(self.tello.local_address_video, relay_address=None,
+                                                                 decoder=decoder, metrics=self.tello.metrics)
+                self.tello_video.subscribe_frames(self.process_video_frame)
+            else:
+                self.tello_video = ryze_tello.TelloVideoReceiver(self.tello.local_address_video, metrics=self.tello.metrics)
+            self.tello_video.subscribe_access_units(self.stream_recorder.write_access_unit)
+            if self.flight_recorder is not None:
+                self.tello_video.subscribe_access_units(self.flight_recorder.write_access_unit)
+        if self.tello_video.decoder is not None:
+            self.is_broadcasting = True
+            return
         try:
-            self.tello_stream = cv2.VideoCapture(self.tello.tello_video_stream)
+            self.tello_stream = cv2.VideoCapture(self.tello_video.relay_stream)
         except Exception as ex:
             print("Exception opening cv2.VideoCapture instance", ex)
         if not self.is_broadcasting:
@@ -187,37 +344,53 @@ class RyzeTelloUI:
 
     def tello_video_broadcast(self):
         '''
-        Read Video stream from Tello and broadcast it in Pygame window
-        If is_snapshortting = True - take snapshort
-        If is_recording = True - record video from Tello
+        Read Video stream from Tello by cv2.VideoCapture and pass decoded frames to process_video_frame
         '''
         self.is_broadcasting = True
-        while self.tello_stream.isOpened():
+        while not self.is_broadcast_stop and self.tello_stream.isOpened():
             try:
-                ret, frame = self.tello_stream.read()
+                ret, frame = self.tello_stream.read(self.frame_bgr)
                 if ret:
-                    if self.is_snapshortting:
-                        self.take_snapshot(frame)
-                        self.is_snapshortting = False
-                    if self.is_recording:
-                        self.video_writer_file.write(frame)
-                    if self.is_recording_stop:
-                        self.video_writer_file.release()
-                        self.is_recording = False
-                        self.is_recording_stop = False
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    frame = frame.swapaxes(0,1)
-                    frame = pygame.surfarray.make_surface(frame)
-                    self.surf_video.blit(frame, (0,0))
-                    self.tello_ui.blit(self.surf_video, (10,0))
-                    if self.is_recording:
-                        self.draw_rec_indicator()
-                pygame.display.flip()
+                    self.process_video_frame(frame)
             except Exception as ex:
-                print ('Exception in tello_video_broadcast ',ex)
-        print('Exiting tello_video_brodcast')
+                ryze_tello.log('Exception in tello_video_broadcast ',ex)
+        ryze_tello.log('Exiting tello_video_brodcast')
         self.is_broadcasting = False
 
+    def process_video_frame(self, frame, access_unit=None):
+        '''
+        Convert decoded BGR frame into preallocated buffer and publish it to frame_mailbox
+        Frames are shown by present_video_frame in main window loop
+        and passed to recorder to record video and take snapshots in background
+        '''
+        if self.is_broadcast_stop:
+            return
+        self.recorder.submit_frame(frame)
+        if self.vision_stage is not None:
+            self.vision_stage.submit(frame, None if access_unit is None else access_unit.completed_at)
+        frame_size = (self.tello.frame_width, self.tello.frame_height)
+        if frame.shape[1::-1] != frame_size:
+            frame = cv2.resize(frame, frame_size)
+        if self.frame_publisher is not None:
+            self.frame_publisher.publish(frame)
+        frame_rgb, _ = self.frame_mailbox.writer_buffer()
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+        self.frame_mailbox.publish()
+
+    def present_video_frame(self):
+        '''
+        Blit the latest decoded frame if there is a new one
+        Frames decoded while UI was busy are dropped, see frame_mailbox.get_stats()
+        '''
+        frame = self.frame_mailbox.take()
+        if frame is None:
+            return
+        (_, surf_frame), _, _ = frame
+        self.tello_ui.blit(surf_frame, self.rect_video)
+        if self.video_recorder.is_recording:
+            self.draw_rec_indicator()
+        self.dirty_rects.append(self.rect_video)
+
     def print_tello_state(self, **kwargs):
         '''
         Print Tello state
@@ -226,98 +399,72 @@ class RyzeTelloUI:
         Optional parameters are available for Battery, Lowest temperature and Highest temperature:
         bat=<value>, templ=<value>, temph=<value>
         if you want it to be printed in RED_COLOR when danger 
+        Only fields changed since the last call are drawn again
         '''
-        TELLO_STATE_TEMPLATE = {'pitch':    ["Attitude pitch {} degree    ",(40, 5)],
-                                'roll' :    ["Attitude roll  {} degree    ",(40, 20)],
-                                'yaw'  :    ["Attitude yaw   {} degree    ",(40, 35)],
-                                'vgx'  :    ["Speed x        {} m/s       ",(40, 50)],
-                                'vgy'  :    ["Speed y        {} m/s       ",(40, 65)],
-                                'vgz'  :    ["Speed z        {} m/s       ",(40, 80)],
-                                'templ':    ["Lowest temperature  {} °C   ",(330, 5)],
-                                'temph':    ["Highest temperature {} °C   ",(330, 20)],
-                                'tof'  :    ["TOF distance   {} cm    ",(330, 35)],
-                                'h'    :    ["Height         {} cm    ",(330, 50)],
-                                'bat'  :    ["Current battery percentage {} %     ",(330, 65)],
-                                'baro' :    ["Barometer measurement  {} cm   ",(660, 5)],
-                                'time' :    ["Motors on time   {}    ",(660, 20)],
-                                'agx'  :    ["Acceleration x   {}    ",(660, 35)],
-                                'agy'  :    ["Acceleration y   {}    ",(660, 50)],
-                                'agz'  :    ["Acceleration z   {}    ",(660, 65)]}
-        self.surf_state.fill(self.__BLACK_COLOR)
-        font = pygame.font.SysFont(self.__FONT_NAME, 14)
         response = self.tello.get_tello_response()
         text_color = self.__WHITE_COLOR if response else self.__BLUE_COLOR
         state = self.tello.get_tello_state()
         for key in state:
+            value = state[key]
             dangerous_value = False
-            if key in kwargs:
-                if key == 'bat' and int(state[key]) < kwargs[key]:
+            if key in kwargs and value is not None:
+                if key == 'bat' and value < kwargs[key]:
                     dangerous_value = True
-                if key == 'templ' and int(state[key]) > kwargs[key]:
+                if key == 'templ' and value > kwargs[key]:
                     dangerous_value = True
-                if key == 'temph' and int(state[key]) > kwargs[key]:
+                if key == 'temph' and value > kwargs[key]:
                     dangerous_value = True
-            if dangerous_value:        
-                text = font.render(TELLO_STATE_TEMPLATE[key][0].format(state[key]),True,self.__RED_COLOR)
+            if value is None:
+                value = 'n/a'
+            color = self.__RED_COLOR if dangerous_value else text_color
+            drawn = self.__state_drawn.get(key)
+            if drawn is not None and drawn[0] == value and drawn[1] == color:
+                continue
+            text = self.render_text(self.__TELLO_STATE_TEMPLATE[key][0].format(value), color, 14)
+            x, y = self.__TELLO_STATE_TEMPLATE[key][1]
+            rect = text.get_rect(topleft=(x, y + self.tello.frame_height))
+            # Clear previous text, it may be wider
+            if drawn is not None:
+                self.tello_ui.fill(self.__BLACK_COLOR, drawn[2])
+                rect_dirty = rect.union(drawn[2])
             else:
-                text = font.render(TELLO_STATE_TEMPLATE[key][0].format(state[key]),True,text_color)
-            self.surf_state.blit(text, TELLO_STATE_TEMPLATE[key][1])
-        self.tello_ui.blit(self.surf_state, (0, self.tello.frame_height))
-
-    def recording_init(self):
-        '''
-        Initialize cv2.VideoWriter object
-        '''
-        if not os.path.exists(self.dir_video):
-            os.mkdir(self.dir_video)
-        now = datetime.datetime.now()
-        self.video_file_name = "{}.avi".format(now.strftime("%Y-%m-%d_%H-%M-%S"))
-        video_path_file_name = os.path.sep.join(("./", self.dir_video, self.video_file_name))
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        try:
-            self.video_writer_file = cv2.VideoWriter(video_path_file_name, fourcc, self.tello.frame_rate,
-                                                    (self.tello.frame_width, self.tello.frame_height))
-        except Exception as ex:
-            print("Exception open VideoWriter", ex)
-            self.video_writer_file.release()
-        else:
-            print("Starting record to {}".format(self.video_file_name))
-            self.is_recording = True
+                rect_dirty = rect
+            self.tello_ui.blit(text, rect)
+            self.__state_drawn[key] = (value, color, rect)
+            self.dirty_rects.append(rect_dirty)
 
     def draw_rec_indicator(self):
         '''
         Draw REC indicator on Video Surface when recording
         '''
-        font = pygame.font.SysFont(self.__FONT_NAME, 36, bold=1)
-        text = font.render("REC",True,self.__RED_COLOR)
-        self.surf_rec_indicator.blit(text, (2, 0))
-        self.tello_ui.blit(self.surf_rec_indicator, (self.tello.frame_width - 100, 40))
-
-    def take_snapshot(self, frame):
-        '''
-        Take snapshot
-        '''
-        if not os.path.exists(self.dir_snapshot):
-            os.mkdir(self.dir_snapshot)
-        now = datetime.datetime.now()
-        filename = "{}.jpg".format(now.strftime("%Y-%m-%d_%H-%M-%S"))
-        path_filename = os.path.sep.join(("./",self.dir_snapshot, filename))
-        cv2.imwrite(path_filename, frame)
-        print("Snapshort saved {}".format(filename))
+        self.tello_ui.blit(self.surf_rec_text, (self.tello.frame_width - 98, 40))
 
     def close(self):
         '''
-        Release Tello stream cv2.VideoCapture instatnce and cv2.VideoWriter instance if recording
+        Release Tello stream cv2.VideoCapture instatnce and stop recorder writing queued frames
+        Video thread is stopped first, releasing cv2.VideoCapture while it reads crashes
         '''
-        try:
-            self.tello_stream.release()
-        except Exception as ex:
-            print("Exception releasing cv2.VideoCature instance", ex)    
-        self.tello_stream.release()
-        try:
-            self.video_writer_file.release()
-        except Exception as ex:
-            print("Exception releasing cv2.VideoWriter instance", ex)    
+        self.is_broadcast_stop = True
+        if self.is_broadcasting and self.tello_stream is not None:
+            self.thread_tello_video_broadcast.join(self.__TIMEOUT_VIDEO_STOP)
+        if self.tello_video is not None:
+            self.tello_video.close()
+        if self.tello_stream is not None:
+            try:
+                self.tello_stream.release()
+            except Exception as ex:
+                print("Exception releasing cv2.VideoCature instance", ex)
+        self.recorder.close()
+        self.stream_recorder.close()
+        if self.frame_publisher is not None:
+            self.frame_publisher.close()
+        if self.vision_stage is not None:
+            self.vision_stage.close()
+        if self.flight_recorder is not None:
+            self.tello.flight_recorder = None
+            self.flight_recorder.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
 
     def main_window(self):
         '''
@@ -326,35 +473,41 @@ class RyzeTelloUI:
         self.tello_ui.fill(self.__BLACK_COLOR)
         self.print_tello_state(bat=20,templ=80,temph=80)
         pygame.display.flip()
+        self.dirty_rects = []
         
         self.broadcast_init()
 
         run = True
         clock = pygame.time.Clock()
         while run:
-            pygame.time.delay(50)
+            self.present_video_frame()
             self.print_tello_state(bat=20,templ=80,temph=80)
             
             keys = pygame.key.get_pressed()
-            self.seek_key_send_command(keys)
+            if self.is_rc_mode:
+                self.seek_key_send_rc(keys)
+            else:
+                self.seek_key_send_command(keys)
 
             if keys[pygame.K_F1]:
-                if not self.is_recording:
-                    self.recording_init()
+                self.video_recorder.start_recording()
             if keys[pygame.K_F2]:
-                if self.is_recording:
-                    print("Stop record to {}".format(self.video_file_name))
-                    self.is_recording_stop = True
-            if keys[pygame.K_F3]:
-                self.is_snapshortting = True
-                pygame.time.delay(1000)
+                self.video_recorder.stop_recording()
             if keys[pygame.K_F10]:
                 print("Restarting brodcast")
                 self.broadcast_init()
-            pygame.display.flip()
+            self.update_display()
             clock.tick(self.__FPS)
 
             for event in pygame.event.get(): 
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.recorder.snapshot()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                    self.recorder.snapshot(self.__SNAPSHOT_BURST)
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                    self.rc_mode_switch()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F6:
+                    self.stream_recorder.capture_incident()
                 if event.type == pygame.QUIT:
                     self.tello.close()
                     self.close()
@@ -0,0 +1,255 @@
+'''
+Headless Ryze Tello client for ground stations without display
+Runs RyzeTello with keepalive, prints telemetry and optionally receives and records video stream
+Video and telemetry modules are imported only when enabled, so without video nothing but
+the standard library is loaded
+
+Usage: python ryze_tello_daemon.py [--video] [--record] [--history 600] [--status-interval 5] ...
+       python ryze_tello_daemon.py --record --pre-trigger 10, then kill -USR1 <pid> records an incident
+       python ryze_tello_daemon.py --help
+'''
+import argparse
+import signal
+import threading
+import time
+
+import ryze_tello
+import ryze_tello_metrics
+
+_STATUS_INTERVAL = 5 # in sec
+_HISTORY = 0 # states, 0 disables telemetry history
+
+
+class RyzeTelloDaemon():
+    '''
+    Class describes headless Ryze Tello client
+    Creating instance argument class RyzeTello required
+    Default optional arguments are:
+    video = False - receive video stream by ryze_tello.TelloVideoReceiver
+    decode = False - decode video stream by PyAV (requires av) to count decoded frames
+    record = False - record video stream as received (implies video), from start if pre_trigger is 0,
+                     otherwise on capture_incident() (SIGUSR1 of the daemon script)
+    dir_video = 'video' - directory to save video records
+    container = None - 'mp4', 'mkv' etc. to remux records into container (requires av)
+    pre_trigger = 0 - seconds of video kept before record starts
+    frame_bus = None - name of shared memory block to publish decoded frames to other processes (implies decode)
+    history = 0 - states to keep in ryze_tello_telemetry.TelloStateHistory (requires numpy), 0 disables it
+    status_interval = 5 - seconds between status lines
+    metrics_address = None - socket as tuple to serve metrics for Prometheus at http://<address>/metrics
+    flight_log = None - directory to save flight log of states, commands and video (see ryze_tello_flightlog)
+    vision_stage = None - ryze_tello_vision.TelloVisionStage to analyze decoded frames (implies decode)
+    '''
+
+    def __init__(self, tello, video=False, decode=False, record=False, dir_video='video', container=None,
+                    pre_trigger=0, frame_bus=None, history=_HISTORY, status_interval=_STATUS_INTERVAL,
+                    metrics_address=None, flight_log=None, vision_stage=None):
+        self.tello = tello
+        self.status_interval = status_interval
+        self.tello_state_history = None
+        self.tello_video = None
+        self.stream_recorder = None
+        self.frame_publisher = None
+        self.metrics_server = None
+        self.flight_recorder = None
+        self.vision_stage = vision_stage
+        self.__stop = threading.Event()
+
+        if history:
+            import ryze_tello_telemetry
+
+            self.tello_state_history = ryze_tello_telemetry.TelloStateHistory(history)
+            self.tello.tello_state_history = self.tello_state_history
+        if flight_log is not None:
+            import ryze_tello_flightlog
+
+            self.flight_recorder = ryze_tello_flightlog.TelloFlightRecorder(flight_log)
+            self.tello.flight_recorder = self.flight_recorder
+        if video or decode or record or frame_bus or vision_stage:
+            decoder = None
+            if decode or frame_bus or vision_stage:
+                import ryze_tello_stream
+
+                decoder = ryze_tello_stream.PyAVDecoder()
+            self.tello_video = ryze_tello.TelloVideoReceiver(self.tello.local_address_video, relay_address=None,
+                                                             decoder=decoder, metrics=self.tello.metrics)
+            if frame_bus:
+                import ryze_tello_framebus
+
+                self.frame_publisher = ryze_tello_framebus.TelloFramePublisher(frame_bus, self.tello.frame_width,
+                                                                               self.tello.frame_height)
+                self.tello_video.subscribe_frames(self.publish_frame)
+            if self.vision_stage is not None:
+                self.tello_video.subscribe_frames(self.submit_frame)
+                self.tello.metrics.add_collector('tello_vision', self.vision_stage.get_stats,
+                                                 ('submitted', 'skipped', 'completed', 'late', 'errors', 'torn'),
+                                                 'Analysis of decoded frames')
+            if record:
+                import ryze_tello_stream
+
+                self.stream_recorder = ryze_tello_stream.TelloStreamRecorder(dir_video, container,
+                                                                             self.tello.frame_rate, pre_trigger)
+                self.tello_video.subscribe_access_units(self.stream_recorder.write_access_unit)
+                self.tello.metrics.add_collector('tello_stream_recorder', self.stream_recorder.get_stats,
+                                                 ('datagrams', 'access_units', 'bytes', 'skipped'), 'Recorder of video stream')
+            if self.flight_recorder is not None:
+                self.tello_video.subscribe_access_units(self.flight_recorder.write_access_unit)
+            self.tello.tello_send_command('command')
+            self.tello.tello_send_command('streamon')
+            if self.stream_recorder is not None and not pre_trigger:
+                self.stream_recorder.start_recording()
+        if metrics_address is not None:
+            self.metrics_server = ryze_tello_metrics.TelloMetricsServer(self.tello.metrics, metrics_address)
+
+    def publish_frame(self, frame, access_unit):
+        self.frame_publisher.publish(frame, access_unit.completed_at)
+
+    def submit_frame(self, frame, access_unit):
+        self.vision_stage.submit(frame, access_unit.completed_at)
+
+    def status(self):
+        '''
+        Return status line with state, command and video counters
+        '''
+        state = self.tello.get_tello_state()
+        line = ['link {} bat {} h {} tof {} time {}'.format(self.tello.get_tello_link_state(), state['bat'], state['h'],
+                                                            state['tof'], state['time'])]
+        line.append('commands {}'.format(self.tello.get_tello_command_stats()))
+        if self.tello_state_history is not None:
+            drain = self.tello_state_history.battery_drain_rate()
+            if drain is not None:
+                line.append('drain {:.2f} %/min'.format(drain))
+        if self.tello_video is not None:
+            stats = self.tello_video.get_stats()
+            line.append('video {:.0f} kB/s frames {} lost {} decoded {}'.format(stats['bytes_per_s'] / 1000,
+                        stats['access_units'], stats['frames_lost'], stats['decoded']))
+        if self.stream_recorder is not None:
+            line.append('record {}'.format(self.stream_recorder.get_stats()['bytes']))
+        if self.vision_stage is not None:
+            stats = self.vision_stage.get_stats()
+            line.append('vision {} results skipped {} scale {:.2f} latency {}'.format(stats['completed'], stats['skipped'],
+                        stats['scale'], None if stats['latency_ms_recent'] is None else round(stats['latency_ms_recent'])))
+        if self.flight_recorder is not None:
+            line.append('flight log {}'.format(self.flight_recorder.get_stats()['records']))
+        return ' | '.join(line)
+
+    def run(self, duration=None):
+        '''
+        Print status every status_interval until stop() or duration in sec
+        '''
+        stop_at = None if duration is None else time.monotonic() + duration
+        while not self.__stop.is_set():
+            timeout = self.status_interval
+            if stop_at is not None:
+                timeout = min(timeout, stop_at - time.monotonic())
+                if timeout <= 0:
+                    break
+            if self.__stop.wait(timeout):
+                break
+            print(self.status())
+
+    def capture_incident(self, *args):
+        '''
+        Record pre-trigger buffer and the next seconds of video, can be used as signal handler
+        '''
+        if self.stream_recorder is not None:
+            self.stream_recorder.capture_incident()
+
+    def stop(self, *args):
+        '''
+        Stop run(), can be used as signal handler
+        '''
+        self.__stop.set()
+
+    def close(self):
+        self.stop()
+        if self.stream_recorder is not None:
+            self.stream_recorder.close()
+        if self.tello_video is not None:
+            self.tello_video.close()
+        if self.vision_stage is not None:
+            self.vision_stage.close()
+        if self.frame_publisher is not None:
+            self.frame_publisher.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.tello.close()
+        if self.flight_recorder is not None:
+            self.flight_recorder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless Ryze Tello client')
+    parser.add_argument('--tello', type=ryze_tello.address, default=ryze_tello._TELLO_ADDRESS_COMMAND_RESPONSE,
+                        help='Tello command address host:port')
+    parser.add_argument('--state-port', type=int, default=ryze_tello._LOCAL_ADDRESS_STATE[1])
+    parser.add_argument('--command-port', type=int, default=ryze_tello._LOCAL_ADDRESS_COMMAND_RESPONSE[1])
+    parser.add_argument('--video-port', type=int, default=ryze_tello._LOCAL_ADDRESS_VIDEO[1])
+    parser.add_argument('--keepalive', type=float, default=ryze_tello._TIMEOUT_SLEEP,
+                        help='seconds without commands before keepalive command')
+    parser.add_argument('--link-lost', type=float, default=ryze_tello._LINK_LOST,
+                        help='seconds without packets from Tello before link is lost and reconnected')
+    parser.add_argument('--video', action='store_true', help='receive video stream')
+    parser.add_argument('--decode', action='store_true', help='decode video stream (requires av)')
+    parser.add_argument('--record', action='store_true', help='record video stream as received')
+    parser.add_argument('--dir-video', default='video')
+    parser.add_argument('--container', help="remux records into container, e.g. 'mp4' (requires av)")
+    parser.add_argument('--pre-trigger', type=float, default=0, help='seconds of video kept before record, records start on SIGUSR1')
+    parser.add_argument('--frame-bus', help='publish decoded frames to shared memory block of this name')
+    parser.add_argument('--history', type=int, default=_HISTORY, help='states kept in telemetry history (requires numpy)')
+    parser.add_argument('--status-interval', type=float, default=_STATUS_INTERVAL)
+    parser.add_argument('--metrics', type=ryze_tello.address, help='serve Prometheus metrics at host:port, e.g. 127.0.0.1:9100')
+    parser.add_argument('--flight-log', help='save flight log of states, commands and video to this directory')
+    parser.add_argument('--vision', help="analyze decoded frames in worker processes by module:function (requires av)")
+    parser.add_argument('--vision-workers', type=int, default=2)
+    parser.add_argument('--vision-latency', type=float, default=0.1, help='target seconds from frame to result')
+    parser.add_argument('--quiet', action='store_true', help="don't print commands, responses and thread events")
+    parser.add_argument('--duration', type=float, help='seconds to run, until Ctrl+C by default')
+    parser.add_argument('--simulator', action='store_true', help='run against local TelloSimulator')
+    parser.add_argument('--simulator-video', help='H.264 elementary stream file for TelloSimulator')
+    arguments = parser.parse_args()
+    ryze_tello.set_logging(not arguments.quiet)
+
+    simulator = None
+    tello_address = arguments.tello
+    host = ''
+    if arguments.simulator:
+        import ryze_tello_simulator
+
+        host = '127.0.0.1'
+        simulator = ryze_tello_simulator.TelloSimulator(state_port=arguments.state_port, video_port=arguments.video_port,
+                                                        video_file=arguments.simulator_video)
+        tello_address = simulator.address
+    tello = ryze_tello.RyzeTello(local_address_state=(host, arguments.state_port),
+                                 local_address_command_response=(host, arguments.command_port),
+                                 tello_address_command_response=tello_address,
+                                 timeout_sleep=arguments.keepalive,
+                                 local_address_video=(host, arguments.video_port))
+    tello.link_lost = arguments.link_lost
+    tello.link_degraded = min(tello.link_degraded, arguments.link_lost)
+    vision_stage = None
+    if arguments.vision:
+        import importlib
+        import ryze_tello_vision
+
+        module, _, function = arguments.vision.partition(':')
+        vision_stage = ryze_tello_vision.TelloVisionStage(getattr(importlib.import_module(module), function),
+                                                          workers=arguments.vision_workers,
+                                                          target_latency=arguments.vision_latency)
+    daemon = RyzeTelloDaemon(tello, arguments.video, arguments.decode, arguments.record, arguments.dir_video,
+                             arguments.container, arguments.pre_trigger, arguments.frame_bus, arguments.history,
+                             arguments.status_interval, arguments.metrics, arguments.flight_log,
+                             vision_stage)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, daemon.capture_incident)
+    try:
+        daemon.run(arguments.duration)
+    finally:
+        daemon.close()
+        if simulator is not None:
+            simulator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+'''
+Flight log: append-only binary log of Tello state, commands, responses and video frames
+written through a memory map, with time index for post-flight tools and replay
+
+<name>.tlog - header and fixed-size records in time order:
+    record header: type, numbers of the latest state and frame records, timestamp (time.monotonic())
+    state    - fields of TelloState
+    command  - command number, command text
+    response - number of matched command (0 if unmatched), response text
+    frame    - offset and size of access unit in <name>.h264, access unit sequence,
+               number of the latest IDR frame record, IDR flag
+<name>.h264 - access units of video stream as received
+
+Records are sorted by timestamp and have the same size, so a moment is found by binary search,
+the latest state, the latest frame and the IDR to start decoding from are linked from every record
+'''
+import datetime
+import math
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+import weakref
+
+import ryze_tello
+
+_DIR_LOG = 'log'
+_MAGIC = b'TELLOLOG'
+_VERSION = 2
+_HEADER = struct.Struct('<8sIIddQ') # magic, version, record size, wall time and monotonic time at start, records
+_HEADER_SIZE = 64
+_COUNT_OFFSET = 32
+_RECORD = struct.Struct('<B3xIId') # type, latest state record, latest frame record, timestamp
+_RECORD_SIZE = 64
+_PAYLOAD_OFFSET = _RECORD.size
+_STATE = struct.Struct('<11hi4f') # pitch ... bat, time, baro, agx, agy, agz
+_TEXT = struct.Struct('<I40s') # command number, text
+_FRAME = struct.Struct('<QIIIB') # offset, size, sequence, latest IDR record, is_idr
+_CHUNK_RECORDS = 16384 # records added to file when it is full, 1 MB
+_NONE = 0xffffffff # no record
+_INT16_NONE = -32768
+_INT32_NONE = -2 ** 31
+
+RECORD_STATE = 1
+RECORD_COMMAND = 2
+RECORD_RESPONSE = 3
+RECORD_FRAME = 4
+
+_STATE_INT_FIELDS = ('pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph', 'tof', 'h', 'bat')
+_STATE_FLOAT_FIELDS = ('baro', 'agx', 'agy', 'agz')
+
+
+def _int16(value):
+    if value is None:
+        return _INT16_NONE
+    return max(-32767, min(32767, int(value)))
+
+
+def _text(text):
+    return text.encode('utf-8', errors='replace')[:_TEXT.size - 4]
+
+
+class TelloFlightRecorder():
+    '''
+    Class writes flight log of RyzeTello and TelloVideoReceiver
+    Set as RyzeTello(flight_recorder=...) or tello.flight_recorder to log states, commands and responses,
+    subscribe write_access_unit to TelloVideoReceiver.subscribe_access_units to log video frames
+    Writing a record is a copy into memory map, the file grows by 1 MB chunks
+    Default optional arguments are:
+    dir_log = 'log' - directory to save flight logs
+    name = None - name of log files, <date_time> if None
+    '''
+
+    def __init__(self, dir_log=_DIR_LOG, name=None):
+        if not os.path.exists(dir_log):
+            os.mkdir(dir_log)
+        if name is None:
+            name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.filename = os.path.join(dir_log, name + '.tlog')
+        self.filename_video = os.path.join(dir_log, name + '.h264')
+        self.__count = 0
+        self.__capacity = _CHUNK_RECORDS
+        self.__last_timestamp = 0
+        self.__last_state = _NONE
+        self.__last_frame = _NONE
+        self.__last_idr = _NONE
+        # Numbers of TelloCommand, commands never answered are dropped with their handles
+        self.__commands = weakref.WeakKeyDictionary()
+        self.__command_number = 0
+        self.__video_offset = 0
+        self.__lock = threading.Lock()
+        self.__log_file = open(self.filename, 'w+b')
+        self.__log_file.truncate(_HEADER_SIZE + self.__capacity * _RECORD_SIZE)
+        self.__mmap = mmap.mmap(self.__log_file.fileno(), 0)
+        _HEADER.pack_into(self.__mmap, 0, _MAGIC, _VERSION, _RECORD_SIZE, time.time(), time.monotonic(), 0)
+        self.__video_file = open(self.filename_video, 'wb')
+        ryze_tello.log("Starting flight log {}".format(self.filename))
+
+    def __append(self, record_type, timestamp, payload, *values):
+        '''
+        Must be called with __lock held, return number of the record
+        '''
+        if self.__mmap is None:
+            return None
+        if self.__count == self.__capacity:
+            self.__grow()
+        # Threads log events slightly out of order, records must stay sorted for binary search
+        timestamp = max(timestamp, self.__last_timestamp)
+        self.__last_timestamp = timestamp
+        offset = _HEADER_SIZE + self.__count * _RECORD_SIZE
+        _RECORD.pack_into(self.__mmap, offset, record_type, self.__last_state, self.__last_frame, timestamp)
+        payload.pack_into(self.__mmap, offset + _PAYLOAD_OFFSET, *values)
+        self.__count += 1
+        struct.pack_into('<Q', self.__mmap, _COUNT_OFFSET, self.__count)
+        return self.__count - 1
+
+    def __grow(self):
+        self.__mmap.flush()
+        self.__mmap.close()
+        self.__capacity += _CHUNK_RECORDS
+        self.__log_file.truncate(_HEADER_SIZE + self.__capacity * _RECORD_SIZE)
+        self.__mmap = mmap.mmap(self.__log_file.fileno(), 0)
+
+    def write_state(self, tello_state):
+        '''
+        Log TelloState, called by RyzeTello.tello_receive_state
+        '''
+        with self.__lock:
+            index = self.__append(RECORD_STATE, tello_state.timestamp or time.monotonic(), _STATE,
+                                  *(_int16(getattr(tello_state, field)) for field in _STATE_INT_FIELDS),
+                                  _INT32_NONE if tello_state.time is None else tello_state.time,
+                                  *(math.nan if getattr(tello_state, field) is None else getattr(tello_state, field)
+                                    for field in _STATE_FLOAT_FIELDS))
+            if index is not None:
+                self.__last_state = index
+
+    def write_command(self, command):
+        '''
+        Log command sent to Tello as TelloCommand or str, called by RyzeTello when command is sent
+        '''
+        text = command if isinstance(command, str) else command.command
+        with self.__lock:
+            self.__command_number += 1
+            if not isinstance(command, str):
+                self.__commands[command] = self.__command_number
+            self.__append(RECORD_COMMAND, time.monotonic(), _TEXT, self.__command_number, _text(text))
+
+    def write_response(self, response, command=None):
+        '''
+        Log response of Tello and number of matched TelloCommand, called by RyzeTello.tello_receive_response
+        '''
+        with self.__lock:
+            number = 0 if command is None else self.__commands.pop(command, 0)
+            self.__append(RECORD_RESPONSE, time.monotonic(), _TEXT, number, _text(response))
+
+    def write_access_unit(self, access_unit):
+        '''
+        Log ryze_tello.TelloAccessUnit, called by TelloVideoReceiver receive thread
+        '''
+        with self.__lock:
+            if self.__mmap is None:
+                return
+            if self.__last_idr == _NONE and not access_unit.is_idr:
+                return
+            self.__video_file.write(access_unit.data)
+            index = self.__append(RECORD_FRAME, access_unit.completed_at, _FRAME, self.__video_offset,
+                                  len(access_unit.data), access_unit.sequence,
+                                  self.__count if access_unit.is_idr else self.__last_idr, access_unit.is_idr)
+            self.__last_frame = index
+            if access_unit.is_idr:
+                self.__last_idr = index
+            self.__video_offset += len(access_unit.data)
+
+    def get_stats(self):
+        '''
+        Return dict: records, video_bytes
+        '''
+        with self.__lock:
+            return {'records': self.__count, 'video_bytes': self.__video_offset}
+
+    def close(self):
+        '''
+        Flush log and cut it to written records
+        '''
+        with self.__lock:
+            if self.__mmap is None:
+                return
+            self.__mmap.flush()
+            self.__mmap.close()
+            self.__mmap = None
+            self.__log_file.truncate(_HEADER_SIZE + self.__count * _RECORD_SIZE)
+            self.__log_file.close()
+            self.__video_file.close()
+        ryze_tello.log("Flight log saved {}".format(self.filename))
+
+
+class TelloFlightRecord():
+    '''
+    Record of flight log
+    index - number of record
+    type - RECORD_STATE, RECORD_COMMAND, RECORD_RESPONSE or RECORD_FRAME
+    timestamp - time.monotonic() of recording process
+    state_index - number of the latest state record before this one or None
+    frame_index - number of the latest frame record before this one or None
+    data - TelloState for state, (command number, text) for command and response,
+           (offset, size, sequence, IDR record number, is_idr) for frame
+    '''
+
+    __slots__ = ('index', 'type', 'timestamp', 'state_index', 'frame_index', 'data')
+
+    def __init__(self, index, record_type, timestamp, state_index, frame_index, data):
+        self.index = index
+        self.type = record_type
+        self.timestamp = timestamp
+        self.state_index = state_index
+        self.frame_index = frame_index
+        self.data = data
+
+    def __repr__(self):
+        return 'TelloFlightRecord(index={}, type={}, timestamp={}, data={})'.format(self.index, self.type,
+                                                                                   self.timestamp, self.data)
+
+
+class TelloFlightLog():
+    '''
+    Class reads flight log written by TelloFlightRecorder without loading it
+    Required argument:
+    filename - .tlog file, video is read from .h264 file of the same name
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.filename_video = os.path.splitext(filename)[0] + '.h264'
+        self.__log_file = open(filename, 'rb')
+        self.__mmap = mmap.mmap(self.__log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.wall_time, self.monotonic_time, count = _HEADER.unpack_from(self.__mmap, 0)
+        if magic != _MAGIC or version != _VERSION or record_size != _RECORD_SIZE:
+            raise ValueError('{} is not a Tello flight log'.format(filename))
+        # Log of crashed process has the file longer than the records written
+        self.__count = min(count, (len(self.__mmap) - _HEADER_SIZE) // _RECORD_SIZE)
+        self.__video_file = open(self.filename_video, 'rb') if os.path.exists(self.filename_video) else None
+
+    def __len__(self):
+        return self.__count
+
+    def timestamp(self, index):
+        return _RECORD.unpack_from(self.__mmap, _HEADER_SIZE + index * _RECORD_SIZE)[3]
+
+    def record(self, index):
+        '''
+        Return TelloFlightRecord of given number
+        '''
+        if not 0 <= index < self.__count:
+            raise IndexError(index)
+        offset = _HEADER_SIZE + index * _RECORD_SIZE
+        record_type, state_index, frame_index, timestamp = _RECORD.unpack_from(self.__mmap, offset)
+        offset += _PAYLOAD_OFFSET
+        if record_type == RECORD_STATE:
+            data = self.__state(offset, timestamp)
+        elif record_type in (RECORD_COMMAND, RECORD_RESPONSE):
+            number, text = _TEXT.unpack_from(self.__mmap, offset)
+            data = (number, text.rstrip(b'\0').decode('utf-8', errors='replace'))
+        elif record_type == RECORD_FRAME:
+            offset_video, size, sequence, idr_index, is_idr = _FRAME.unpack_from(self.__mmap, offset)
+            data = (offset_video, size, sequence, idr_index, bool(is_idr))
+        else:
+            data = None
+        return TelloFlightRecord(index, record_type, timestamp, None if state_index == _NONE else state_index,
+                                 None if frame_index == _NONE else frame_index, data)
+
+    def __state(self, offset, timestamp):
+        values = _STATE.unpack_from(self.__mmap, offset)
+        tello_state = ryze_tello.TelloState()
+        for field, value in zip(_STATE_INT_FIELDS, values):
+            setattr(tello_state, field, None if value == _INT16_NONE else value)
+        tello_state.time = None if values[11] == _INT32_NONE else values[11]
+        for field, value in zip(_STATE_FLOAT_FIELDS, values[12:]):
+            setattr(tello_state, field, None if math.isnan(value) else round(value, 2))
+        tello_state.timestamp = timestamp
+        return tello_state
+
+    def __iter__(self):
+        for index in range(self.__count):
+            yield self.record(index)
+
+    def find(self, timestamp):
+        '''
+        Return number of the last record at or before timestamp, -1 if timestamp is before the log
+        Binary search, O(log n)
+        '''
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def records(self, start=None, end=None, types=None):
+        '''
+        Iterate records with start <= timestamp < end of given types (all if None)
+        '''
+        index = 0 if start is None else self.find(start) + 1
+        if start is not None and index > 0 and self.timestamp(index - 1) == start:
+            index = self.find(math.nextafter(start, -math.inf)) + 1
+        while index < self.__count:
+            record = self.record(index)
+            if end is not None and record.timestamp >= end:
+                break
+            if types is None or record.type in types:
+                yield record
+            index += 1
+
+    def state_at(self, timestamp):
+        '''
+        Return TelloState received last at timestamp or None
+        '''
+        index = self.find(timestamp)
+        if index < 0:
+            return None
+        record = self.record(index)
+        if record.type == RECORD_STATE:
+            return record.data
+        if record.state_index is None:
+            return None
+        return self.record(record.state_index).data
+
+    def frame_at(self, timestamp):
+        '''
+        Return the last frame record at timestamp or None
+        '''
+        index = self.find(timestamp)
+        if index < 0:
+            return None
+        record = self.record(index)
+        if record.type == RECORD_FRAME:
+            return record
+        if record.frame_index is None:
+            return None
+        return self.record(record.frame_index)
+
+    def frame_data(self, record):
+        '''
+        Return H.264 access unit of frame record
+        '''
+        offset_video, size = record.data[:2]
+        self.__video_file.seek(offset_video)
+        return self.__video_file.read(size)
+
+    def frames_at(self, timestamp):
+        '''
+        Return H.264 stream from the latest IDR up to the frame at timestamp, decoding it gives that frame last
+        '''
+        record = self.frame_at(timestamp)
+        if record is None or self.__video_file is None:
+            return b''
+        start = self.record(record.data[3])
+        self.__video_file.seek(start.data[0])
+        return self.__video_file.read(record.data[0] + record.data[1] - start.data[0])
+
+    def close(self):
+        self.__mmap.close()
+        self.__log_file.close()
+        if self.__video_file is not None:
+            self.__video_file.close()
+
+
+class TelloFlightReplay():
+    '''
+    Class plays flight log back as Tello over UDP, so RyzeTello, TelloVideoReceiver and UI get
+    the recorded states and video and their commands get recorded responses
+    Connect RyzeTello to address like to TelloSimulator, playback starts with the first command received
+    Default optional arguments are:
+    local_address_command = ('127.0.0.1', 0) - socket as tuple to receive commands, port 0 picks a free port
+    state_port = 8890 - port to send state packets to
+    video_port = 11111 - port to send video stream to
+    speed = 10 - playback speed, 1 is real time, 0 sends as fast as possible
+    '''
+
+    def __init__(self, filename, local_address_command=('127.0.0.1', 0), state_port=8890, video_port=11111, speed=10):
+        self.flight_log = TelloFlightLog(filename)
+        self.state_port = state_port
+        self.video_port = video_port
+        self.speed = speed
+        self.client_address = None
+        self.__responses = [record.data[1] for record in self.flight_log.records(types=(RECORD_RESPONSE,))
+                            if record.data[0]]
+        self.__is_running = True
+        self.__finished = threading.Event()
+        self.__stats = {'states': 0, 'frames': 0, 'commands': 0, 'responses': 0}
+
+        self.socket_command = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_command.bind(local_address_command)
+        self.socket_command.settimeout(0.1)
+        self.address = self.socket_command.getsockname()
+        self.socket_state = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_video = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.threads = [threading.Thread(target=self.replay_command), threading.Thread(target=self.replay_feed)]
+        for thread in self.threads:
+            thread.start()
+
+    def replay_command(self):
+        '''
+        Answer commands with recorded responses in order, rc is not answered like by Tello
+        '''
+        while self.__is_running:
+            try:
+                command, address = self.socket_command.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.client_address = address
+            self.__stats['commands'] += 1
+            if command.startswith(b'rc '):
+                continue
+            response = self.__responses[self.__stats['responses']] if self.__stats['responses'] < len(self.__responses) else 'ok'
+            self.__stats['responses'] += 1
+            try:
+                self.socket_command.sendto(response.encode('utf-8'), address)
+            except OSError:
+                break
+
+    def replay_feed(self):
+        '''
+        Send state packets and video frames at recorded times divided by speed
+        '''
+        while self.__is_running and self.client_address is None:
+            time.sleep(0.01)
+        started = time.monotonic()
+        first_timestamp = None
+        for record in self.flight_log.records(types=(RECORD_STATE, RECORD_FRAME)):
+            if not self.__is_running:
+                break
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+            if self.speed:
+                delay = started + (record.timestamp - first_timestamp) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                if record.type == RECORD_STATE:
+                    self.socket_state.sendto(self.state_packet(record.data), (self.client_address[0], self.state_port))
+                    self.__stats['states'] += 1
+                else:
+                    data = self.flight_log.frame_data(record)
+                    for position in range(0, len(data), ryze_tello._VIDEO_PACKET_SIZE):
+                        self.socket_video.sendto(data[position:position + ryze_tello._VIDEO_PACKET_SIZE],
+                                                 (self.client_address[0], self.video_port))
+                    self.__stats['frames'] += 1
+            except OSError:
+                break
+        self.__finished.set()
+
+    @staticmethod
+    def state_packet(tello_state):
+        '''
+        Return TelloState as state packet in format of Tello SDK
+        '''
+        return (''.join('{}:{};'.format(field, 0 if tello_state[field] is None else tello_state[field])
+                        for field in ryze_tello.TelloState.FIELDS) + '\r\n').encode('utf-8')
+
+    def wait(self, timeout=None):
+        '''
+        Wait until all states and frames are sent, return True if they are
+        '''
+        return self.__finished.wait(timeout)
+
+    def get_stats(self):
+        '''
+        Return copy of counters as dict: states, frames (sent), commands (received), responses (sent)
+        '''
+        return dict(self.__stats)
+
+    def close(self):
+        self.__is_running = False
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.socket_command.close()
+        self.socket_state.close()
+        self.socket_video.close()
+        self.flight_log.close()
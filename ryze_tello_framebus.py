@@ -0,0 +1,215 @@
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+_SLOTS = 4
+_MAGIC = 0x54454c4c4f425553 # 'TELLOBUS'
+_VERSION = 1
+_HEADER_SIZE = 64 # bytes: magic, version, slots, height, width, channels, sequence of the last frame
+_SLOT_HEADER_SIZE = 64 # bytes: sequence written before frame, sequence written after frame, timestamp
+_POLL_INTERVAL = 0.001 # in sec
+
+
+def _slot_size(frame_height, frame_width, channels):
+    frame_size = frame_height * frame_width * channels
+    return _SLOT_HEADER_SIZE + (frame_size + 63) // 64 * 64
+
+
+class TelloFramePublisher():
+    '''
+    Class publishes decoded frames into shared memory ring, so any number of local processes
+    can read them by TelloFrameSubscriber as NumPy arrays without pickling and copying
+    Ring has slots of fixed frame size, every frame gets sequence number and time.monotonic() timestamp
+    Publisher never waits for subscribers, a subscriber slower than the ring detects overrun
+    Required arguments:
+    name - name of shared memory block, subscribers open it by this name
+    frame_width, frame_height - of published frames
+    Default optional arguments are:
+    slots = 4 - frames kept in the ring, i.e. how far a subscriber may fall behind
+    channels = 3 - channels of published frames (BGR)
+    '''
+
+    def __init__(self, name, frame_width, frame_height, slots=_SLOTS, channels=3):
+        if slots < 2:
+            raise ValueError('Frame bus needs at least 2 slots')
+        self.name = name
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.slots = slots
+        self.channels = channels
+        self.sequence = 0
+        slot_size = _slot_size(frame_height, frame_width, channels)
+        self.shared_memory = shared_memory.SharedMemory(name, create=True, size=_HEADER_SIZE + slots * slot_size)
+        self.__header, self.__slot_headers, self.__timestamps, self.__frames = _map(
+            self.shared_memory.buf, slots, frame_height, frame_width, channels)
+        self.__header[:] = (_MAGIC, _VERSION, slots, frame_height, frame_width, channels, 0, 0)
+
+    def publish(self, frame, timestamp=None):
+        '''
+        Copy frame into the next slot and return its sequence number
+        '''
+        if frame.shape != self.__frames[0].shape:
+            raise ValueError('Frame shape {} differs from frame bus {}'.format(frame.shape, self.__frames[0].shape))
+        self.sequence += 1
+        slot = self.sequence % self.slots
+        # Subscriber reading this slot sees sequences differ and knows the frame is being overwritten
+        self.__slot_headers[slot, 0] = self.sequence
+        numpy.copyto(self.__frames[slot], frame)
+        self.__timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+        self.__slot_headers[slot, 1] = self.sequence
+        self.__header[6] = self.sequence
+        return self.sequence
+
+    def close(self):
+        '''
+        Close and remove shared memory block, subscribers keep their mapping until they close
+        '''
+        self.__header = self.__slot_headers = self.__timestamps = self.__frames = None
+        self.shared_memory.close()
+        try:
+            self.shared_memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class TelloSharedFrame():
+    '''
+    Frame read by TelloFrameSubscriber
+    frame - NumPy array mapped to shared memory slot, not a copy
+    sequence - sequence number of frame
+    timestamp - time.monotonic() when frame was published
+    Publisher overwrites the slot after slots newer frames, check is_valid() after using frame
+    or use copy() to keep it
+    '''
+
+    __slots__ = ('frame', 'sequence', 'timestamp', '__slot_headers', '__slot')
+
+    def __init__(self, frame, sequence, timestamp, slot_headers, slot):
+        self.frame = frame
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.__slot_headers = slot_headers
+        self.__slot = slot
+
+    def is_valid(self):
+        '''
+        Return True if frame was not overwritten yet
+        '''
+        return self.__slot_headers[self.__slot, 0] == self.sequence
+
+    def copy(self):
+        '''
+        Return copy of frame or None if it was overwritten while copying
+        '''
+        frame = self.frame.copy()
+        return frame if self.is_valid() else None
+
+
+class TelloFrameSubscriber():
+    '''
+    Class reads frames published by TelloFramePublisher in another process
+    Required argument:
+    name - name of shared memory block given to publisher
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.shared_memory = _attach(name)
+        header = numpy.ndarray((8,), numpy.uint64, self.shared_memory.buf)
+        if header[0] != _MAGIC or header[1] != _VERSION:
+            self.shared_memory.close()
+            raise ValueError('{} is not a Tello frame bus'.format(name))
+        self.slots, self.frame_height, self.frame_width, self.channels = (int(value) for value in header[2:6])
+        del header
+        self.__header, self.__slot_headers, self.__timestamps, self.__frames = _map(
+            self.shared_memory.buf, self.slots, self.frame_height, self.frame_width, self.channels)
+        self.__sequence = int(self.__header[6])
+        self.__stats = {'read': 0, 'overruns': 0, 'frames_missed': 0, 'torn': 0}
+
+    def get_sequence(self):
+        '''
+        Return sequence number of the last published frame
+        '''
+        return int(self.__header[6])
+
+    def read(self, latest=False, timeout=None):
+        '''
+        Return the next frame as TelloSharedFrame, or the newest one if latest is True
+        Wait up to timeout sec for a new frame (forever if None), return None if there is none
+        When subscriber falls behind by more than slots frames it skips to the oldest frame
+        still in the ring and counts overrun
+        '''
+        wait_until = None if timeout is None else time.monotonic() + timeout
+        while True:
+            published = int(self.__header[6])
+            if published > self.__sequence:
+                sequence = published if latest else self.__sequence + 1
+                if published - sequence >= self.slots - 1:
+                    self.__stats['overruns'] += 1
+                    sequence = published - self.slots + 2
+                slot = sequence % self.slots
+                if self.__slot_headers[slot, 1] == sequence and self.__slot_headers[slot, 0] == sequence:
+                    timestamp = float(self.__timestamps[slot])
+                    self.__stats['frames_missed'] += sequence - self.__sequence - 1
+                    self.__sequence = sequence
+                    self.__stats['read'] += 1
+                    return TelloSharedFrame(self.__frames[slot], sequence, timestamp, self.__slot_headers, slot)
+                # Publisher is writing the slot right now
+                self.__stats['torn'] += 1
+            if wait_until is not None and time.monotonic() >= wait_until:
+                return None
+            time.sleep(_POLL_INTERVAL)
+
+    def get(self, sequence):
+        '''
+        Return frame of given sequence number as TelloSharedFrame or None if it is not in the ring,
+        e.g. frame handed to worker process by its sequence number
+        '''
+        slot = sequence % self.slots
+        if self.__slot_headers[slot, 1] != sequence or self.__slot_headers[slot, 0] != sequence:
+            return None
+        return TelloSharedFrame(self.__frames[slot], sequence, float(self.__timestamps[slot]), self.__slot_headers, slot)
+
+    def get_stats(self):
+        '''
+        Return copy of counters as dict: read, overruns (times subscriber fell behind the ring),
+        frames_missed (skipped frames), torn (reads retried because slot was being written)
+        '''
+        return dict(self.__stats)
+
+    def close(self):
+        self.__header = self.__slot_headers = self.__timestamps = self.__frames = None
+        self.shared_memory.close()
+
+
+def _map(buffer, slots, frame_height, frame_width, channels):
+    '''
+    Return NumPy views of header, slot headers, timestamps and frames of shared memory buffer
+    '''
+    slot_size = _slot_size(frame_height, frame_width, channels)
+    header = numpy.ndarray((8,), numpy.uint64, buffer)
+    slot_headers = numpy.ndarray((slots, 2), numpy.uint64, buffer, _HEADER_SIZE, (slot_size, 8))
+    timestamps = numpy.ndarray((slots,), numpy.float64, buffer, _HEADER_SIZE + 16, (slot_size,))
+    frames = numpy.ndarray((slots, frame_height, frame_width, channels), numpy.uint8, buffer,
+                           _HEADER_SIZE + _SLOT_HEADER_SIZE, (slot_size, frame_width * channels, channels, 1))
+    return header, slot_headers, timestamps, frames
+
+
+def _attach(name):
+    '''
+    Open existing shared memory block without handing it to resource tracker,
+    which would remove it when subscriber process exits
+    '''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # Python before 3.13 registers every opened block, registration is skipped instead of undone,
+    # because processes started by publisher share its resource tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
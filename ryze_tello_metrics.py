@@ -0,0 +1,185 @@
+import bisect
+import http.server
+import threading
+
+import ryze_tello
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5) # in sec
+_METRICS_ADDRESS = ('127.0.0.1', 9100)
+
+
+class TelloHistogram():
+    '''
+    Histogram of observed values with fixed bucket bounds, e.g. latencies in sec
+    observe() is cheap enough for hot paths: one bisect and one lock
+    '''
+
+    def __init__(self, name, help_text='', buckets=_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.__counts = [0] * (len(self.buckets) + 1)
+        self.__sum = 0
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def observe(self, value):
+        with self.__lock:
+            self.__counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.__sum += value
+            self.__count += 1
+
+    def get_stats(self):
+        '''
+        Return dict: count, sum, buckets as list of (upper bound, cumulative count) ending with (inf, count)
+        '''
+        with self.__lock:
+            counts = list(self.__counts)
+            stats = {'count': self.__count, 'sum': self.__sum}
+        cumulative = 0
+        stats['buckets'] = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            stats['buckets'].append((bound, cumulative))
+        return stats
+
+    def quantile(self, q):
+        '''
+        Return upper bound of bucket holding q quantile (0..1) or None if nothing was observed
+        '''
+        stats = self.get_stats()
+        if not stats['count']:
+            return None
+        for bound, cumulative in stats['buckets']:
+            if cumulative >= q * stats['count']:
+                return bound
+
+
+class TelloMetrics():
+    '''
+    Registry of metrics of RyzeTello and its video, recording and UI parts
+    Counters are not counted twice: components keep their counters (get_stats() dicts) and register
+    a collector reading them on demand, only latencies are observed on hot paths into TelloHistogram
+    Read metrics by get_metrics() or in Prometheus text format by render() (see TelloMetricsServer)
+    '''
+
+    def __init__(self):
+        self.__histograms = {}
+        # prefix -> (callback returning dict of numbers, keys of counters, help)
+        self.__collectors = {}
+        self.__lock = threading.Lock()
+
+    def histogram(self, name, help_text='', buckets=_LATENCY_BUCKETS):
+        '''
+        Return histogram of given name, it is created on the first call
+        '''
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = TelloHistogram(name, help_text, buckets)
+            return histogram
+
+    def add_collector(self, prefix, callback, counters=(), help_text=''):
+        '''
+        Export numbers of dict returned by callback() as <prefix>_<key>
+        Keys in counters are exported as counters (only grow), others as gauges, None values are skipped
+        Collector of the same prefix is replaced
+        '''
+        with self.__lock:
+            self.__collectors[prefix] = (callback, frozenset(counters), help_text)
+
+    def remove_collector(self, prefix):
+        with self.__lock:
+            self.__collectors.pop(prefix, None)
+
+    def __collect(self):
+        '''
+        Return list of (name, type, help, value) of collectors
+        '''
+        with self.__lock:
+            collectors = list(self.__collectors.items())
+        samples = []
+        for prefix, (callback, counters, help_text) in collectors:
+            try:
+                values = callback()
+            except Exception as ex:
+                ryze_tello.log('Exception in metrics collector {}'.format(prefix), ex)
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                samples.append(('{}_{}'.format(prefix, key), 'counter' if key in counters else 'gauge', help_text, value))
+        return samples
+
+    def get_metrics(self):
+        '''
+        Return dict of metric name -> value, histograms as dict of TelloHistogram.get_stats()
+        '''
+        metrics = {name: value for name, _, _, value in self.__collect()}
+        with self.__lock:
+            histograms = list(self.__histograms.values())
+        for histogram in histograms:
+            metrics[histogram.name] = histogram.get_stats()
+        return metrics
+
+    def render(self):
+        '''
+        Return metrics in Prometheus text exposition format
+        '''
+        lines = []
+        for name, metric_type, help_text, value in self.__collect():
+            if help_text:
+                lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.append('{} {}'.format(name, value))
+        with self.__lock:
+            histograms = list(self.__histograms.values())
+        for histogram in histograms:
+            stats = histogram.get_stats()
+            if histogram.help_text:
+                lines.append('# HELP {} {}'.format(histogram.name, histogram.help_text))
+            lines.append('# TYPE {} histogram'.format(histogram.name))
+            for bound, cumulative in stats['buckets']:
+                lines.append('{}_bucket{{le="{}"}} {}'.format(histogram.name, '+Inf' if bound == float('inf') else bound, cumulative))
+            lines.append('{}_sum {}'.format(histogram.name, stats['sum']))
+            lines.append('{}_count {}'.format(histogram.name, stats['count']))
+        return '\n'.join(lines) + '\n'
+
+
+class TelloMetricsServer():
+    '''
+    Local HTTP endpoint serving TelloMetrics.render() at /metrics for Prometheus
+    Required argument:
+    metrics - TelloMetrics instance
+    Default optional argument:
+    address = ('127.0.0.1', 9100) - socket as tuple to listen, port 0 picks a free port
+    '''
+
+    def __init__(self, metrics, address=_METRICS_ADDRESS):
+        self.metrics = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?', 1)[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.http_server = http.server.ThreadingHTTPServer(address, Handler)
+        self.address = self.http_server.server_address
+        self.thread_metrics_server = threading.Thread(target=self.http_server.serve_forever)
+        self.thread_metrics_server.start()
+        ryze_tello.log("Starting metrics server on http://{}:{}/metrics".format(*self.address))
+
+    def close(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.thread_metrics_server.join()
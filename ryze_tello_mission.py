@@ -0,0 +1,319 @@
+'''
+Missions of Tello commands advancing on state conditions instead of fixed sleeps
+
+Mission file is JSON: list of steps or object {"abort": "land", "steps": [...]}, step keys are
+    command - command sent at start of step (optional)
+    until - condition on Tello state ending the step, e.g. "h >= 100", "abs(wrap(yaw - target)) < 5"
+            without it the step ends with the response to command
+    timeout - seconds to wait for condition or response, 10 by default
+    set - variables computed from state at start of step, e.g. {"target": "wrap(yaw + 90)"}
+    on_timeout - "abort" (send abort command and stop mission, default) or "continue"
+Expressions use fields of TelloState, variables set before, numbers, arithmetic, comparisons,
+and/or/not and functions abs, min, max, round, wrap (angle into -180..180)
+
+Example:
+    [{"command": "takeoff", "until": "h >= 50", "timeout": 10},
+     {"command": "up 50", "until": "h >= 100", "timeout": 5},
+     {"set": {"target": "wrap(yaw + 90)"}, "command": "cw 90", "until": "abs(wrap(yaw - target)) < 5"},
+     {"until": "bat > 25", "timeout": 1},
+     {"command": "land", "until": "h <= 10"}]
+
+Usage: python ryze_tello_mission.py mission.json [--dry-run] [--speed 100] [--time-scale 10]
+'''
+import argparse
+import ast
+import json
+import threading
+import time
+
+import ryze_tello
+
+_TIMEOUT = 10 # in sec
+_ABORT_COMMAND = 'land'
+_DRY_RUN_SPEED = 100 # in cm/s, speed of TelloSimulator
+_DRY_RUN_TIME_SCALE = 10
+
+_FUNCTIONS = {'abs': abs, 'min': min, 'max': max, 'round': round, 'wrap': lambda angle: (angle + 180) % 360 - 180}
+_NODES = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+          ast.Constant, ast.And, ast.Or, ast.Not, ast.USub, ast.UAdd, ast.Add, ast.Sub, ast.Mult, ast.Div,
+          ast.FloorDiv, ast.Mod, ast.Pow, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class TelloExpression():
+    '''
+    Expression on Tello state fields and variables, compiled once
+    Only arithmetic, comparisons, boolean operators and functions abs, min, max, round, wrap are allowed
+    evaluate() remembers values of fields used by the expression and computes it again only
+    when one of them changed, so checking it on every state packet costs a tuple comparison
+    Required argument:
+    expression - str, e.g. 'h >= 100 and bat > 25'
+    '''
+
+    def __init__(self, expression):
+        self.expression = expression
+        tree = ast.parse(expression, mode='eval')
+        names = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _NODES):
+                raise ValueError("'{}' is not allowed in expression '{}'".format(type(node).__name__, expression))
+            if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS
+                                               or node.keywords):
+                raise ValueError("Only functions {} are allowed in expression '{}'".format(', '.join(_FUNCTIONS), expression))
+            if isinstance(node, ast.Name) and node.id not in _FUNCTIONS:
+                names.add(node.id)
+        self.fields = tuple(sorted(name for name in names if name in ryze_tello.TelloState.FIELDS))
+        self.variables = tuple(sorted(name for name in names if name not in ryze_tello.TelloState.FIELDS))
+        self.__code = compile(tree, '<{}>'.format(expression), 'eval')
+        self.__values = None
+        self.__result = None
+
+    def evaluate(self, tello_state, variables=None):
+        '''
+        Return value of expression for TelloState, None while a used field is unknown
+        '''
+        values = tuple(getattr(tello_state, field) for field in self.fields)
+        if values == self.__values:
+            return self.__result
+        if None in values:
+            result = None
+        else:
+            namespace = dict(_FUNCTIONS)
+            if variables:
+                namespace.update(variables)
+            namespace.update(zip(self.fields, values))
+            result = eval(self.__code, {'__builtins__': {}}, namespace)
+        self.__values = values
+        self.__result = result
+        return result
+
+    def reset(self):
+        '''
+        Forget remembered values, call when variables changed
+        '''
+        self.__values = None
+        self.__result = None
+
+
+class TelloMissionStep():
+    '''
+    Step of mission, see module description for keys of step in mission file
+    '''
+
+    def __init__(self, command=None, until=None, timeout=_TIMEOUT, set=None, on_timeout='abort'):
+        if command is None and until is None:
+            raise ValueError('Mission step needs command or until')
+        if on_timeout not in ('abort', 'continue'):
+            raise ValueError("on_timeout must be 'abort' or 'continue', not '{}'".format(on_timeout))
+        self.command = command
+        self.until = None if until is None else TelloExpression(until)
+        self.timeout = timeout
+        self.set = {name: TelloExpression(expression) for name, expression in (set or {}).items()}
+        self.on_timeout = on_timeout
+
+    def __repr__(self):
+        return 'TelloMissionStep(command={}, until={})'.format(self.command, self.until and self.until.expression)
+
+
+def load_mission(filename):
+    '''
+    Return (steps as list of TelloMissionStep, abort command) read from JSON mission file
+    '''
+    with open(filename) as mission_file:
+        mission = json.load(mission_file)
+    abort_command = _ABORT_COMMAND
+    if isinstance(mission, dict):
+        abort_command = mission.get('abort', _ABORT_COMMAND)
+        mission = mission['steps']
+    steps = []
+    for number, step in enumerate(mission, 1):
+        try:
+            steps.append(TelloMissionStep(**step))
+        except (TypeError, ValueError, SyntaxError) as ex:
+            raise ValueError('Step {} of {}: {}'.format(number, filename, ex))
+    # Variable must be set by this or an earlier step
+    variables = set()
+    for number, step in enumerate(steps, 1):
+        variables.update(step.set)
+        used = set(step.until.variables if step.until is not None else ())
+        for expression in step.set.values():
+            used.update(expression.variables)
+        if used - variables:
+            raise ValueError('Step {} of {}: unknown {}'.format(number, filename, ', '.join(sorted(used - variables))))
+    return steps, abort_command
+
+
+class TelloMission():
+    '''
+    Class runs mission steps on RyzeTello
+    Conditions are checked in tello_receive_state thread by RyzeTello.subscribe_state as every state packet
+    is parsed, so a step ends with the first packet satisfying its condition
+    Required arguments:
+    tello - RyzeTello instance
+    steps - list of TelloMissionStep (see load_mission)
+    Default optional arguments are:
+    abort_command = 'land' - command sent when step times out with on_timeout 'abort', None sends nothing
+    time_scale = 1 - divide timeouts by time_scale, for dry runs against faster TelloSimulator
+    '''
+
+    def __init__(self, tello, steps, abort_command=_ABORT_COMMAND, time_scale=1):
+        self.tello = tello
+        self.steps = steps
+        self.abort_command = abort_command
+        self.time_scale = time_scale
+        self.variables = {}
+        self.results = []
+        self.__step = None
+        self.__step_done = threading.Event()
+        self.__is_stopped = False
+
+    def on_state(self, tello_state):
+        '''
+        State subscriber: check condition of current step
+        '''
+        step = self.__step
+        if step is None or step.until is None:
+            return
+        try:
+            if step.until.evaluate(tello_state, self.variables):
+                self.__step_done.set()
+        except Exception as ex:
+            ryze_tello.log("Exception in condition '{}'".format(step.until.expression), ex)
+
+    def run(self):
+        '''
+        Run steps in order, return True if all steps ended before timeout (or continued after it)
+        Result of every step is appended to results as dict:
+        step, command, until, status ('done', 'timeout', 'error', 'stopped'), response, seconds
+        '''
+        self.results = []
+        self.variables = {}
+        self.__is_stopped = False
+        started_at = time.monotonic()
+        self.tello.subscribe_state(self.on_state)
+        try:
+            for number, step in enumerate(self.steps, 1):
+                if self.__is_stopped:
+                    break
+                result = self.run_step(number, step)
+                self.results.append(result)
+                ryze_tello.log('Step {} {} {} {:.2f} sec'.format(number, step.command or step.until.expression,
+                                                                 result['status'], result['seconds']))
+                if result['status'] == 'stopped':
+                    return False
+                if result['status'] != 'done' and step.on_timeout == 'abort':
+                    if self.abort_command is not None:
+                        self.tello.tello_send_command(self.abort_command)
+                    return False
+        finally:
+            self.__step = None
+            self.tello.unsubscribe_state(self.on_state)
+        ryze_tello.log('Mission completed in {:.2f} sec'.format((time.monotonic() - started_at) * self.time_scale))
+        return not self.__is_stopped
+
+    def run_step(self, number, step):
+        started_at = time.monotonic()
+        result = {'step': number, 'command': step.command, 'until': step.until and step.until.expression,
+                  'status': 'done', 'response': None, 'seconds': 0}
+        timeout = step.timeout / self.time_scale
+        if step.set:
+            tello_state = self.tello.get_tello_state().copy()
+            for name, expression in step.set.items():
+                value = expression.evaluate(tello_state, self.variables)
+                expression.reset()
+                if value is None:
+                    result['status'] = 'error'
+                    result['response'] = "Unknown state for '{}'".format(name)
+                    return result
+                self.variables[name] = value
+        self.__step_done.clear()
+        if step.until is not None:
+            step.until.reset()
+            self.__step = step
+            # State received before the step may already satisfy the condition
+            self.on_state(self.tello.get_tello_state())
+        command = None
+        if step.command is not None:
+            command = self.tello.tello_send_command_async(step.command, timeout * 1000)
+        if step.until is not None:
+            is_done = self.__step_done.wait(timeout)
+            self.__step = None
+            if command is not None and command.done() and command.response is not None and command.response.startswith('error'):
+                is_done = False
+                result['status'] = 'error'
+            elif not is_done:
+                result['status'] = 'timeout'
+        else:
+            command.wait()
+            is_done = command.response is not None and not command.response.startswith('error')
+            if not is_done:
+                result['status'] = 'error' if command.response is not None else 'timeout'
+        if self.__is_stopped:
+            result['status'] = 'stopped'
+        if command is not None:
+            result['response'] = command.response
+        result['seconds'] = (time.monotonic() - started_at) * self.time_scale
+        return result
+
+    def stop(self):
+        '''
+        Stop mission after current step ends, the step ends at once
+        '''
+        self.__is_stopped = True
+        self.__step_done.set()
+
+    def get_duration(self):
+        '''
+        Return seconds of steps run (scaled back by time_scale)
+        '''
+        return sum(result['seconds'] for result in self.results)
+
+
+def dry_run(steps, abort_command=_ABORT_COMMAND, speed=_DRY_RUN_SPEED, time_scale=_DRY_RUN_TIME_SCALE):
+    '''
+    Run mission against local ryze_tello_simulator.TelloSimulator flying time_scale times faster
+    Return (True if mission completed, results of steps with seconds estimated for real flight)
+    '''
+    import ryze_tello_simulator
+
+    simulator = ryze_tello_simulator.TelloSimulator(speed=speed * time_scale, state_rate=10 * time_scale)
+    tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0), local_address_command_response=('127.0.0.1', 0),
+                                 tello_address_command_response=simulator.address)
+    simulator.state_port = tello.socket_state.getsockname()[1]
+    try:
+        tello.tello_send_command('command')
+        mission = TelloMission(tello, steps, abort_command, time_scale)
+        is_completed = mission.run()
+        return is_completed, mission.results
+    finally:
+        tello.close()
+        simulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Tello mission of state-triggered steps')
+    parser.add_argument('mission', help='JSON mission file')
+    parser.add_argument('--dry-run', action='store_true', help='run against TelloSimulator and estimate duration')
+    parser.add_argument('--speed', type=float, default=_DRY_RUN_SPEED, help='speed of TelloSimulator in cm/s')
+    parser.add_argument('--time-scale', type=float, default=_DRY_RUN_TIME_SCALE,
+                        help='how many times faster than real time TelloSimulator flies')
+    parser.add_argument('--tello', type=ryze_tello.address, default=ryze_tello._TELLO_ADDRESS_COMMAND_RESPONSE,
+                        help='Tello command address host:port')
+    arguments = parser.parse_args()
+    steps, abort_command = load_mission(arguments.mission)
+    if arguments.dry_run:
+        ryze_tello.set_logging(False)
+        is_completed, results = dry_run(steps, abort_command, arguments.speed, arguments.time_scale)
+        ryze_tello.set_logging(True)
+        ryze_tello.log('Estimated mission duration {:.1f} sec{}'.format(sum(result['seconds'] for result in results),
+                                                                       '' if is_completed else ' (mission aborted)'))
+        return
+    tello = ryze_tello.RyzeTello(tello_address_command_response=arguments.tello)
+    try:
+        tello.tello_send_command('command')
+        TelloMission(tello, steps, abort_command).run()
+    finally:
+        tello.close()
+
+
+if __name__ == "__main__":
+    main()
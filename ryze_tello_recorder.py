@@ -0,0 +1,220 @@
+import collections
+import datetime
+import os
+import threading
+import time
+
+import cv2
+import numpy
+
+import ryze_tello
+
+_DIR_SNAPSHOT = 'img'
+_DIR_VIDEO = 'video'
+_QUEUE_SIZE = 60 # frames, 2 sec of Tello video stream
+_POLICY = 'drop_newest'
+_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+
+class TelloRecorder():
+    '''
+    Class describes background recording and snapshot writer
+    Video thread submits decoded frames, they are copied into a pool of preallocated buffers
+    and encoded by recorder thread, so encoding stalls don't delay the live view
+    Required arguments:
+    frame_width, frame_height, frame_rate - of Tello video stream
+    Default optional arguments are:
+    dir_snapshot = 'img' - directory to save snapshots
+    dir_video = 'video' - directory to save video records
+    queue_size = 60 - number of frames waiting for encoding, i.e. memory bound of the queue
+    policy = 'drop_newest' - what to do with a frame when the queue is full:
+             'drop_newest' - drop submitted frame, 'drop_oldest' - drop the oldest queued frame,
+             'block' - wait for free buffer (backpressure to video thread)
+    metrics = None - ryze_tello_metrics.TelloMetrics to export counters and queue lag to
+    '''
+
+    def __init__(self, frame_width, frame_height, frame_rate, dir_snapshot=_DIR_SNAPSHOT, dir_video=_DIR_VIDEO,
+                    queue_size=_QUEUE_SIZE, policy=_POLICY, metrics=None):
+        if policy not in _POLICIES:
+            raise ValueError('Unknown policy {}, use one of {}'.format(policy, _POLICIES))
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.frame_rate = frame_rate
+        self.dir_snapshot = dir_snapshot
+        self.dir_video = dir_video
+        self.policy = policy
+        self.is_recording = False
+        self.video_file_name = None
+
+        self.__free_buffers = [numpy.empty((frame_height, frame_width, 3), numpy.uint8) for _ in range(queue_size)]
+        # Jobs: (kind, buffer, argument, submitted_at), kind is 'open', 'frame', 'snapshot' or 'close'
+        self.__jobs = collections.deque()
+        self.__condition = threading.Condition()
+        self.__snapshots_left = 0
+        self.__snapshot_count = 0
+        self.__snapshot_name = None
+        self.__is_running = True
+        self.__stats = {'submitted': 0, 'written': 0, 'snapshots': 0, 'dropped': 0,
+                        'lag_ms_last': None, 'lag_ms_max': None, 'encode_ms_total': 0}
+        self.__lag_histogram = None
+        if metrics is not None:
+            self.__lag_histogram = metrics.histogram('tello_recorder_lag_seconds', 'From submit to written')
+            metrics.add_collector('tello_recorder', self.get_stats, ('submitted', 'written', 'snapshots', 'dropped'),
+                                  'Recorder of decoded frames')
+
+        self.thread_recorder = threading.Thread(target=self.recorder)
+        self.thread_recorder.start()
+        ryze_tello.log("Starting recorder thread")
+
+    def start_recording(self):
+        '''
+        Start record to dir_video/<date_time>.avi from the next submitted frame
+        '''
+        if self.is_recording:
+            return
+        now = datetime.datetime.now()
+        self.video_file_name = "{}.avi".format(now.strftime("%Y-%m-%d_%H-%M-%S"))
+        with self.__condition:
+            self.__jobs.append(('open', None, os.path.sep.join((".", self.dir_video, self.video_file_name)), time.monotonic()))
+            self.is_recording = True
+            self.__condition.notify()
+        ryze_tello.log("Starting record to {}".format(self.video_file_name))
+
+    def stop_recording(self):
+        '''
+        Stop record after frames already queued are written
+        '''
+        if not self.is_recording:
+            return
+        with self.__condition:
+            self.__jobs.append(('close', None, None, time.monotonic()))
+            self.is_recording = False
+            self.__condition.notify()
+        ryze_tello.log("Stop record to {}".format(self.video_file_name))
+
+    def snapshot(self, count=1):
+        '''
+        Save the next count submitted frames to dir_snapshot/<date_time>.jpg, burst frames get suffix _<n>
+        '''
+        now = datetime.datetime.now()
+        with self.__condition:
+            self.__snapshot_name = now.strftime("%Y-%m-%d_%H-%M-%S")
+            self.__snapshots_left = count
+            self.__snapshot_count = count
+
+    def submit_frame(self, frame):
+        '''
+        Queue BGR frame for recording and snapshot if needed, called by video thread for every frame
+        Frame is copied, caller may reuse it at once
+        '''
+        with self.__condition:
+            if self.is_recording:
+                self.__submit('frame', frame, None)
+            if self.__snapshots_left:
+                number = self.__snapshot_count - self.__snapshots_left
+                self.__snapshots_left -= 1
+                suffix = '_{}'.format(number + 1) if self.__snapshot_count > 1 else ''
+                self.__submit('snapshot', frame, "{}{}.jpg".format(self.__snapshot_name, suffix))
+
+    def __submit(self, kind, frame, argument):
+        '''
+        Must be called with __condition held
+        '''
+        self.__stats['submitted'] += 1
+        if not self.__free_buffers:
+            if self.policy == 'drop_newest':
+                self.__stats['dropped'] += 1
+                return
+            if self.policy == 'drop_oldest':
+                for job in self.__jobs:
+                    if job[0] in ('frame', 'snapshot'):
+                        self.__jobs.remove(job)
+                        self.__free_buffers.append(job[1])
+                        self.__stats['dropped'] += 1
+                        break
+            while not self.__free_buffers and self.__is_running:
+                self.__condition.wait()
+            if not self.__free_buffers:
+                self.__stats['dropped'] += 1
+                return
+        buffer = self.__free_buffers.pop()
+        if frame.shape == buffer.shape:
+            numpy.copyto(buffer, frame)
+        else:
+            cv2.resize(frame, (self.frame_width, self.frame_height), dst=buffer)
+        self.__jobs.append((kind, buffer, argument, time.monotonic()))
+        self.__condition.notify_all()
+
+    def recorder(self):
+        '''
+        Encode queued frames and snapshots in order
+        '''
+        video_writer_file = None
+        while True:
+            with self.__condition:
+                while not self.__jobs and self.__is_running:
+                    self.__condition.wait()
+                if not self.__jobs:
+                    break
+                kind, buffer, argument, submitted_at = self.__jobs.popleft()
+            encode_started = time.monotonic()
+            try:
+                if kind == 'open':
+                    if not os.path.exists(self.dir_video):
+                        os.mkdir(self.dir_video)
+                    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+                    video_writer_file = cv2.VideoWriter(argument, fourcc, self.frame_rate, (self.frame_width, self.frame_height))
+                elif kind == 'close':
+                    if video_writer_file is not None:
+                        video_writer_file.release()
+                        video_writer_file = None
+                elif kind == 'frame':
+                    if video_writer_file is not None:
+                        video_writer_file.write(buffer)
+                elif kind == 'snapshot':
+                    if not os.path.exists(self.dir_snapshot):
+                        os.mkdir(self.dir_snapshot)
+                    cv2.imwrite(os.path.sep.join((".", self.dir_snapshot, argument)), buffer)
+                    ryze_tello.log("Snapshort saved {}".format(argument))
+            except Exception as ex:
+                ryze_tello.log('Exception in recorder', ex)
+            now = time.monotonic()
+            with self.__condition:
+                if buffer is not None:
+                    self.__free_buffers.append(buffer)
+                    self.__stats['written' if kind == 'frame' else 'snapshots'] += 1
+                    self.__stats['encode_ms_total'] += (now - encode_started) * 1000
+                    lag = (now - submitted_at) * 1000
+                    self.__stats['lag_ms_last'] = lag
+                    self.__stats['lag_ms_max'] = max(lag, self.__stats['lag_ms_max'] or 0)
+                    self.__condition.notify_all()
+            if buffer is not None and self.__lag_histogram is not None:
+                self.__lag_histogram.observe(lag / 1000)
+        if video_writer_file is not None:
+            video_writer_file.release()
+        ryze_tello.log("Exiting recorder...")
+
+    def get_stats(self):
+        '''
+        Return copy of counters as dict: submitted, written (video frames), snapshots, dropped,
+        depth (jobs in queue), lag_ms_last, lag_ms_max (from submit to written),
+        encode_fps (frames encoded per second of encoder time)
+        '''
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats['depth'] = len(self.__jobs)
+        encode_ms_total = stats.pop('encode_ms_total')
+        encoded = stats['written'] + stats['snapshots']
+        stats['encode_fps'] = encoded / encode_ms_total * 1000 if encode_ms_total else None
+        return stats
+
+    def close(self):
+        '''
+        Write queued frames, release video file and stop recorder thread
+        '''
+        self.stop_recording()
+        with self.__condition:
+            self.__is_running = False
+            self.__condition.notify_all()
+        if threading.current_thread() is not self.thread_recorder:
+            self.thread_recorder.join()
@@ -0,0 +1,318 @@
+import random
+import socket
+import threading
+import time
+
+import ryze_tello
+
+_LOCAL_ADDRESS_COMMAND = ('127.0.0.1', 0)
+_STATE_PORT = 8890
+_VIDEO_PORT = 11111
+_STATE_RATE = 10 # in Hz
+_DELAY = 0 # in ms
+_LOSS = 0
+_ERROR_RATE = 0
+_VIDEO_PACKET_SIZE = 1460
+_SOCKET_TIMEOUT = 0.1 # in sec
+
+# Read commands of Tello SDK and TelloSimulator attributes they return
+_READ_COMMANDS = {'speed?': 'speed', 'battery?': 'bat', 'time?': 'time', 'height?': 'h',
+                  'temp?': 'templ', 'attitude?': 'attitude', 'baro?': 'baro', 'tof?': 'tof',
+                  'acceleration?': 'acceleration', 'wifi?': 'wifi'}
+
+
+class TelloSimulator():
+    '''
+    Class describes local Tello speaking the text protocol of Tello SDK over UDP
+    Answers 'ok' to control and set commands and values to read commands,
+    sends state packets to port 8890 and video to port 11111 of the address commands come from
+    State and video are sent from the ip of local_address_command, so simulators bound to
+    distinct loopback ips (127.0.0.2, 127.0.0.3, ...) can stand for a swarm (see ryze_tello_swarm)
+    Default optional arguments are:
+    local_address_command = ('127.0.0.1', 0) - socket as tuple to receive commands, port 0 picks a free port
+    state_port = 8890 - port to send state packets to
+    video_port = 11111 - port to send video stream to after 'streamon'
+    state_rate = 10 - state packets per second
+    delay = 0 - delay in ms before response
+    loss = 0 - probability to lose a response or a state packet
+    error_rate = 0 - probability to answer 'error'
+    speed = None - speed in cm/s to simulate flight time of move and rotate (100 degree/s) commands,
+                   height and yaw change gradually during flight time, None answers at once
+    video_file = None - H.264 elementary stream file to send in loop after 'streamon'
+    frame_rate = 30 - frame rate of video_file
+    seed = None - seed of random generator for reproducible loss and errors
+    '''
+
+    def __init__(self, local_address_command=_LOCAL_ADDRESS_COMMAND, state_port=_STATE_PORT, video_port=_VIDEO_PORT,
+                    state_rate=_STATE_RATE, delay=_DELAY, loss=_LOSS, error_rate=_ERROR_RATE, speed=None,
+                    video_file=None, frame_rate=ryze_tello._FRAME_RATE, seed=None):
+        self.state_port = state_port
+        self.video_port = video_port
+        self.state_rate = state_rate
+        self.delay = delay
+        self.loss = loss
+        self.error_rate = error_rate
+        self.speed = speed
+        self.video_file = video_file
+        self.frame_rate = frame_rate
+        self.random = random.Random(seed)
+
+        self.pitch = self.roll = self.yaw = 0
+        self.vgx = self.vgy = self.vgz = 0
+        self.templ = 60
+        self.temph = 63
+        self.tof = 10
+        self.h = 0
+        self.bat = 100
+        self.baro = 100.0
+        self.time = 0
+        self.agx = self.agy = 0.0
+        self.agz = -1000.0
+        self.wifi = 90
+        self.is_sdk_mode = False
+        self.is_streaming = False
+        self.client_address = None
+        self.commands_received = 0
+        # field, start value, end value, start time, duration of height or yaw change in flight
+        self.__motion = None
+        self.__motion_lock = threading.RLock()
+        self.__started_at = time.monotonic()
+        self.__is_running = True
+
+        self.socket_command = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_command.bind(local_address_command)
+        self.socket_command.settimeout(_SOCKET_TIMEOUT)
+        self.address = self.socket_command.getsockname()
+        self.socket_state = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_state.bind((self.address[0], 0))
+        self.socket_video = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_video.bind((self.address[0], 0))
+
+        self.threads = [threading.Thread(target=self.simulator_command),
+                        threading.Thread(target=self.simulator_state)]
+        if self.video_file is not None:
+            self.threads.append(threading.Thread(target=self.simulator_video))
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def simulator_command(self):
+        '''
+        Receive commands and answer them in order, like Tello does
+        '''
+        while self.__is_running:
+            try:
+                command, address = self.socket_command.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.commands_received += 1
+            self.client_address = address
+            response, duration = self.execute(command.decode("utf-8", errors="replace").strip())
+            time.sleep(self.delay / 1000 + duration)
+            if response is None or self.random.random() < self.loss:
+                continue
+            try:
+                self.socket_command.sendto(response.encode("utf-8"), address)
+            except OSError:
+                break
+
+    def execute(self, command):
+        '''
+        Apply command to simulated state
+        Return response as str (None if Tello doesn't answer) and flight time in sec
+        '''
+        if command == 'command':
+            self.is_sdk_mode = True
+            return 'ok', 0
+        if not self.is_sdk_mode:
+            return 'error', 0
+        if command in _READ_COMMANDS:
+            return self.read(_READ_COMMANDS[command]), 0
+        if self.random.random() < self.error_rate:
+            return 'error', 0
+        words = command.split()
+        if not words:
+            return 'error', 0
+        name = words[0]
+        try:
+            arguments = [int(word) for word in words[1:]]
+        except ValueError:
+            return 'error', 0
+        if name == 'streamon':
+            self.is_streaming = True
+        elif name == 'streamoff':
+            self.is_streaming = False
+        elif name == 'takeoff':
+            return 'ok', self.__move('h', 80)
+        elif name == 'land':
+            return 'ok', self.__move('h', 0)
+        elif name in ('up', 'down') and arguments:
+            self.update_motion()
+            return 'ok', self.__move('h', max(0, self.h + (arguments[0] if name == 'up' else -arguments[0])))
+        elif name in ('forward', 'back', 'left', 'right') and arguments:
+            return 'ok', self.__flight_time(arguments[0])
+        elif name in ('cw', 'ccw') and arguments:
+            self.update_motion()
+            return 'ok', self.__move('yaw', self.yaw + (arguments[0] if name == 'cw' else -arguments[0]))
+        elif name == 'rc':
+            # Tello doesn't answer rc
+            return None, 0
+        elif name in ('emergency', 'stop', 'speed', 'wifi', 'flip', 'go', 'curve'):
+            if name == 'emergency':
+                with self.__motion_lock:
+                    self.__motion = None
+                    self.h = 0
+        else:
+            return 'error', 0
+        return 'ok', 0
+
+    def __flight_time(self, distance):
+        if self.speed is None:
+            return 0
+        return abs(distance) / self.speed
+
+    def __move(self, field, value):
+        '''
+        Start changing height or yaw to value, return flight time
+        '''
+        with self.__motion_lock:
+            self.update_motion()
+            start = getattr(self, field)
+            duration = self.__flight_time(value - start)
+            self.__motion = (field, start, value, time.monotonic(), duration)
+            self.update_motion()
+        return duration
+
+    def update_motion(self):
+        '''
+        Set height or yaw changing in flight to its value at this moment
+        '''
+        with self.__motion_lock:
+            if self.__motion is None:
+                return
+            field, start, end, started_at, duration = self.__motion
+            progress = 1 if duration <= 0 else min(1, (time.monotonic() - started_at) / duration)
+            value = round(start + (end - start) * progress)
+            if field == 'yaw':
+                value = (value + 180) % 360 - 180
+            setattr(self, field, value)
+            if progress == 1:
+                self.__motion = None
+
+    def read(self, field):
+        self.update_motion()
+        if field == 'speed':
+            return str(self.speed or 100)
+        if field == 'attitude':
+            return 'pitch:{};roll:{};yaw:{};'.format(self.pitch, self.roll, self.yaw)
+        if field == 'acceleration':
+            return 'agx:{:.2f};agy:{:.2f};agz:{:.2f};'.format(self.agx, self.agy, self.agz)
+        if field == 'time':
+            return '{}s'.format(self.time)
+        if field == 'h':
+            return '{}dm'.format(self.h // 10)
+        if field == 'templ':
+            return '{}~{}C'.format(self.templ, self.temph)
+        if field == 'tof':
+            return '{}mm'.format(self.tof * 10)
+        return str(getattr(self, field))
+
+    def state_packet(self):
+        '''
+        Return state packet in format of Tello SDK
+        '''
+        return ('pitch:{};roll:{};yaw:{};vgx:{};vgy:{};vgz:{};templ:{};temph:{};tof:{};h:{};bat:{};'
+                'baro:{:.2f};time:{};agx:{:.2f};agy:{:.2f};agz:{:.2f};\r\n').format(
+                self.pitch, self.roll, self.yaw, self.vgx, self.vgy, self.vgz, self.templ, self.temph,
+                self.tof, self.h, self.bat, self.baro + self.h, self.time, self.agx, self.agy, self.agz).encode("utf-8")
+
+    def simulator_state(self):
+        '''
+        Send state packets with state_rate to client which sent 'command'
+        '''
+        next_time = time.monotonic()
+        while self.__is_running:
+            now = time.monotonic()
+            if now < next_time:
+                time.sleep(min(next_time - now, _SOCKET_TIMEOUT))
+                continue
+            next_time += 1 / self.state_rate
+            self.update_motion()
+            # Battery lasts about 13 minutes in flight
+            if self.h:
+                self.time = int(time.monotonic() - self.__started_at)
+                self.bat = max(0, 100 - self.time // 8)
+            if not self.is_sdk_mode or self.client_address is None or self.random.random() < self.loss:
+                continue
+            try:
+                self.socket_state.sendto(self.state_packet(), (self.client_address[0], self.state_port))
+            except OSError:
+                break
+
+    def simulator_video(self):
+        '''
+        Send video_file split into NAL units of not more then 1460 bytes per datagram
+        One access unit (NAL units up to the next picture) per 1 / frame_rate sec
+        '''
+        with open(self.video_file, 'rb') as video_file:
+            data = video_file.read()
+        frames = split_access_units(data)
+        next_time = time.monotonic()
+        while self.__is_running:
+            for frame in frames:
+                if not self.__is_running:
+                    break
+                next_time += 1 / self.frame_rate
+                time.sleep(max(0, next_time - time.monotonic()))
+                if not self.is_streaming or self.client_address is None:
+                    continue
+                for position in range(0, len(frame), _VIDEO_PACKET_SIZE):
+                    try:
+                        self.socket_video.sendto(frame[position:position + _VIDEO_PACKET_SIZE],
+                                                 (self.client_address[0], self.video_port))
+                    except OSError:
+                        return
+
+    def close(self):
+        self.__is_running = False
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.socket_command.close()
+        self.socket_state.close()
+        self.socket_video.close()
+
+
+def split_access_units(data):
+    '''
+    Split H.264 elementary stream into list of access units
+    Parameter sets and SEI are kept with the following picture, all slices of a picture are kept together
+    '''
+    frames = []
+    start = 0
+    position = data.find(b'\x00\x00\x01')
+    has_picture = False
+    while position >= 0:
+        nal_type = data[position + 3] & 0x1f if position + 3 < len(data) else 0
+        nal_start = position - 1 if position > 0 and data[position - 1] == 0 else position
+        # Slice starting a new picture has first_mb_in_slice = 0, coded as a single 1 bit
+        if nal_type in (1, 5) and position + 4 < len(data) and data[position + 4] & 0x80:
+            if has_picture:
+                frames.append(data[start:nal_start])
+                start = nal_start
+            has_picture = True
+        elif nal_type in (6, 7, 8, 9) and has_picture:
+            frames.append(data[start:nal_start])
+            start = nal_start
+            has_picture = False
+        position = data.find(b'\x00\x00\x01', position + 3)
+    if start < len(data):
+        frames.append(data[start:])
+    return frames
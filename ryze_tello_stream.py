@@ -0,0 +1,356 @@
+import collections
+import datetime
+import os
+import threading
+import time
+
+import ryze_tello
+
+_DIR_VIDEO = 'video'
+_CONTAINER = None
+_NAL_SPS = 7
+_NAL_PPS = 8
+_NAL_IDR = 5
+_PRE_TRIGGER = 0 # in sec, 0 disables pre-trigger buffer of TelloStreamRecorder
+_PRE_TRIGGER_SECONDS = 10 # in sec
+_PRE_TRIGGER_BYTES = 16 << 20 # about 25 sec of Tello video stream
+_INCIDENT_AFTER = 5 # in sec
+
+
+def nal_unit_type(datagram):
+    '''
+    Return type of NAL unit starting the datagram or None if it doesn't start with a start code
+    Tello sends every NAL unit from the beginning of a datagram
+    '''
+    if datagram.startswith(b'\x00\x00\x00\x01'):
+        position = 4
+    elif datagram.startswith(b'\x00\x00\x01'):
+        position = 3
+    else:
+        return None
+    if len(datagram) <= position:
+        return None
+    return datagram[position] & 0x1f
+
+
+def parameter_sets(data):
+    '''
+    Return SPS and PPS NAL units with start codes found in access unit data (empty bytes if there are none)
+    '''
+    nal_units = []
+    position = data.find(b'\x00\x00\x01')
+    while position >= 0 and position + 3 < len(data):
+        end = data.find(b'\x00\x00\x01', position + 3)
+        if data[position + 3] & 0x1f in (_NAL_SPS, _NAL_PPS):
+            nal_end = len(data) if end < 0 else (end - 1 if data[end - 1] == 0 else end)
+            nal_units.append(b'\x00\x00\x00\x01' + data[position + 3:nal_end])
+        position = end
+    return b''.join(nal_units)
+
+
+def remux_h264(filename_h264, filename_container, frame_rate=ryze_tello._FRAME_RATE):
+    '''
+    Copy H.264 elementary stream into container (e.g. .mp4 or .mkv) without decoding
+    Requires PyAV (pip install av), frames get timestamps of constant frame_rate
+    '''
+    import fractions
+    import av
+
+    time_base = fractions.Fraction(1, frame_rate)
+    with av.open(filename_h264, format='h264') as source, av.open(filename_container, 'w') as target:
+        stream_source = source.streams.video[0]
+        stream_target = target.add_stream_from_template(stream_source)
+        stream_target.time_base = time_base
+        frame = 0
+        for packet in source.demux(stream_source):
+            if not packet.size:
+                continue
+            packet.stream = stream_target
+            packet.time_base = time_base
+            packet.pts = packet.dts = frame
+            packet.duration = 1
+            target.mux(packet)
+            frame += 1
+
+
+class PyAVDecoder():
+    '''
+    H.264 decoder for ryze_tello.TelloVideoReceiver(decoder=...) based on PyAV (pip install av)
+    Decodes reassembled access units into BGR numpy arrays, without cv2.VideoCapture and relay
+    '''
+
+    def __init__(self):
+        import av
+
+        self.codec = av.CodecContext.create('h264', 'r')
+
+    def decode(self, data):
+        '''
+        Decode access unit and return list of decoded frames as BGR numpy arrays
+        '''
+        import av
+
+        try:
+            frames = self.codec.decode(av.Packet(data))
+        except av.error.InvalidDataError:
+            return []
+        return [frame.to_ndarray(format='bgr24') for frame in frames]
+
+
+def create_decoder():
+    '''
+    Return PyAVDecoder or None if PyAV is not installed
+    '''
+    try:
+        return PyAVDecoder()
+    except ImportError:
+        return None
+
+
+class TelloPreTriggerBuffer():
+    '''
+    Rolling buffer of the last seconds of Tello video stream, kept compressed as received
+    Append ryze_tello.TelloAccessUnit from TelloVideoReceiver.subscribe_access_units
+    Stream is kept as whole GOPs (from IDR up to the next IDR), so the buffer always starts with
+    a decodable picture, the oldest GOP is dropped when the next one covers the seconds alone
+    or when buffer exceeds max_bytes
+    Default optional arguments are:
+    seconds = 10 - seconds of video to keep at least
+    max_bytes = 16 MB - memory bound of the buffer
+    '''
+
+    def __init__(self, seconds=_PRE_TRIGGER_SECONDS, max_bytes=_PRE_TRIGGER_BYTES):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.__gops = collections.deque()
+        self.__bytes = 0
+        self.__parameter_sets = b''
+        self.__lock = threading.Lock()
+
+    def append(self, access_unit):
+        with self.__lock:
+            if access_unit.is_idr:
+                if access_unit.has_sps:
+                    self.__parameter_sets = parameter_sets(access_unit.data)
+                self.__gops.append([])
+            elif not self.__gops:
+                return
+            self.__gops[-1].append(access_unit)
+            self.__bytes += len(access_unit.data)
+            while self.__gops and (self.__bytes > self.max_bytes
+                    or len(self.__gops) > 1 and self.__gops[1][0].completed_at <= access_unit.completed_at - self.seconds):
+                self.__bytes -= sum(len(gop_access_unit.data) for gop_access_unit in self.__gops.popleft())
+
+    def get_data(self):
+        '''
+        Return buffered stream as bytes starting with SPS, PPS and IDR
+        '''
+        return b''.join(self.get_chunks())
+
+    def get_chunks(self):
+        '''
+        Return buffered stream as list of bytes starting with SPS, PPS and IDR, without joining them
+        '''
+        with self.__lock:
+            if not self.__gops:
+                return []
+            data = [gop_access_unit.data for gop in self.__gops for gop_access_unit in gop]
+            if not self.__gops[0][0].has_sps:
+                data.insert(0, self.__parameter_sets)
+            return data
+
+    def get_parameter_sets(self):
+        '''
+        Return the last SPS and PPS received as bytes
+        '''
+        with self.__lock:
+            return self.__parameter_sets
+
+    def get_stats(self):
+        '''
+        Return dict: gops, access_units, bytes, seconds (from the first buffered picture to the last one)
+        '''
+        with self.__lock:
+            access_units = sum(len(gop) for gop in self.__gops)
+            seconds = self.__gops[-1][-1].completed_at - self.__gops[0][0].completed_at if self.__gops else 0
+            return {'gops': len(self.__gops), 'access_units': access_units, 'bytes': self.__bytes, 'seconds': seconds}
+
+    def clear(self):
+        with self.__lock:
+            self.__gops.clear()
+            self.__bytes = 0
+
+
+class TelloStreamRecorder():
+    '''
+    Class records Tello video stream as received, without decoding and encoding pixels
+    Subscribe write() to ryze_tello.TelloVideoReceiver.subscribe to record datagrams from the first SPS,
+    or write_access_unit() to TelloVideoReceiver.subscribe_access_units to record pictures from the first IDR
+    and keep pre-trigger buffer, so the file always starts with a decodable picture
+    With pre-trigger buffer the record starts with the last pre_trigger seconds before start_recording,
+    the buffer is written by the thread calling start_recording without blocking the receive thread,
+    which keeps video arriving meanwhile in memory until the buffer is written
+    Default optional arguments are:
+    dir_video = 'video' - directory to save video records (<date_time>.h264)
+    container = None - 'mp4', 'mkv' etc. to remux record into container after stop (requires PyAV)
+    frame_rate = 30 - frame rate of Tello video stream, used for container timestamps
+    pre_trigger = 0 - seconds of video to keep in TelloPreTriggerBuffer, 0 disables it
+    pre_trigger_bytes = 16 MB - memory bound of pre-trigger buffer
+    '''
+
+    def __init__(self, dir_video=_DIR_VIDEO, container=_CONTAINER, frame_rate=ryze_tello._FRAME_RATE,
+                    pre_trigger=_PRE_TRIGGER, pre_trigger_bytes=_PRE_TRIGGER_BYTES):
+        self.dir_video = dir_video
+        self.container = container
+        self.frame_rate = frame_rate
+        self.pre_trigger_buffer = TelloPreTriggerBuffer(pre_trigger, pre_trigger_bytes) if pre_trigger else None
+        self.is_recording = False
+        self.video_file_name = None
+        self.__video_file = None
+        self.__is_waiting_sps = False
+        self.__stop_at = None
+        # Video received while pre-trigger buffer is written, None when it is written to file directly
+        self.__backlog = None
+        self.__lock = threading.Lock()
+        # Held while pre-trigger buffer is written, file is closed after that
+        self.__file_lock = threading.Lock()
+        self.__stats = {'datagrams': 0, 'access_units': 0, 'bytes': 0, 'skipped': 0, 'pre_trigger_bytes': 0}
+
+    def start_recording(self, seconds=None):
+        '''
+        Start record, pre-trigger buffer is written at once
+        Record stops by itself after seconds if set
+        '''
+        if self.is_recording:
+            return
+        if not os.path.exists(self.dir_video):
+            os.mkdir(self.dir_video)
+        now = datetime.datetime.now()
+        video_file_name = "{}.h264".format(now.strftime("%Y-%m-%d_%H-%M-%S"))
+        video_file = open(os.path.sep.join((".", self.dir_video, video_file_name)), 'wb')
+        with self.__file_lock:
+            with self.__lock:
+                if self.is_recording:
+                    video_file.close()
+                    return
+                self.video_file_name = video_file_name
+                self.__video_file = video_file
+                # Buffer snapshot is a list of references to access units, not a copy of them
+                chunks = self.pre_trigger_buffer.get_chunks() if self.pre_trigger_buffer is not None else []
+                self.__is_waiting_sps = not chunks
+                self.__backlog = [] if chunks else None
+                self.__stop_at = None if seconds is None else time.monotonic() + seconds
+                self.is_recording = True
+            ryze_tello.log("Starting record to {}".format(video_file_name))
+            if not chunks:
+                return
+            for chunk in chunks:
+                video_file.write(chunk)
+            with self.__lock:
+                for chunk in self.__backlog:
+                    video_file.write(chunk)
+                self.__backlog = None
+                self.__stats['pre_trigger_bytes'] += sum(len(chunk) for chunk in chunks)
+                self.__stats['bytes'] += sum(len(chunk) for chunk in chunks)
+
+    def capture_incident(self, seconds_after=_INCIDENT_AFTER):
+        '''
+        Record pre-trigger buffer and the next seconds_after seconds of video
+        While record is running, it is extended to seconds_after seconds from now if it would stop earlier
+        '''
+        with self.__lock:
+            if self.is_recording:
+                if self.__stop_at is not None:
+                    self.__stop_at = max(self.__stop_at, time.monotonic() + seconds_after)
+                return
+        self.start_recording(seconds_after)
+
+    def __write(self, data):
+        '''
+        Must be called with __lock held
+        '''
+        if self.__backlog is not None:
+            self.__backlog.append(data)
+        else:
+            self.__video_file.write(data)
+
+    def write(self, datagram):
+        '''
+        Write datagram of H.264 stream, called by receive thread
+        '''
+        with self.__lock:
+            if not self.is_recording:
+                return
+            if self.__is_waiting_sps:
+                if nal_unit_type(datagram) != _NAL_SPS:
+                    self.__stats['skipped'] += 1
+                    return
+                self.__is_waiting_sps = False
+            self.__write(datagram)
+            self.__stats['datagrams'] += 1
+            self.__stats['bytes'] += len(datagram)
+            is_stop = self.__stop_at is not None and time.monotonic() >= self.__stop_at
+        if is_stop:
+            self.stop_recording()
+
+    def write_access_unit(self, access_unit):
+        '''
+        Write ryze_tello.TelloAccessUnit and keep it in pre-trigger buffer, called by receive thread
+        '''
+        with self.__lock:
+            if self.pre_trigger_buffer is not None:
+                self.pre_trigger_buffer.append(access_unit)
+            if not self.is_recording:
+                return
+            if self.__is_waiting_sps:
+                if not access_unit.is_idr:
+                    self.__stats['skipped'] += 1
+                    return
+                self.__is_waiting_sps = False
+                if not access_unit.has_sps and self.pre_trigger_buffer is not None:
+                    self.__write(self.pre_trigger_buffer.get_parameter_sets())
+            self.__write(access_unit.data)
+            self.__stats['access_units'] += 1
+            self.__stats['bytes'] += len(access_unit.data)
+            is_stop = self.__stop_at is not None and access_unit.completed_at >= self.__stop_at
+        if is_stop:
+            self.stop_recording()
+
+    def stop_recording(self):
+        '''
+        Close record and remux it into container in background thread if container is set
+        '''
+        with self.__lock:
+            if not self.is_recording:
+                return
+            self.is_recording = False
+            video_file = self.__video_file
+            self.__video_file = None
+        # Pre-trigger buffer may be being written
+        with self.__file_lock:
+            video_file.close()
+        ryze_tello.log("Stop record to {}".format(self.video_file_name))
+        if self.container is not None:
+            filename_h264 = os.path.sep.join((".", self.dir_video, self.video_file_name))
+            threading.Thread(target=self.remux, args=(filename_h264,)).start()
+
+    def remux(self, filename_h264):
+        filename_container = "{}.{}".format(os.path.splitext(filename_h264)[0], self.container)
+        try:
+            remux_h264(filename_h264, filename_container, self.frame_rate)
+        except Exception as ex:
+            ryze_tello.log("Exception remuxing {}".format(filename_h264), ex)
+        else:
+            os.remove(filename_h264)
+            ryze_tello.log("Record remuxed to {}".format(filename_container))
+
+    def get_stats(self):
+        '''
+        Return copy of counters as dict: datagrams, access_units, bytes (written),
+        skipped (before the first SPS or IDR), pre_trigger_bytes (written from pre-trigger buffer)
+        '''
+        with self.__lock:
+            return dict(self.__stats)
+
+    def close(self):
+        self.stop_recording()
@@ -0,0 +1,196 @@
+import selectors
+import socket
+import threading
+import time
+
+import ryze_tello
+
+_SELECT_TIMEOUT = 0.1 # in sec
+
+
+class TelloSwarmDrone():
+    '''
+    Class describes one Tello in TelloSwarm
+    Created by TelloSwarm, commands are sent through sockets of the swarm
+    tello_address_command_response - socket as tuple to send Tello command
+    '''
+
+    def __init__(self, swarm, tello_address_command_response):
+        self.swarm = swarm
+        self.tello_address_command_response = tello_address_command_response
+        self.__tello_state = ryze_tello.TelloState()
+        self.__tello_state_spare = ryze_tello.TelloState()
+        self.__tello_state_errors = 0
+        self.__tello_response = ''
+        self.__command_matcher = ryze_tello.TelloCommandMatcher()
+        self.last_command_time = 0
+
+    def tello_receive_state(self, state):
+        if not ryze_tello.parse_tello_state(state, self.__tello_state_spare):
+            self.__tello_state_errors += 1
+            return
+        self.__tello_state_spare.timestamp = time.monotonic()
+        self.__tello_state, self.__tello_state_spare = self.__tello_state_spare, self.__tello_state
+
+    def get_tello_state(self):
+        return self.__tello_state
+
+    def get_tello_state_errors(self):
+        return self.__tello_state_errors
+
+    def tello_receive_response(self, response):
+        try:
+            self.__tello_response = response.decode(encoding="utf-8")
+        except UnicodeDecodeError as decode_error:
+            ryze_tello.log('Exception in tello_receive_response', self.tello_address_command_response, decode_error)
+            return
+        self.__command_matcher.match(self.__tello_response)
+
+    def get_tello_response(self):
+        return self.__tello_response
+
+    def get_tello_command_stats(self):
+        return self.__command_matcher.get_stats()
+
+    def expire_commands(self):
+        self.__command_matcher.expire()
+
+    def tello_send_command_async(self, command_to_tello='command', timeout=None):
+        '''
+        Send command to Tello without waiting for response
+        Return ryze_tello.TelloCommand handle completed when response arrives
+        '''
+        command = ryze_tello.TelloCommand(command_to_tello, ryze_tello.command_timeout(command_to_tello, self.swarm.timeout_response)
+                                          if timeout is None else timeout)
+        self.__tello_response = ''
+        command.sent_at = time.monotonic()
+        self.last_command_time = command.sent_at
+        self.__command_matcher.add(command)
+        try:
+            self.swarm.socket_command_response.sendto(command_to_tello.encode(encoding="utf-8"), self.tello_address_command_response)
+        except Exception as ex:
+            ryze_tello.log("Exception in tello_send_command", self.tello_address_command_response, ex)
+        return command
+
+    def tello_send_command(self, command_to_tello='command', timeout=None):
+        '''
+        Send command to Tello and wait for response
+        Return response as str or None if Tello doesn't response
+        '''
+        command = self.tello_send_command_async(command_to_tello, timeout)
+        command.wait()
+        self.__command_matcher.expire()
+        return command.response
+
+
+class TelloSwarm():
+    '''
+    Class describes a fleet of Ryze Tello driven from one process
+    Two sockets are shared by all drones and served by one selector thread:
+    responses are routed to drones by source address, state packets by source ip
+    Tello sends state from port 8890, not its command port, so every drone must have its own ip:
+    ValueError is raised for two drones of the same ip. Local TelloSimulator instances
+    are bound to distinct loopback ips for that, e.g. ('127.0.0.2', 0), ('127.0.0.3', 0)
+    Required argument:
+    tello_addresses - list of sockets as tuple to send Tello commands, e.g. [('192.168.10.1', 8889), ...]
+    Default optional arguments are the same as ryze_tello.RyzeTello
+    '''
+
+    def __init__(self, tello_addresses, local_address_state=ryze_tello._LOCAL_ADDRESS_STATE,
+                    local_address_command_response=ryze_tello._LOCAL_ADDRESS_COMMAND_RESPONSE,
+                    timeout_response=ryze_tello._TIMEOUT_RESPONSE, timeout_sleep=ryze_tello._TIMEOUT_SLEEP):
+        self.local_address_state = local_address_state
+        self.local_address_command_response = local_address_command_response
+        self.timeout_response = timeout_response
+        self.timeout_sleep = timeout_sleep
+
+        ips = [address[0] for address in tello_addresses]
+        duplicate_ips = sorted({ip for ip in ips if ips.count(ip) > 1})
+        if duplicate_ips:
+            raise ValueError('Drones of swarm must have distinct ips, state packets are routed by ip: {}'.format(
+                ', '.join(duplicate_ips)))
+        self.drones = [TelloSwarmDrone(self, tuple(address)) for address in tello_addresses]
+        self.__drones_by_address = {drone.tello_address_command_response: drone for drone in self.drones}
+        self.__drones_by_ip = {drone.tello_address_command_response[0]: drone for drone in self.drones}
+        self.__unknown_datagrams = 0
+
+        self.socket_state = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_state.bind(self.local_address_state)
+        self.socket_command_response = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_command_response.bind(self.local_address_command_response)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket_state, selectors.EVENT_READ, self.__receive_state)
+        self.selector.register(self.socket_command_response, selectors.EVENT_READ, self.__receive_response)
+
+        self.__is_running = True
+        self.thread_swarm_loop = threading.Thread(target=self.swarm_loop)
+        self.thread_swarm_loop.start()
+        ryze_tello.log("Starting swarm_loop thread")
+
+    def get_drone(self, tello_address_command_response):
+        return self.__drones_by_address[tuple(tello_address_command_response)]
+
+    def get_unknown_datagrams(self):
+        '''
+        Return number of datagrams received from addresses not in the swarm
+        '''
+        return self.__unknown_datagrams
+
+    def __receive_state(self):
+        state, address = self.socket_state.recvfrom(1024)
+        drone = self.__drones_by_ip.get(address[0])
+        if drone is None:
+            self.__unknown_datagrams += 1
+            return
+        drone.tello_receive_state(state)
+
+    def __receive_response(self):
+        response, address = self.socket_command_response.recvfrom(1024)
+        drone = self.__drones_by_address.get(address)
+        if drone is None:
+            self.__unknown_datagrams += 1
+            return
+        drone.tello_receive_response(response)
+
+    def swarm_loop(self):
+        '''
+        Receive state and responses of all drones
+        Expire timed out commands and send 'command' to drone idle for timeout_sleep sec
+        '''
+        while self.__is_running:
+            try:
+                for key, _ in self.selector.select(_SELECT_TIMEOUT):
+                    key.data()
+                now = time.monotonic()
+                for drone in self.drones:
+                    drone.expire_commands()
+                    if now - drone.last_command_time >= self.timeout_sleep:
+                        drone.tello_send_command_async()
+            except Exception as ex:
+                ryze_tello.log('Exception in swarm_loop', ex)
+        ryze_tello.log("Exiting swarm_loop...")
+
+    def broadcast(self, command_to_tello='command', timeout=None):
+        '''
+        Send command to every drone at once without waiting for responses
+        Return dict {tello_address_command_response: ryze_tello.TelloCommand}
+        '''
+        return {drone.tello_address_command_response: drone.tello_send_command_async(command_to_tello, timeout)
+                for drone in self.drones}
+
+    def gather(self, commands):
+        '''
+        Wait for responses to commands returned by broadcast()
+        Total wait is the slowest response or timeout, not the sum of them
+        Return dict {tello_address_command_response: response or None}
+        '''
+        return {address: command.wait() for address, command in commands.items()}
+
+    def close(self):
+        self.__is_running = False
+        if threading.current_thread() is not self.thread_swarm_loop:
+            self.thread_swarm_loop.join()
+        self.selector.close()
+        self.socket_state.close()
+        self.socket_command_response.close()
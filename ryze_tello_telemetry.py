@@ -0,0 +1,105 @@
+import numpy as np
+
+import ryze_tello
+
+_CAPACITY = 600 # samples, 60 sec of Tello state at 10 Hz
+
+
+class TelloStateHistory():
+    '''
+    Class describes fixed-capacity ring buffer of recent Tello states
+    Every field of ryze_tello.TelloState and receive timestamp is stored in own NumPy column,
+    unknown values are stored as NaN
+    Each sample is written twice (at i and i + capacity), so the last n samples
+    are always a contiguous slice and queries return views without copying the window
+    A view of n samples is valid only until capacity - n more samples are appended: when the buffer
+    is full a view of all samples changes with the next append, copy views to keep them longer
+    One thread appends while others query without a lock: head and count are replaced as one tuple
+    after the sample is written, and every query slices all its columns from one snapshot of them
+    Default optional argument is:
+    capacity = 600 - number of samples kept
+    '''
+
+    COLUMNS = ryze_tello.TelloState.FIELDS + ('timestamp',)
+
+    def __init__(self, capacity=_CAPACITY):
+        self.capacity = capacity
+        self.__columns = {column: np.full(2 * capacity, np.nan) for column in self.COLUMNS}
+        self.__position = (0, 0) # index of the next sample, number of samples
+
+    def __len__(self):
+        return self.__position[1]
+
+    def append(self, tello_state):
+        '''
+        Append ryze_tello.TelloState, called by receive thread for every state packet
+        '''
+        head, count = self.__position
+        for column in self.COLUMNS:
+            value = getattr(tello_state, column)
+            if value is None:
+                value = np.nan
+            values = self.__columns[column]
+            values[head] = value
+            values[head + self.capacity] = value
+        self.__position = ((head + 1) % self.capacity, min(count + 1, self.capacity))
+
+    def column(self, column, n=None):
+        '''
+        Return view of the last n samples of column (default all kept samples), the oldest first
+        '''
+        return self.__column(column, n, self.__position)
+
+    def __column(self, column, n, position):
+        head, count = position
+        if n is None or n > count:
+            n = count
+        end = head + self.capacity
+        return self.__columns[column][end - n:end]
+
+    def window(self, column, seconds):
+        '''
+        Return view of column samples received in the last given seconds before the latest sample
+        '''
+        return self.__window((column,), seconds)[0]
+
+    def __window(self, columns, seconds):
+        '''
+        Return views of columns in the last seconds, all of the same samples
+        '''
+        position = self.__position
+        timestamps = self.__column('timestamp', None, position)
+        n = 0
+        if len(timestamps):
+            n = len(timestamps) - np.searchsorted(timestamps, timestamps[-1] - seconds, side='left')
+        return [self.__column(column, n, position) for column in columns]
+
+    def rolling_mean(self, column, size, seconds=None):
+        '''
+        Return rolling mean over size samples of column in the last seconds (default all kept samples)
+        '''
+        return self.__rolling(column, size, seconds).mean(axis=1)
+
+    def rolling_min(self, column, size, seconds=None):
+        return self.__rolling(column, size, seconds).min(axis=1)
+
+    def rolling_max(self, column, size, seconds=None):
+        return self.__rolling(column, size, seconds).max(axis=1)
+
+    def __rolling(self, column, size, seconds):
+        values = self.column(column) if seconds is None else self.window(column, seconds)
+        if len(values) < size:
+            return np.empty((0, size))
+        return np.lib.stride_tricks.sliding_window_view(values, size)
+
+    def battery_drain_rate(self, seconds=60):
+        '''
+        Return battery drain in % per minute over the last seconds
+        fitted by least squares, or None if there are not enough samples
+        '''
+        timestamps, battery = self.__window(('timestamp', 'bat'), seconds)
+        valid = ~np.isnan(battery)
+        if np.count_nonzero(valid) < 2 or timestamps[-1] == timestamps[0]:
+            return None
+        slope = np.polyfit(timestamps[valid], battery[valid], 1)[0]
+        return -slope * 60
@@ -0,0 +1,232 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+import ryze_tello
+import ryze_tello_framebus
+
+_WORKERS = 2
+_TARGET_LATENCY = 0.1 # in sec, from frame decoded to its result delivered
+_MIN_SCALE = 0.25
+_SCALE_STEP = 0.8
+
+# Worker process globals, set by _worker_init
+_subscriber = None
+_analyzer = None
+
+
+def _worker_init(name, analyzer):
+    global _subscriber, _analyzer
+    _subscriber = ryze_tello_framebus.TelloFrameSubscriber(name)
+    _analyzer = analyzer
+
+
+def _worker_analyze(sequence, scale):
+    '''
+    Run analyzer on frame of frame bus, return (result, analysis time in sec) or None if frame was overwritten
+    '''
+    shared_frame = _subscriber.get(sequence)
+    if shared_frame is None:
+        return None
+    started = time.perf_counter()
+    frame = shared_frame.frame
+    if scale < 1:
+        import cv2
+
+        frame = cv2.resize(frame, (round(frame.shape[1] * scale), round(frame.shape[0] * scale)),
+                           interpolation=cv2.INTER_AREA)
+    result = _analyzer(frame)
+    if not shared_frame.is_valid():
+        return None
+    return result, time.perf_counter() - started
+
+
+class TelloVisionResult():
+    '''
+    Result of analyzer for one frame
+    sequence - number of frame given by TelloVisionStage
+    timestamp - timestamp of frame given to submit(), time.monotonic() of its decoding by default
+    value - returned by analyzer
+    scale - scale of frame analyzed, coordinates in value are of frame resized by it
+    latency - sec from timestamp to result delivered
+    analysis_time - sec spent by analyzer (with resize)
+    '''
+
+    __slots__ = ('sequence', 'timestamp', 'value', 'scale', 'latency', 'analysis_time')
+
+    def __init__(self, sequence, timestamp, value, scale, latency, analysis_time):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.value = value
+        self.scale = scale
+        self.latency = latency
+        self.analysis_time = analysis_time
+
+    def __repr__(self):
+        return 'TelloVisionResult(sequence={}, value={}, scale={}, latency={:.3f})'.format(self.sequence, self.value,
+                                                                                         self.scale, self.latency)
+
+
+class TelloVisionStage():
+    '''
+    Class runs analyzer on decoded frames in pool of worker processes, off the decoding and UI threads
+    Frames are handed to workers through shared memory frame bus (ryze_tello_framebus), only sequence
+    numbers are pickled
+    Scheduler never queues frames: a frame submitted while all workers are busy is skipped, so latency
+    stays close to analysis time. While average latency is above target_latency frames are downscaled
+    for analysis (down to min_scale), when it falls well below target they are scaled up again
+    Results are delivered as TelloVisionResult to callback from result thread of the pool
+    and kept for get_result()
+    Required argument:
+    analyzer - function defined at module level (workers import it) taking BGR frame as NumPy array,
+               its return value is delivered as result and must be picklable
+    Workers are spawned and import the main script, start it under if __name__ == "__main__":
+    Default optional arguments are:
+    callback = None - callback(TelloVisionResult) called for every result
+    workers = 2 - worker processes
+    target_latency = 0.1 - sec from frame timestamp to result
+    min_scale = 0.25 - the smallest scale of frames, 1 disables downscaling
+    '''
+
+    def __init__(self, analyzer, callback=None, workers=_WORKERS, target_latency=_TARGET_LATENCY, min_scale=_MIN_SCALE):
+        self.analyzer = analyzer
+        self.callback = callback
+        self.workers = workers
+        self.target_latency = target_latency
+        self.min_scale = min_scale
+        self.scale = 1
+        self.frame_publisher = None
+        self.executor = None
+        self.__in_flight = {}
+        self.__latency = None
+        self.__result = None
+        self.__started_at = None
+        self.__warm_at = None
+        self.__is_closed = False
+        self.__lock = threading.Lock()
+        self.__stats = {'submitted': 0, 'skipped': 0, 'completed': 0, 'late': 0, 'errors': 0, 'callback_errors': 0,
+                        'torn': 0, 'latency_ms_total': 0, 'analysis_ms_total': 0}
+
+    def __start(self, frame):
+        '''
+        Create frame bus for frames of this shape and start workers, called with the first frame
+        '''
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        # Frames in flight are never overwritten: ring is longer than workers can hold
+        self.frame_publisher = ryze_tello_framebus.TelloFramePublisher('tello_vision_{}_{}'.format(os.getpid(), id(self)),
+                                                                       width, height, self.workers + 2, channels)
+        # Workers are spawned, forking a process running receive and UI threads may copy their held locks
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                                                               _worker_init, (self.frame_publisher.name, self.analyzer))
+        self.__started_at = time.monotonic()
+        ryze_tello.log("Starting vision stage with {} workers".format(self.workers))
+
+    def submit(self, frame, timestamp=None):
+        '''
+        Submit decoded frame for analysis without waiting, return its sequence number or None if it was skipped
+        '''
+        with self.__lock:
+            if self.__is_closed:
+                return None
+            if self.executor is None:
+                self.__start(frame)
+            if len(self.__in_flight) >= self.workers:
+                self.__stats['skipped'] += 1
+                return None
+            sequence = self.frame_publisher.publish(frame.reshape(self.frame_publisher.frame_height,
+                                                                  self.frame_publisher.frame_width, -1), timestamp)
+            timestamp = time.monotonic() if timestamp is None else timestamp
+            self.__in_flight[sequence] = (timestamp, self.scale, time.monotonic())
+            self.__stats['submitted'] += 1
+            future = self.executor.submit(_worker_analyze, sequence, self.scale)
+        future.add_done_callback(lambda future: self.__complete(sequence, future))
+        return sequence
+
+    def __complete(self, sequence, future):
+        with self.__lock:
+            timestamp, scale, submitted_at = self.__in_flight.pop(sequence)
+            if future.cancelled():
+                return
+            try:
+                analysis = future.result()
+            except Exception as ex:
+                # Analyzer failing on one frame usually fails on every frame, only the first one is logged
+                self.__stats['errors'] += 1
+                if self.__stats['errors'] == 1:
+                    ryze_tello.log('Exception in vision analyzer (next ones are counted in errors)', ex)
+                return
+            if analysis is None:
+                self.__stats['torn'] += 1
+                return
+            value, analysis_time = analysis
+            latency = time.monotonic() - timestamp
+            self.__stats['completed'] += 1
+            self.__stats['latency_ms_total'] += latency * 1000
+            self.__stats['analysis_ms_total'] += analysis_time * 1000
+            if latency > self.target_latency:
+                self.__stats['late'] += 1
+            # Frames submitted before workers started answering waited for them to start
+            if self.__warm_at is None:
+                self.__warm_at = time.monotonic()
+            elif submitted_at >= self.__warm_at:
+                self.__latency = latency if self.__latency is None else 0.8 * self.__latency + 0.2 * latency
+            # Scale is changed again only after a frame of current scale was analyzed
+            if self.__latency is not None and scale == self.scale:
+                if self.__latency > self.target_latency and self.scale > self.min_scale:
+                    self.scale = max(self.min_scale, self.scale * _SCALE_STEP)
+                elif self.__latency < 0.6 * self.target_latency and self.scale < 1:
+                    self.scale = min(1, self.scale / _SCALE_STEP)
+            result = self.__result = TelloVisionResult(sequence, timestamp, value, scale, latency, analysis_time)
+        if self.callback is not None:
+            try:
+                self.callback(result)
+            except Exception as ex:
+                with self.__lock:
+                    self.__stats['callback_errors'] += 1
+                    is_first = self.__stats['callback_errors'] == 1
+                if is_first:
+                    ryze_tello.log('Exception in vision callback (next ones are counted in callback_errors)', ex)
+
+    def get_result(self):
+        '''
+        Return the latest TelloVisionResult or None
+        '''
+        return self.__result
+
+    def get_stats(self):
+        '''
+        Return dict: submitted, skipped (while workers were busy), completed, late (over target_latency),
+        errors (exceptions of analyzer), callback_errors (exceptions of callback), torn (frames overwritten
+        before analysis), in_flight, skip_ratio, results_per_s, latency_ms_avg, analysis_ms_avg,
+        latency_ms_recent (moving average), scale
+        '''
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['in_flight'] = len(self.__in_flight)
+            stats['latency_ms_recent'] = None if self.__latency is None else self.__latency * 1000
+            stats['scale'] = self.scale
+            started_at = self.__started_at
+        latency_ms_total = stats.pop('latency_ms_total')
+        analysis_ms_total = stats.pop('analysis_ms_total')
+        frames = stats['submitted'] + stats['skipped']
+        stats['skip_ratio'] = stats['skipped'] / frames if frames else None
+        stats['results_per_s'] = stats['completed'] / (time.monotonic() - started_at) if started_at else None
+        stats['latency_ms_avg'] = latency_ms_total / stats['completed'] if stats['completed'] else None
+        stats['analysis_ms_avg'] = analysis_ms_total / stats['completed'] if stats['completed'] else None
+        return stats
+
+    def close(self):
+        '''
+        Stop workers, frames in flight are not analyzed
+        '''
+        with self.__lock:
+            if self.__is_closed:
+                return
+            self.__is_closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.frame_publisher.close()
+            ryze_tello.log("Vision stage closed", self.get_stats())
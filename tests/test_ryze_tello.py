@@ -0,0 +1,275 @@
+'''
+Regression checks of RyzeTello against local TelloSimulator
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_simulator
+import ryze_tello_swarm
+
+ryze_tello.set_logging(False)
+
+
+class TestParseTelloState(unittest.TestCase):
+
+    PACKET = (b'pitch:1;roll:2;yaw:3;vgx:0;vgy:0;vgz:0;templ:60;temph:63;tof:10;h:20;bat:87;'
+              b'baro:100.5;time:4;agx:0.00;agy:0.00;agz:-1000.00;\r\n')
+
+    def test_sdk_packet(self):
+        tello_state = ryze_tello.TelloState()
+        self.assertTrue(ryze_tello.parse_tello_state(self.PACKET, tello_state))
+        self.assertEqual((tello_state.h, tello_state.bat, tello_state.baro), (20, 87, 100.5))
+
+    def test_extra_fields(self):
+        tello_state = ryze_tello.TelloState()
+        self.assertTrue(ryze_tello.parse_tello_state(b'mid:-1;x:0;y:0;z:0;' + self.PACKET, tello_state))
+        self.assertEqual(tello_state.bat, 87)
+
+    def test_empty_and_partial_packets(self):
+        tello_state = ryze_tello.TelloState()
+        for packet in (b'', b'\r\n', b'bat:5;\r\n', self.PACKET.replace(b'bat:87;', b''), b'bat:x;\r\n'):
+            self.assertFalse(ryze_tello.parse_tello_state(packet, tello_state), packet)
+
+
+class TestFrameMailbox(unittest.TestCase):
+
+    def setUp(self):
+        self.buffers = [bytearray(4) for _ in range(3)]
+        self.frame_mailbox = ryze_tello.TelloFrameMailbox(self.buffers)
+
+    def write(self, value):
+        buffer = self.frame_mailbox.writer_buffer()
+        buffer[:] = bytes([value % 256]) * 4
+        return buffer
+
+    def test_publish_take(self):
+        self.assertIsNone(self.frame_mailbox.take())
+        buffer = self.write(1)
+        self.assertEqual(self.frame_mailbox.publish(timestamp=5.0), 1)
+        taken, sequence, timestamp = self.frame_mailbox.take()
+        # Frame is passed without copying and taken only once
+        self.assertIs(taken, buffer)
+        self.assertEqual((sequence, timestamp), (1, 5.0))
+        self.assertIsNone(self.frame_mailbox.take())
+        # Renderer owns taken buffer until the next take, decoder writes and publishes others
+        for value in range(2, 6):
+            self.assertIsNot(self.write(value), taken)
+            self.frame_mailbox.publish()
+        self.assertEqual(taken, bytes([1]) * 4)
+        self.assertEqual(self.frame_mailbox.get_stats(), {'published': 5, 'taken': 1, 'dropped': 3})
+
+    def test_latest_frame_wins(self):
+        for value in range(1, 4):
+            self.write(value)
+            self.frame_mailbox.publish()
+        taken, sequence, _ = self.frame_mailbox.take()
+        self.assertEqual((taken, sequence), (bytes([3]) * 4, 3))
+        self.assertEqual(self.frame_mailbox.get_stats()['dropped'], 2)
+        # Buffers rotate, none is allocated
+        writer = self.frame_mailbox.writer_buffer()
+        self.assertIsNot(writer, taken)
+        self.assertTrue(any(buffer is writer for buffer in self.buffers))
+        self.assertTrue(any(buffer is taken for buffer in self.buffers))
+        with self.assertRaises(ValueError):
+            ryze_tello.TelloFrameMailbox(self.buffers[:2])
+
+    def test_concurrent(self):
+        frames = 20000
+
+        def decode():
+            for value in range(1, frames + 1):
+                self.write(value)
+                self.frame_mailbox.publish()
+
+        thread_decode = threading.Thread(target=decode)
+        thread_decode.start()
+        last_sequence = 0
+        while thread_decode.is_alive() or last_sequence < frames:
+            frame = self.frame_mailbox.take()
+            if frame is None:
+                continue
+            taken, sequence, _ = frame
+            # Taken buffer is never written by decoder: its content is of its own frame
+            self.assertEqual(taken, bytes([sequence % 256]) * 4)
+            self.assertGreater(sequence, last_sequence)
+            last_sequence = sequence
+        thread_decode.join()
+        stats = self.frame_mailbox.get_stats()
+        self.assertEqual(stats['published'], frames)
+        self.assertEqual(stats['taken'] + stats['dropped'], frames)
+
+
+class TestCommandMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = ryze_tello_simulator.TelloSimulator()
+        self.tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                          local_address_command_response=('127.0.0.1', 0),
+                                          tello_address_command_response=self.simulator.address,
+                                          timeout_response=300)
+        self.simulator.state_port = self.tello.socket_state.getsockname()[1]
+        self.assertEqual(self.tello.tello_send_command('command'), 'ok')
+
+    def tearDown(self):
+        self.tello.close()
+        self.simulator.close()
+
+    def test_lost_response_fails_one_command(self):
+        self.simulator.loss = 1
+        self.assertIsNone(self.tello.tello_send_command('battery?'))
+        self.simulator.loss = 0
+        for _ in range(10):
+            self.assertEqual(self.tello.tello_send_command('battery?'), '100')
+        stats = self.tello.get_tello_command_stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['late'], 0)
+
+
+class TestLateResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = ryze_tello_simulator.TelloSimulator(speed=100)
+        self.tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                          local_address_command_response=('127.0.0.1', 0),
+                                          tello_address_command_response=self.simulator.address)
+        self.simulator.state_port = self.tello.socket_state.getsockname()[1]
+        self.assertEqual(self.tello.tello_send_command('command'), 'ok')
+        while self.tello.get_tello_link_state() != 'ok':
+            time.sleep(0.05)
+        self.assertEqual(self.tello.tello_send_command('takeoff'), 'ok')
+
+    def tearDown(self):
+        self.tello.close()
+        self.simulator.close()
+
+    def test_late_response_not_given_to_next_command(self):
+        # Flight takes 2 sec, response arrives after timeout while battery? waits
+        self.assertIsNone(self.tello.tello_send_command('forward 200', 1000))
+        self.assertEqual(self.tello.tello_send_command('battery?'), '100')
+        self.assertEqual(self.tello.tello_send_command('height?'), '8dm')
+        stats = self.tello.get_tello_command_stats()
+        self.assertEqual((stats['timeouts'], stats['late'], stats['dropped']), (1, 1, 0))
+
+    def test_movement_timeout_covers_flight(self):
+        self.assertEqual(self.tello.tello_send_command('forward 300'), 'ok')
+        self.assertGreater(ryze_tello.command_timeout('forward 300'), ryze_tello._TIMEOUT_RESPONSE)
+        self.assertEqual(ryze_tello.command_timeout('battery?'), ryze_tello._TIMEOUT_RESPONSE)
+
+
+class TestCommandQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = ryze_tello_simulator.TelloSimulator(speed=100)
+        self.tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                          local_address_command_response=('127.0.0.1', 0),
+                                          tello_address_command_response=self.simulator.address)
+        self.simulator.state_port = self.tello.socket_state.getsockname()[1]
+        self.assertEqual(self.tello.tello_send_command('command'), 'ok')
+        # Handshakes of tello_supervise_link stop when link is up
+        while self.tello.get_tello_link_state() != 'ok':
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.tello.close()
+        self.simulator.close()
+
+    def test_held_land_sent_once(self):
+        self.assertEqual(self.tello.tello_send_command('takeoff'), 'ok')
+        commands_received = self.simulator.commands_received
+        # Key held down, land takes the flight time to be answered
+        handles = {self.tello.tello_queue_command('land') for _ in range(10)}
+        self.assertEqual(len(handles), 1)
+        self.assertEqual(handles.pop().wait(), 'ok')
+        self.assertEqual(self.simulator.commands_received - commands_received, 1)
+        self.assertEqual(self.tello.get_tello_queue_stats()['coalesced'], 9)
+
+    def test_emergency_always_sent(self):
+        handles = {self.tello.tello_queue_command('emergency') for _ in range(3)}
+        self.assertEqual(len(handles), 3)
+
+
+class TestLinkSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = ryze_tello_simulator.TelloSimulator()
+        self.tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                          local_address_command_response=('127.0.0.1', 0),
+                                          tello_address_command_response=self.simulator.address)
+        self.simulator.state_port = self.tello.socket_state.getsockname()[1]
+        self.tello.link_lost = 1
+        self.assertEqual(self.tello.tello_send_command('command'), 'ok')
+
+    def tearDown(self):
+        self.tello.close()
+        self.simulator.close()
+
+    def test_commands_answered_after_reconnect(self):
+        self.simulator.loss = 1
+        time.sleep(4)
+        self.assertEqual(self.tello.get_tello_link_state(), 'lost')
+        self.simulator.loss = 0
+        wait_until = time.monotonic() + 10
+        while self.tello.get_tello_link_state() != 'ok' and time.monotonic() < wait_until:
+            time.sleep(0.05)
+        self.assertEqual(self.tello.get_tello_link_state(), 'ok')
+        for _ in range(6):
+            self.assertEqual(self.tello.tello_send_command('battery?'), '100')
+        stats = self.tello.get_tello_command_stats()
+        self.assertEqual((stats['unmatched'], stats['late']), (0, 0))
+
+
+class TestHandshake(unittest.TestCase):
+
+    def test_fresh_start(self):
+        for _ in range(5):
+            with ryze_tello_simulator.TelloSimulator() as simulator:
+                tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                             local_address_command_response=('127.0.0.1', 0),
+                                             tello_address_command_response=simulator.address)
+                try:
+                    simulator.state_port = tello.socket_state.getsockname()[1]
+                    # Handshake of tello_supervise_link is sent at the same time
+                    self.assertEqual(tello.tello_send_command('command'), 'ok')
+                    self.assertEqual(tello.tello_send_command('battery?'), '100')
+                    while tello.get_tello_link_state() != 'ok':
+                        time.sleep(0.05)
+                    stats = tello.get_tello_command_stats()
+                    self.assertEqual((stats['unmatched'], stats['timeouts']), (0, 0))
+                finally:
+                    tello.close()
+
+
+class TestSwarm(unittest.TestCase):
+
+    def test_state_routed_to_its_drone(self):
+        simulators = [ryze_tello_simulator.TelloSimulator(('127.0.0.{}'.format(index), 0)) for index in (2, 3, 4)]
+        swarm = ryze_tello_swarm.TelloSwarm([simulator.address for simulator in simulators],
+                                            local_address_state=('127.0.0.1', 0),
+                                            local_address_command_response=('127.0.0.1', 0))
+        try:
+            for simulator, bat in zip(simulators, (50, 60, 70)):
+                simulator.bat = bat
+                simulator.state_port = swarm.socket_state.getsockname()[1]
+            self.assertEqual(set(swarm.gather(swarm.broadcast('command')).values()), {'ok'})
+            time.sleep(0.5)
+            self.assertEqual([drone.get_tello_state().bat for drone in swarm.drones], [50, 60, 70])
+        finally:
+            swarm.close()
+            for simulator in simulators:
+                simulator.close()
+
+    def test_duplicate_ips_rejected(self):
+        with self.assertRaises(ValueError):
+            ryze_tello_swarm.TelloSwarm([('127.0.0.1', 9001), ('127.0.0.1', 9002)])
+
+
+if __name__ == "__main__":
+    unittest.main()
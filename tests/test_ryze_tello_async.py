@@ -0,0 +1,56 @@
+'''
+Checks of AsyncRyzeTello against local TelloSimulator
+
+Usage: python -m unittest discover tests
+'''
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_async
+import ryze_tello_simulator
+
+
+class TestAsyncRyzeTello(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = ryze_tello_simulator.TelloSimulator()
+
+    def tearDown(self):
+        self.simulator.close()
+        ryze_tello.set_logging(True)
+
+    async def fly(self, timeout_sleep):
+        async with ryze_tello_async.AsyncRyzeTello(local_address_state=('127.0.0.1', 0),
+                                                   local_address_command_response=('127.0.0.1', 0),
+                                                   tello_address_command_response=self.simulator.address,
+                                                   timeout_sleep=timeout_sleep) as tello:
+            self.assertEqual(await tello.tello_send_command('command'), 'ok')
+            for _ in range(10):
+                self.assertEqual(await tello.tello_send_command('battery?'), '100')
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(0.05)
+            return tello.get_tello_command_stats()
+
+    def test_keepalive_only_when_idle(self):
+        ryze_tello.set_logging(False)
+        stats = asyncio.run(self.fly(0.5))
+        # Commands are never 0.5 sec apart, no keepalive is needed
+        self.assertEqual(stats['sent'], 11)
+
+    def test_logging_off(self):
+        ryze_tello.set_logging(False)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            asyncio.run(self.fly(10))
+        self.assertEqual(output.getvalue(), '')
+
+
+if __name__ == "__main__":
+    unittest.main()
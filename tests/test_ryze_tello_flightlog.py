@@ -0,0 +1,114 @@
+'''
+Checks of flight log written by TelloFlightRecorder and read by TelloFlightLog
+
+Usage: python -m unittest discover tests
+'''
+import math
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_flightlog
+import ryze_tello_simulator
+
+
+class TestFlightLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        recorder = ryze_tello_flightlog.TelloFlightRecorder(self.directory.name, 'flight')
+        tello_state = ryze_tello.TelloState()
+        # A few frames then a long flight without video
+        for sequence in range(1, 6):
+            recorder.write_access_unit(ryze_tello.TelloAccessUnit(bytes([sequence]) * 10, sequence in (1, 4), False,
+                                                                  None, sequence, sequence, sequence))
+        for index in range(100000):
+            tello_state.h = index % 1000
+            tello_state.timestamp = 10 + index * 0.01
+            recorder.write_state(tello_state)
+        recorder.close()
+        self.flight_log = ryze_tello_flightlog.TelloFlightLog(recorder.filename)
+
+    def tearDown(self):
+        self.flight_log.close()
+        self.directory.cleanup()
+
+    def test_frame_at(self):
+        self.assertIsNone(self.flight_log.frame_at(0.5))
+        self.assertEqual(self.flight_log.frame_at(2.5).data[2], 2)
+        started = time.perf_counter()
+        record = self.flight_log.frame_at(10000)
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertEqual(record.data[2], 5)
+        # Decoding starts from IDR frame 4
+        self.assertEqual(self.flight_log.frames_at(10000), bytes([4]) * 10 + bytes([5]) * 10)
+
+    def test_state_at(self):
+        self.assertIsNone(self.flight_log.state_at(9))
+        self.assertEqual(self.flight_log.state_at(10 + 1234 * 0.01 + 0.001).h, 234)
+
+
+class TestFlightReplay(unittest.TestCase):
+
+    COMMANDS = ('battery?', 'height?', 'speed?', 'time?')
+
+    def setUp(self):
+        ryze_tello.set_logging(False)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def connect(self, tello_like, flight_recorder=None):
+        '''
+        Return RyzeTello connected to TelloSimulator or TelloFlightReplay
+        '''
+        tello = ryze_tello.RyzeTello(local_address_state=('127.0.0.1', 0),
+                                     local_address_command_response=('127.0.0.1', 0),
+                                     tello_address_command_response=tello_like.address, flight_recorder=flight_recorder)
+        tello_like.state_port = tello.socket_state.getsockname()[1]
+        # The first command is the handshake of link supervisor, states follow it
+        while tello.get_tello_link_state() != 'ok':
+            time.sleep(0.05)
+        return tello
+
+    def test_round_trip(self):
+        simulator = ryze_tello_simulator.TelloSimulator()
+        self.addCleanup(simulator.close)
+        recorder = ryze_tello_flightlog.TelloFlightRecorder(self.directory.name, 'flight')
+        tello = self.connect(simulator, recorder)
+        responses = [tello.tello_send_command(command) for command in self.COMMANDS]
+        time.sleep(0.3)
+        tello.close()
+        recorder.close()
+
+        flight_log = ryze_tello_flightlog.TelloFlightLog(recorder.filename)
+        self.addCleanup(flight_log.close)
+        commands = [record.data for record in flight_log.records(types=(ryze_tello_flightlog.RECORD_COMMAND,))]
+        answers = [record.data for record in flight_log.records(types=(ryze_tello_flightlog.RECORD_RESPONSE,))]
+        self.assertEqual(commands[0][1], 'command')
+        self.assertEqual([text for number, text in commands[-len(self.COMMANDS):]], list(self.COMMANDS))
+        # Every response is logged with number of the command it answers
+        self.assertEqual([number for number, text in answers], [number for number, text in commands])
+        self.assertEqual([text for number, text in answers[-len(self.COMMANDS):]], responses)
+        recorded_state = flight_log.state_at(math.inf)
+        self.assertIsNotNone(recorded_state)
+
+        replay = ryze_tello_flightlog.TelloFlightReplay(recorder.filename, state_port=0, video_port=0)
+        self.addCleanup(replay.close)
+        tello = self.connect(replay)
+        self.addCleanup(tello.close)
+        self.assertEqual([tello.tello_send_command(command) for command in self.COMMANDS], responses)
+        self.assertTrue(replay.wait(10))
+        time.sleep(0.1)
+        self.assertEqual(replay.get_stats()['states'], len(list(
+            flight_log.records(types=(ryze_tello_flightlog.RECORD_STATE,)))))
+        self.assertEqual(tello.get_tello_state().bat, recorded_state.bat)
+        self.assertEqual(tello.get_tello_state().h, recorded_state.h)
+
+
+if __name__ == "__main__":
+    unittest.main()
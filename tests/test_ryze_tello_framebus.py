@@ -0,0 +1,123 @@
+'''
+Checks of frame bus with publisher and subscriber handles in one process
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+import ryze_tello_framebus
+
+_WIDTH = 32
+_HEIGHT = 24
+_SLOTS = 4
+
+
+def make_frame(value):
+    return numpy.full((_HEIGHT, _WIDTH, 3), value % 256, numpy.uint8)
+
+
+class TestFrameBus(unittest.TestCase):
+
+    def setUp(self):
+        self.name = 'tello_test_{}_{}'.format(os.getpid(), self.id().rsplit('.', 1)[-1])
+        self.publisher = ryze_tello_framebus.TelloFramePublisher(self.name, _WIDTH, _HEIGHT, _SLOTS)
+        self.subscriber = ryze_tello_framebus.TelloFrameSubscriber(self.name)
+
+    def tearDown(self):
+        self.subscriber.close()
+        self.publisher.close()
+
+    def test_round_trip(self):
+        self.assertEqual((self.subscriber.frame_width, self.subscriber.frame_height, self.subscriber.slots),
+                         (_WIDTH, _HEIGHT, _SLOTS))
+        self.assertIsNone(self.subscriber.read(timeout=0.01))
+        for value in range(1, 3):
+            self.assertEqual(self.publisher.publish(make_frame(value), timestamp=value / 10), value)
+        for value in range(1, 3):
+            shared_frame = self.subscriber.read(timeout=0.01)
+            self.assertEqual((shared_frame.sequence, shared_frame.timestamp), (value, value / 10))
+            self.assertTrue(numpy.array_equal(shared_frame.frame, make_frame(value)))
+            self.assertTrue(shared_frame.is_valid())
+            del shared_frame
+        self.assertIsNone(self.subscriber.read(timeout=0.01))
+        for value in range(3, 6):
+            self.publisher.publish(make_frame(value))
+        shared_frame = self.subscriber.read(latest=True, timeout=0.01)
+        self.assertEqual(shared_frame.sequence, 5)
+        self.assertTrue(numpy.array_equal(self.subscriber.get(4).frame, make_frame(4)))
+        del shared_frame
+        stats = self.subscriber.get_stats()
+        self.assertEqual((stats['read'], stats['frames_missed'], stats['torn']), (3, 2, 0))
+        with self.assertRaises(ValueError):
+            self.publisher.publish(numpy.zeros((_HEIGHT, _WIDTH), numpy.uint8))
+
+    def test_overwritten_frame(self):
+        self.publisher.publish(make_frame(1))
+        shared_frame = self.subscriber.read(timeout=0.01)
+        for value in range(2, 2 + _SLOTS):
+            self.publisher.publish(make_frame(value))
+        # Slot of frame 1 now holds frame 5, sequence check tells the frame changed under the reader
+        self.assertFalse(shared_frame.is_valid())
+        self.assertIsNone(shared_frame.copy())
+        self.assertIsNone(self.subscriber.get(1))
+        del shared_frame
+        # Reader fell behind the ring and skips to the oldest frame still safe to read, frame 2 may be
+        # overwritten by the next publish while it is read
+        shared_frame = self.subscriber.read(timeout=0.01)
+        self.assertEqual(shared_frame.sequence, 3)
+        del shared_frame
+        self.assertEqual(self.subscriber.get_stats()['overruns'], 1)
+
+    def test_torn_read(self):
+        self.publisher.publish(make_frame(1))
+        shared_frame = self.subscriber.read(timeout=0.01)
+        # Publisher writes sequence before frame and after it, stop it in the middle of writing frame 5
+        _, slot_headers, _, frames = ryze_tello_framebus._map(self.publisher.shared_memory.buf, _SLOTS, _HEIGHT,
+                                                              _WIDTH, 3)
+        for value in range(2, 1 + _SLOTS):
+            self.publisher.publish(make_frame(value))
+        slot = (1 + _SLOTS) % _SLOTS
+        slot_headers[slot, 0] = 1 + _SLOTS
+        frames[slot, :_HEIGHT // 2] = 1 + _SLOTS
+        self.assertFalse(shared_frame.is_valid())
+        self.assertIsNone(shared_frame.copy())
+        del shared_frame
+        self.assertIsNone(self.subscriber.get(1 + _SLOTS))
+        # Published sequence is not updated yet, reads of frames 2..4 are not affected
+        for value in range(2, 1 + _SLOTS):
+            self.assertEqual(self.subscriber.read(timeout=0.01).sequence, value)
+        # Publisher finished writing sequence but not the published one: a reader polling the slot retries
+        self.publisher.publish(make_frame(1 + _SLOTS))
+        slot_headers[slot, 0] = 1 + _SLOTS + 1
+        self.assertIsNone(self.subscriber.read(timeout=0.01))
+        self.assertGreater(self.subscriber.get_stats()['torn'], 0)
+        slot_headers[slot, 0] = 1 + _SLOTS
+        shared_frame = self.subscriber.read(timeout=0.01)
+        self.assertTrue(numpy.array_equal(shared_frame.copy(), make_frame(1 + _SLOTS)))
+        del shared_frame, slot_headers, frames
+
+    def test_close_removes_shared_memory(self):
+        self.assertTrue(os.path.exists('/dev/shm/' + self.name) or not os.path.isdir('/dev/shm'))
+        self.publisher.publish(make_frame(1))
+        # Closing subscriber leaves the block to publisher and other subscribers
+        self.subscriber.close()
+        self.subscriber = ryze_tello_framebus.TelloFrameSubscriber(self.name)
+        self.assertEqual(self.subscriber.get_sequence(), 1)
+        self.publisher.close()
+        with self.assertRaises(FileNotFoundError):
+            ryze_tello_framebus.TelloFrameSubscriber(self.name)
+        self.assertFalse(os.path.exists('/dev/shm/' + self.name))
+        # Subscriber still attached reads its mapping until it closes
+        shared_frame = self.subscriber.get(1)
+        self.assertTrue(numpy.array_equal(shared_frame.frame, make_frame(1)))
+        del shared_frame
+
+
+if __name__ == "__main__":
+    unittest.main()
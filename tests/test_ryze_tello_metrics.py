@@ -0,0 +1,70 @@
+'''
+Checks of TelloMetrics rendering scraped from TelloMetricsServer
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_metrics
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def setUp(self):
+        ryze_tello.set_logging(False)
+        self.metrics = ryze_tello_metrics.TelloMetrics()
+        self.metrics_server = ryze_tello_metrics.TelloMetricsServer(self.metrics, ('127.0.0.1', 0))
+        self.addCleanup(self.metrics_server.close)
+        self.url = 'http://{}:{}'.format(*self.metrics_server.address)
+
+    def scrape(self, path='/metrics'):
+        with urllib.request.urlopen(self.url + path, timeout=5) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            return response.read().decode('utf-8')
+
+    def test_counters_and_gauges(self):
+        stats = {'sent': 3, 'timeouts': 1, 'rtt_ms': 12.5, 'is_streaming': True, 'last': None}
+        self.metrics.add_collector('tello_command', lambda: stats, counters=('sent', 'timeouts'),
+                                   help_text='Commands sent to Tello')
+        self.metrics.add_collector('tello_broken', lambda: 1 / 0)
+        lines = self.scrape().splitlines()
+        self.assertIn('# HELP tello_command_sent Commands sent to Tello', lines)
+        self.assertIn('# TYPE tello_command_sent counter', lines)
+        self.assertIn('tello_command_sent 3', lines)
+        self.assertIn('# TYPE tello_command_rtt_ms gauge', lines)
+        self.assertIn('tello_command_rtt_ms 12.5', lines)
+        # Booleans, None and failing collectors are not exported
+        self.assertFalse([line for line in lines if 'is_streaming' in line or '_last' in line or 'broken' in line])
+        stats['sent'] = 4
+        self.assertIn('tello_command_sent 4', self.scrape().splitlines())
+
+    def test_histogram_buckets(self):
+        histogram = self.metrics.histogram('tello_rtt_seconds', 'Round trip time', buckets=(0.01, 0.1, 1))
+        for value in (0.005, 0.01, 0.05, 0.5, 5):
+            histogram.observe(value)
+        lines = self.scrape().splitlines()
+        self.assertIn('# TYPE tello_rtt_seconds histogram', lines)
+        buckets = [line for line in lines if line.startswith('tello_rtt_seconds_bucket')]
+        # Buckets are cumulative, le is inclusive and +Inf counts every observation
+        self.assertEqual(buckets, ['tello_rtt_seconds_bucket{le="0.01"} 2', 'tello_rtt_seconds_bucket{le="0.1"} 3',
+                                   'tello_rtt_seconds_bucket{le="1"} 4', 'tello_rtt_seconds_bucket{le="+Inf"} 5'])
+        self.assertIn('tello_rtt_seconds_count 5', lines)
+        sums = [line for line in lines if line.startswith('tello_rtt_seconds_sum ')]
+        self.assertAlmostEqual(float(sums[0].split()[1]), 5.565)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.scrape('/')
+        self.assertEqual(context.exception.code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
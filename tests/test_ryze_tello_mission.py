@@ -0,0 +1,81 @@
+'''
+Checks of mission expressions and dry run against TelloSimulator
+
+Usage: python -m unittest discover tests
+'''
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_mission
+
+
+class TestExpression(unittest.TestCase):
+
+    def test_allowed(self):
+        expression = ryze_tello_mission.TelloExpression('abs(wrap(yaw - target)) < 5 and h >= 100')
+        self.assertEqual(expression.fields, ('h', 'yaw'))
+        self.assertEqual(expression.variables, ('target',))
+        tello_state = ryze_tello.TelloState()
+        self.assertIsNone(expression.evaluate(tello_state, {'target': 90}))
+        tello_state.yaw, tello_state.h = -178, 120
+        self.assertTrue(expression.evaluate(tello_state, {'target': 180}))
+        expression.reset()
+        self.assertFalse(expression.evaluate(tello_state, {'target': 90}))
+
+    def test_rejected(self):
+        for text in ('bat.__class__', 'h.bit_length()', '__import__("os")', 'open("mission.json")',
+                     'round(h, ndigits=1)', '(lambda: 1)()', 'wrap.__globals__', '[h][0]', 'abs(h)(1)'):
+            with self.assertRaises(ValueError, msg=text):
+                ryze_tello_mission.TelloExpression(text)
+
+
+class TestDryRun(unittest.TestCase):
+
+    MISSION = {'abort': 'land',
+               'steps': [{'command': 'takeoff', 'until': 'h >= 50'},
+                         {'command': 'up 50', 'until': 'h >= 100', 'timeout': 5},
+                         {'set': {'start': 'bat'}, 'until': 'bat >= start'},
+                         {'command': 'land', 'until': 'h <= 10'}]}
+
+    def setUp(self):
+        ryze_tello.set_logging(False)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def load(self, mission):
+        filename = os.path.join(self.directory.name, 'mission.json')
+        with open(filename, 'w') as mission_file:
+            json.dump(mission, mission_file)
+        return ryze_tello_mission.load_mission(filename)
+
+    def test_estimate(self):
+        steps, abort_command = self.load(self.MISSION)
+        is_completed, results = ryze_tello_mission.dry_run(steps, abort_command)
+        self.assertTrue(is_completed)
+        self.assertEqual([result['status'] for result in results], ['done'] * 4)
+        # Seconds are of real flight at 100 cm/s: 50 cm, 50 cm, 0 cm and about 100 cm
+        seconds = [result['seconds'] for result in results]
+        self.assertGreater(seconds[0], 0.4)
+        self.assertGreater(seconds[1], 0.4)
+        self.assertLess(seconds[2], 0.5)
+        self.assertGreater(seconds[3], 0.9)
+        self.assertLess(sum(seconds), 6)
+
+    def test_timeout_aborts(self):
+        steps, abort_command = self.load([{'command': 'takeoff', 'until': 'h >= 1000', 'timeout': 1},
+                                          {'command': 'forward 100'}])
+        is_completed, results = ryze_tello_mission.dry_run(steps, abort_command)
+        self.assertFalse(is_completed)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['status'], 'timeout')
+        self.assertAlmostEqual(results[0]['seconds'], 1, delta=0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
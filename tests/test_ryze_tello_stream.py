@@ -0,0 +1,112 @@
+'''
+Checks of TelloPreTriggerBuffer and TelloStreamRecorder with generated access units
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_stream
+
+SPS = b'\x00\x00\x00\x01\x67\x64\x00\x28'
+PPS = b'\x00\x00\x00\x01\x68\xee\x3c\x80'
+
+
+def access_unit(sequence, completed_at, gop=10, size=100):
+    '''
+    Return TelloAccessUnit of a stream with IDR and parameter sets every gop pictures
+    '''
+    is_idr = sequence % gop == 0
+    nal_unit = b'\x00\x00\x00\x01' + (b'\x65' if is_idr else b'\x41') + sequence.to_bytes(4, 'big') * (size // 4)
+    data = SPS + PPS + nal_unit if is_idr else nal_unit
+    return ryze_tello.TelloAccessUnit(data, is_idr, is_idr, sequence % gop, completed_at, completed_at, sequence)
+
+
+class TestPreTriggerBuffer(unittest.TestCase):
+
+    def test_whole_gops_kept(self):
+        buffer = ryze_tello_stream.TelloPreTriggerBuffer(seconds=1)
+        # Stream starts in the middle of GOP, pictures before the first IDR are not kept
+        for sequence in range(5, 65):
+            buffer.append(access_unit(sequence, sequence * 0.1))
+        stats = buffer.get_stats()
+        self.assertEqual(stats['gops'], 2)
+        self.assertEqual(stats['access_units'], 15)
+        self.assertGreaterEqual(stats['seconds'], 1)
+        chunks = buffer.get_chunks()
+        self.assertTrue(chunks[0].startswith(SPS + PPS + b'\x00\x00\x00\x01\x65'))
+        self.assertEqual(buffer.get_data(), b''.join(chunks))
+
+    def test_byte_cap(self):
+        unit_size = len(access_unit(1, 0).data)
+        buffer = ryze_tello_stream.TelloPreTriggerBuffer(seconds=60, max_bytes=25 * unit_size)
+        for sequence in range(100):
+            buffer.append(access_unit(sequence, sequence * 0.1))
+            self.assertLessEqual(buffer.get_stats()['bytes'], 25 * unit_size)
+        stats = buffer.get_stats()
+        # The oldest GOPs are dropped whole, the buffer still starts with IDR
+        self.assertEqual((stats['gops'], stats['access_units']), (2, 20))
+        self.assertIn(b'\x00\x00\x00\x01\x65', buffer.get_chunks()[0])
+
+    def test_parameter_sets_before_idr_without_them(self):
+        buffer = ryze_tello_stream.TelloPreTriggerBuffer(seconds=1)
+        buffer.append(access_unit(0, 0))
+        unit = access_unit(10, 1)
+        buffer.append(ryze_tello.TelloAccessUnit(unit.data[len(SPS + PPS):], True, False, 0, 1, 1, 10))
+        buffer.append(access_unit(11, 2.5))
+        self.assertTrue(buffer.get_data().startswith(SPS + PPS + b'\x00\x00\x00\x01\x65'))
+
+
+class TestStreamRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        # Recorder writes to dir_video relative to working directory
+        os.chdir(self.directory.name)
+        ryze_tello.set_logging(False)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+        ryze_tello.set_logging(True)
+
+    def read_record(self, recorder):
+        with open(os.path.join('video', recorder.video_file_name), 'rb') as video_file:
+            return video_file.read()
+
+    def test_record_starts_with_pre_trigger(self):
+        recorder = ryze_tello_stream.TelloStreamRecorder(pre_trigger=1)
+        now = time.monotonic()
+        for sequence in range(5, 35):
+            recorder.write_access_unit(access_unit(sequence, now + sequence * 0.1 - 3.5))
+        pre_trigger = recorder.pre_trigger_buffer.get_data()
+        recorder.start_recording()
+        after = [access_unit(sequence, now + sequence * 0.1 - 3.5) for sequence in range(35, 40)]
+        for unit in after:
+            recorder.write_access_unit(unit)
+        recorder.stop_recording()
+        self.assertEqual(self.read_record(recorder), pre_trigger + b''.join(unit.data for unit in after))
+        self.assertEqual(recorder.get_stats()['pre_trigger_bytes'], len(pre_trigger))
+
+    def test_incident_extends_record(self):
+        recorder = ryze_tello_stream.TelloStreamRecorder(pre_trigger=1)
+        now = time.monotonic()
+        recorder.write_access_unit(access_unit(0, now))
+        recorder.capture_incident(1)
+        recorder.capture_incident(5)
+        recorder.write_access_unit(access_unit(1, now + 3))
+        self.assertTrue(recorder.is_recording)
+        recorder.write_access_unit(access_unit(2, now + 6))
+        self.assertFalse(recorder.is_recording)
+        self.assertEqual(recorder.get_stats()['access_units'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
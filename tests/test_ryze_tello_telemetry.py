@@ -0,0 +1,56 @@
+'''
+Checks of TelloStateHistory
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_telemetry
+
+
+class TestStateHistory(unittest.TestCase):
+
+    def test_window(self):
+        history = ryze_tello_telemetry.TelloStateHistory(10)
+        tello_state = ryze_tello.TelloState()
+        for index in range(25):
+            tello_state.bat = 100 - index
+            tello_state.timestamp = index * 0.1
+            history.append(tello_state)
+        self.assertEqual(len(history), 10)
+        self.assertEqual(list(history.window('bat', 0.25)), [78, 77, 76])
+        self.assertAlmostEqual(history.battery_drain_rate(), 600)
+
+    def test_queries_during_appends(self):
+        history = ryze_tello_telemetry.TelloStateHistory(50)
+        is_running = True
+
+        def append():
+            tello_state = ryze_tello.TelloState()
+            index = 0
+            while is_running:
+                tello_state.bat = index % 100
+                tello_state.timestamp = index * 0.1
+                history.append(tello_state)
+                index += 1
+
+        thread = threading.Thread(target=append)
+        thread.start()
+        try:
+            for _ in range(3000):
+                history.window('bat', 2)
+                history.rolling_mean('bat', 5, 3)
+                history.battery_drain_rate(3)
+        finally:
+            is_running = False
+            thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
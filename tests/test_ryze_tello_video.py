@@ -0,0 +1,156 @@
+'''
+Checks of TelloVideoReceiver reassembly and loss counting with generated H.264 stream
+streamed by TelloSimulator over loopback
+
+Usage: python -m unittest discover tests
+'''
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ryze_tello
+import ryze_tello_simulator
+
+try:
+    import av
+    import numpy
+except ImportError:
+    av = None
+
+_FRAMES = 40
+_GOP = 10
+
+
+def generate_h264(filename):
+    '''
+    Encode small H.264 elementary stream: IDR with SPS and PPS every 10 pictures, no B-frames,
+    every picture fits into one datagram
+    '''
+    with av.open(filename, 'w', format='h264') as container:
+        stream = container.add_stream('libx264', rate=30)
+        stream.width, stream.height, stream.pix_fmt = 64, 48, 'yuv420p'
+        stream.options = {'bf': '0', 'g': str(_GOP), 'keyint_min': str(_GOP), 'sc_threshold': '0',
+                          'x264-params': 'repeat-headers=1'}
+        for index in range(_FRAMES):
+            image = numpy.zeros((48, 64, 3), numpy.uint8)
+            image[:, index * 3 % 64] = 255
+            for packet in stream.encode(av.VideoFrame.from_ndarray(image, format='rgb24')):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+@unittest.skipIf(av is None, 'requires av and numpy')
+class TestVideoReceiver(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.filename = os.path.join(cls.directory.name, 'stream.h264')
+        generate_h264(cls.filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        ryze_tello.set_logging(False)
+        self.receiver = ryze_tello.TelloVideoReceiver(('127.0.0.1', 0), relay_address=None)
+        self.access_units = []
+        self.receiver.subscribe_access_units(self.access_units.append)
+        # Datagrams pass through relay socket of the test, which may drop one of them
+        self.drop_index = None
+        self.socket_relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_relay.bind(('127.0.0.1', 0))
+        self.socket_relay.settimeout(0.1)
+        self.is_running = True
+        self.thread_relay = threading.Thread(target=self.relay)
+        self.thread_relay.start()
+        self.simulator = ryze_tello_simulator.TelloSimulator(video_port=self.socket_relay.getsockname()[1],
+                                                             video_file=self.filename, frame_rate=200)
+
+    def tearDown(self):
+        self.simulator.close()
+        self.is_running = False
+        self.thread_relay.join()
+        self.socket_relay.close()
+        self.receiver.close()
+        ryze_tello.set_logging(True)
+
+    def relay(self):
+        index = 0
+        while self.is_running:
+            try:
+                datagram = self.socket_relay.recv(2048)
+            except socket.timeout:
+                continue
+            if index != self.drop_index:
+                self.socket_relay.sendto(datagram, self.receiver.socket_video.getsockname())
+            index += 1
+
+    def stream(self, access_units):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as socket_command:
+            socket_command.sendto(b'command', self.simulator.address)
+            socket_command.sendto(b'streamon', self.simulator.address)
+        wait_until = time.monotonic() + 10
+        while len(self.access_units) < access_units and time.monotonic() < wait_until:
+            time.sleep(0.01)
+        self.simulator.is_streaming = False
+
+    def test_reassembly(self):
+        self.stream(2 * _FRAMES)
+        access_units = self.access_units[:2 * _FRAMES]
+        self.assertEqual(len(access_units), 2 * _FRAMES)
+        # Stream is looped, it starts again with IDR
+        self.assertEqual([access_unit.is_idr for access_unit in access_units],
+                         [index % _GOP == 0 for index in range(2 * _FRAMES)])
+        self.assertTrue(all(access_unit.has_sps for access_unit in access_units if access_unit.is_idr))
+        self.assertEqual([access_unit.frame_num for access_unit in access_units[:_GOP]], list(range(_GOP)))
+        stats = self.receiver.get_stats()
+        self.assertEqual(stats['frames_lost'], 0)
+        self.assertEqual(stats['idr_frames'], sum(access_unit.is_idr for access_unit in self.access_units))
+
+    def test_lost_datagram(self):
+        # The 4th picture of the first GOP, P picture in one datagram
+        self.drop_index = 3
+        self.stream(_FRAMES)
+        self.assertEqual(self.receiver.get_stats()['frames_lost'], 1)
+        self.assertEqual([access_unit.frame_num for access_unit in self.access_units[:5]], [0, 1, 2, 4, 5])
+
+
+class TestH264Headers(unittest.TestCase):
+
+    def test_exp_golomb(self):
+        # ue: 1 -> 0, 010 -> 1, 011 -> 2, 00100 -> 3; se: 010 -> 1, 011 -> -1
+        reader = ryze_tello.H264BitReader(bytes([0b10100110, 0b01000100, 0b11000000]))
+        self.assertEqual([reader.ue() for _ in range(4)], [0, 1, 2, 3])
+        self.assertEqual([reader.se(), reader.se()], [1, -1])
+
+    @unittest.skipIf(av is None, 'requires av and numpy')
+    def test_sps_and_slice(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'stream.h264')
+            generate_h264(filename)
+            with open(filename, 'rb') as stream_file:
+                frames = ryze_tello_simulator.split_access_units(stream_file.read())
+        nal_units = {}
+        for index, frame in enumerate(frames[:3]):
+            for nal_unit in frame.split(b'\x00\x00\x01')[1:]:
+                nal_unit = nal_unit.rstrip(b'\x00')
+                nal_units.setdefault(nal_unit[0] & 0x1f, []).append(nal_unit)
+        log2_max_frame_num, separate_colour_plane = ryze_tello.parse_h264_sps(nal_units[7][0])
+        self.assertGreaterEqual(log2_max_frame_num, 4)
+        self.assertEqual(separate_colour_plane, 0)
+        self.assertEqual(ryze_tello.parse_h264_frame_num(nal_units[5][0], log2_max_frame_num), (0, 0))
+        self.assertEqual([ryze_tello.parse_h264_frame_num(nal_unit, log2_max_frame_num)
+                          for nal_unit in nal_units[1]], [(0, 1), (0, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
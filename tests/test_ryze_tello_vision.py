@@ -0,0 +1,112 @@
+'''
+Checks of TelloVisionStage scheduling with one spawned worker
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+import ryze_tello
+import ryze_tello_vision
+
+_ANALYSIS_TIME = 0.1 # sec
+
+
+def slow_analyzer(frame):
+    '''
+    Analyzer of workers, module level to be picklable: returns shape of the frame it was given
+    '''
+    time.sleep(_ANALYSIS_TIME)
+    return frame.shape
+
+
+def submit_for(vision_stage, duration, interval=0.01):
+    '''
+    Submit frames every interval sec for duration sec, return number of frames submitted
+    '''
+    frame = numpy.zeros((48, 64, 3), numpy.uint8)
+    frames = 0
+    stop_at = time.monotonic() + duration
+    while time.monotonic() < stop_at:
+        vision_stage.submit(frame)
+        frames += 1
+        time.sleep(interval)
+    return frames
+
+
+class TestVisionStage(unittest.TestCase):
+
+    def setUp(self):
+        ryze_tello.set_logging(False)
+        self.results = []
+        self.results_event = threading.Event()
+
+    def callback(self, result):
+        self.results.append(result)
+        self.results_event.set()
+
+    def start(self, **kwargs):
+        vision_stage = ryze_tello_vision.TelloVisionStage(slow_analyzer, self.callback, workers=1, **kwargs)
+        self.addCleanup(vision_stage.close)
+        # The first result comes after the worker was spawned
+        vision_stage.submit(numpy.zeros((48, 64, 3), numpy.uint8))
+        self.assertTrue(self.results_event.wait(30))
+        return vision_stage
+
+    def test_skip_while_busy(self):
+        vision_stage = self.start(min_scale=1)
+        frames = submit_for(vision_stage, 1)
+        stats = vision_stage.get_stats()
+        self.assertEqual(stats['submitted'] + stats['skipped'], frames + 1)
+        # One worker takes at most one frame per analysis time, the rest is skipped, not queued
+        self.assertLessEqual(stats['submitted'], 1 + 1 / _ANALYSIS_TIME + 1)
+        self.assertGreater(stats['skipped'], frames / 2)
+        self.assertLessEqual(stats['in_flight'], 1)
+        self.assertEqual(stats['errors'], 0)
+
+    def test_downscale_when_late(self):
+        vision_stage = self.start(target_latency=_ANALYSIS_TIME / 2, min_scale=0.5)
+        submit_for(vision_stage, 2)
+        time.sleep(2 * _ANALYSIS_TIME)
+        self.assertEqual(vision_stage.scale, 0.5)
+        self.assertGreater(vision_stage.get_stats()['late'], 0)
+        # Result values are of the frames downscaled for analysis
+        result = self.results[-1]
+        self.assertLess(result.scale, 1)
+        self.assertEqual(result.value, (round(48 * result.scale), round(64 * result.scale), 3))
+
+    def test_timestamp(self):
+        vision_stage = self.start(min_scale=1)
+        time.sleep(2 * _ANALYSIS_TIME)
+        self.results_event.clear()
+        timestamp = time.monotonic() - 1
+        sequence = vision_stage.submit(numpy.zeros((48, 64, 3), numpy.uint8), timestamp)
+        self.assertIsNotNone(sequence)
+        self.assertTrue(self.results_event.wait(5))
+        result = self.results[-1]
+        self.assertEqual(result.sequence, sequence)
+        self.assertEqual(result.timestamp, timestamp)
+        self.assertGreaterEqual(result.latency, 1 + _ANALYSIS_TIME)
+        self.assertGreaterEqual(result.analysis_time, _ANALYSIS_TIME)
+        self.assertIs(vision_stage.get_result(), result)
+
+    def test_callback_errors(self):
+        vision_stage = self.start(min_scale=1)
+        vision_stage.callback = lambda result: 1 / 0
+        submit_for(vision_stage, 0.5)
+        time.sleep(2 * _ANALYSIS_TIME)
+        stats = vision_stage.get_stats()
+        self.assertGreater(stats['callback_errors'], 1)
+        self.assertLessEqual(stats['callback_errors'], stats['completed'] - 1)
+        self.assertEqual(stats['errors'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()